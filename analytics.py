@@ -0,0 +1,281 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from db import get_db_connection, pools, use_database
+from logs import LogEvent
+from queries import PRODUCT_USAGE_SINCE
+from stock import run_write
+
+# 使用ペースを計算する期間（日）
+WINDOW_DAYS = 28
+# 発注のおすすめ数は「この日数分の使用量 + 発注点」まで在庫を戻す量にします
+COVER_DAYS = 7
+# 1回の集計トランザクションで読むログの件数（書き込みロックを長く持たないため）
+ROLLUP_BATCH_SIZE = 50_000
+# 日別集計を裏で更新する間隔（秒。0 なら更新しないので、flask rollup-usage を定期実行します）
+ROLLUP_INTERVAL = float(os.environ.get("PANTRY_ROLLUP_INTERVAL", "60"))
+
+# 使用量の集計に含めるログ種別
+CONSUMED_EVENTS = (LogEvent.DEPARTURE,)
+WASTED_EVENTS = (LogEvent.WASTE,)
+RECEIVED_EVENTS = (LogEvent.ARRIVAL, LogEvent.BULK_ARRIVAL)
+
+
+def _in(events):
+    return ", ".join(str(int(e)) for e in events)
+
+
+# 前回の続きのログだけを日別に集計し、既存の行に足し込みます
+# （created_at は UTC なので、日付も UTC の日付です。比べる側も utc_today() を使います）
+ROLLUP_UPSERT = f"""
+    INSERT INTO daily_product_usage (product_id, day, consumed, wasted, received)
+    SELECT product_id,
+           date(created_at),
+           SUM(CASE WHEN event IN ({_in(CONSUMED_EVENTS)}) THEN quantity ELSE 0 END),
+           SUM(CASE WHEN event IN ({_in(WASTED_EVENTS)}) THEN quantity ELSE 0 END),
+           SUM(CASE WHEN event IN ({_in(RECEIVED_EVENTS)}) THEN quantity ELSE 0 END)
+    FROM inventory_logs
+    WHERE id > ? AND id <= ?
+      AND event IN ({_in(CONSUMED_EVENTS + WASTED_EVENTS + RECEIVED_EVENTS)})
+    GROUP BY product_id, date(created_at)
+    ON CONFLICT (product_id, day) DO UPDATE SET
+        consumed = consumed + excluded.consumed,
+        wasted = wasted + excluded.wasted,
+        received = received + excluded.received
+"""
+
+
+def rollup_watermark(conn):
+    return conn.execute(
+        "SELECT last_log_id FROM usage_rollup_watermark WHERE id = 1"
+    ).fetchone()[0]
+
+
+def _rollup_batch(conn, batch_size):
+    """集計済みの位置から batch_size 件分を集計し、位置を進める（処理した件数を返す）"""
+    last_log_id = rollup_watermark(conn)
+    count, upper = conn.execute(
+        """
+        SELECT COUNT(*), MAX(id)
+        FROM (SELECT id FROM inventory_logs WHERE id > ? ORDER BY id LIMIT ?)
+        """,
+        (last_log_id, batch_size),
+    ).fetchone()
+    if not count:
+        return 0
+
+    # 書き込みロックを持っているので、upper より小さい id のログが後から増えることはありません
+    conn.execute(ROLLUP_UPSERT, (last_log_id, upper))
+    conn.execute(
+        """
+        UPDATE usage_rollup_watermark
+        SET last_log_id = ?, updated_at = CURRENT_TIMESTAMP
+        WHERE id = 1
+        """,
+        (upper,),
+    )
+    return count
+
+
+def refresh_rollups(batch_size=ROLLUP_BATCH_SIZE):
+    """前回から増えたログだけを日別集計に反映し、反映した件数を返す"""
+    # 新しいログがなければ、書き込みロックを取らずに終わります
+    with get_db_connection() as conn:
+        latest = conn.execute("SELECT COALESCE(MAX(id), 0) FROM inventory_logs").fetchone()[0]
+        if latest <= rollup_watermark(conn):
+            return 0
+
+    total = 0
+    while True:
+        count = run_write(_rollup_batch, batch_size)
+        if not count:
+            return total
+        total += count
+
+
+class RollupTicker:
+    """接続を開いている店舗の日別集計を、ROLLUP_INTERVAL 秒ごとに裏のスレッドで更新する
+
+    お買い物リストの画面は集計済みの表を読むだけにして、在庫の書き込みと
+    書き込みロックを取り合わないようにします（ワーカープロセスごとに1本です）。
+    """
+
+    def __init__(self, interval=ROLLUP_INTERVAL):
+        self.interval = interval
+        self._thread = None
+        self._lock = threading.Lock()
+        self.errors = 0
+
+    def ensure_started(self):
+        if self._thread is not None or self.interval <= 0:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="usage-rollup", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self.tick()
+            time.sleep(self.interval)
+
+    def tick(self):
+        for database in pools.databases():
+            try:
+                with use_database(database):
+                    refresh_rollups()
+            except sqlite3.Error:
+                # 次の回にやり直します（集計済みの位置は、コミットできた分だけ進んでいます）
+                self.errors += 1
+
+    def reset(self):
+        """fork 後の子プロセスでは、親のスレッドは動いていないので作り直す"""
+        self._thread = None
+        self._lock = threading.Lock()
+
+
+rollup_ticker = RollupTicker()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=rollup_ticker.reset)
+
+
+def utc_today():
+    return datetime.now(timezone.utc).date()
+
+
+def _forecast(row, window_days, cover_days):
+    consumed = row["consumed"] or 0
+    wasted = row["wasted"] or 0
+    stock = max(row["current_stock"] or 0, 0)
+    reorder_level = row["reorder_level"] or 0
+
+    # 在庫が減るペースは使用と廃棄の合計、発注の目安は実際に使った分だけで考えます
+    consumption_rate = consumed / window_days
+    depletion_rate = (consumed + wasted) / window_days
+    used = consumed + wasted
+
+    if depletion_rate > 0:
+        days_until_stockout = stock / depletion_rate
+    else:
+        days_until_stockout = None
+
+    target = consumption_rate * cover_days + reorder_level
+    suggested = max(math.ceil(target - stock), 0)
+
+    return {
+        "id": row["id"],
+        "name": row["name"],
+        "unit": row["unit"],
+        "current_stock": row["current_stock"],
+        "reorder_level": row["reorder_level"],
+        "consumed": consumed,
+        "wasted": wasted,
+        "received": row["received"] or 0,
+        "consumption_rate": consumption_rate,
+        "waste_ratio": wasted / used if used else None,
+        "days_until_stockout": days_until_stockout,
+        "suggested_quantity": suggested,
+    }
+
+
+def product_forecasts(conn, window_days=WINDOW_DAYS, cover_days=COVER_DAYS, today=None):
+    """直近 window_days 日の日別集計から、商品ごとの使用ペースと発注の目安を計算する
+
+    {商品ID: 予測の辞書} を返します。期間中に動きのなかった商品は含みません。
+    集計は裏のスレッドが更新するので、最大 ROLLUP_INTERVAL 秒ぶん遅れることがあります。
+    """
+    rollup_ticker.ensure_started()
+    today = today or utc_today()
+    since = (today - timedelta(days=window_days - 1)).isoformat()
+    rows = conn.execute(PRODUCT_USAGE_SINCE, (since,)).fetchall()
+    return {row["id"]: _forecast(row, window_days, cover_days) for row in rows}
+
+
+def suggested_quantity(item, forecast):
+    """お買い物リストの商品1つに対する、おすすめの入庫数（1以上の整数）"""
+    if forecast and forecast["suggested_quantity"] > 0:
+        return forecast["suggested_quantity"]
+    # 使用の記録がない商品は、発注点を1つ上回るところまで
+    reorder_level = item["reorder_level"] or 0
+    stock = max(item["current_stock"] or 0, 0)
+    return max(math.ceil(reorder_level - stock) + 1, 1)
+
+
+def running_out_soon(forecasts, exclude_ids, cover_days=COVER_DAYS):
+    """発注点はまだ割っていないが、cover_days 日以内になくなりそうな商品（早い順）"""
+    soon = [
+        f for f in forecasts.values()
+        if f["id"] not in exclude_ids
+        and f["days_until_stockout"] is not None
+        and f["days_until_stockout"] <= cover_days
+    ]
+    return sorted(soon, key=lambda f: f["days_until_stockout"])
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 店舗をまたぐ集計（tenants.fan_out で店舗ごとに実行して、merge_store_summaries でまとめます）
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+STORE_COUNTS = """
+    SELECT
+        (SELECT COUNT(*) FROM products WHERE is_active = 1) AS products,
+        (SELECT COUNT(*) FROM low_stock_products) AS low_stock,
+        (SELECT COUNT(*) FROM products WHERE is_active = 1 AND current_stock <= 0) AS out_of_stock
+"""
+
+
+def store_summary(window_days=WINDOW_DAYS, today=None):
+    """今の店舗の商品数・発注点割れの数と、直近 window_days 日の商品ごとの使用量"""
+    rollup_ticker.ensure_started()
+    today = today or utc_today()
+    since = (today - timedelta(days=window_days - 1)).isoformat()
+    with get_db_connection() as conn:
+        counts = conn.execute(STORE_COUNTS).fetchone()
+        usage = conn.execute(PRODUCT_USAGE_SINCE, (since,)).fetchall()
+
+    return {
+        "products": counts["products"],
+        "low_stock": counts["low_stock"],
+        "out_of_stock": counts["out_of_stock"],
+        "consumed": sum(row["consumed"] or 0 for row in usage),
+        "wasted": sum(row["wasted"] or 0 for row in usage),
+        "received": sum(row["received"] or 0 for row in usage),
+        # 商品 ID は店舗ごとに違うので、名前と単位で突き合わせます
+        "by_product": [
+            (row["name"], row["unit"], row["consumed"] or 0, row["wasted"] or 0) for row in usage
+        ],
+    }
+
+
+def merge_store_summaries(results, limit=20):
+    """店舗ごとの集計をまとめる
+
+    tenants.fan_out の結果 [(店舗名, store_summary の結果, エラー), ...] から、
+    店舗ごとの行・合計・全店舗で使用量の多い商品（limit 件）を返します。
+    """
+    stores = []
+    totals = {key: 0 for key in ("products", "low_stock", "out_of_stock", "consumed", "wasted", "received")}
+    products = {}
+
+    for store, summary, error in results:
+        if error is not None:
+            stores.append({"store": store, "error": str(error)})
+            continue
+        stores.append({"store": store, **{key: summary[key] for key in totals}})
+        for key in totals:
+            totals[key] += summary[key]
+        for name, unit, consumed, wasted in summary["by_product"]:
+            item = products.setdefault(
+                (name, unit), {"name": name, "unit": unit, "consumed": 0, "wasted": 0, "stores": 0}
+            )
+            item["consumed"] += consumed
+            item["wasted"] += wasted
+            item["stores"] += 1
+
+    top_products = sorted(products.values(), key=lambda p: p["consumed"], reverse=True)[:limit]
+    return {"stores": stores, "totals": totals, "top_products": top_products}
@@ -1,51 +1,169 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+# 起動にかかった時間を、アプリの読み込みから測ります（startup.IMPORT_STARTED）
+import startup
+
+from flask import Flask, Response, abort, render_template, request, redirect, url_for, flash, session, jsonify, send_from_directory
+import functools
+import os
 import sqlite3
-from contextlib import contextmanager
+import subprocess
+from contextlib import closing, nullcontext
+
+import click
+
+import analytics
+import archive
+import backup
+import cache
+import http_cache
+import images
+import live
+import perf
+import search
+import sync
+import templating
+import tenants
+import transfer
+import write_behind
+from db import current_database, current_pool, get_db_connection, pools
+from logs import (
+    INCOMING_EVENTS,
+    LOG_EVENTS,
+    LogEvent,
+    describe_log,
+    encode_details,
+    fetch_logs_page,
+    parse_cursor,
+    parse_filters,
+)
+from migrations import check_query_plans, run_migrations
+from stock import (
+    bulk_arrival,
+    change_stock,
+    mode_to_change,
+    parse_bulk_form,
+    parse_bulk_items,
+    parse_quantity,
+    run_write,
+    staff_exists,
+)
 
 app = Flask(__name__)
 app.secret_key = "pantry_key_nozomi"  # ← これを足してくださいまし！
-DATABASE = "pantry_track.db"
-
-@contextmanager
-def get_db_connection():
-    """データベース接続を管理するコンテキストマネージャー"""
-    conn = sqlite3.connect(DATABASE, timeout=10.0)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA journal_mode=WAL")
-    try:
-        yield conn
-    except Exception:
-        conn.rollback()
-        raise
-    else:
-        conn.commit()
-    finally:
-        conn.close()
+# 複数店舗（PANTRY_TENANTS_DIR）なら、ほかの処理より先にリクエストの店舗を決めます
+tenants.init_app(app)
+http_cache.init_app(app)
+perf.init_app(app)
+templating.init_app(app)
+app.jinja_env.globals["image_variants"] = images.image_variants
+app.jinja_env.globals["describe_log"] = describe_log
+app.jinja_env.globals["incoming_events"] = INCOMING_EVENTS
+
+# PANTRY_WRITE_BEHIND=1 なら、+1/-1 ボタンの書き込みをキューでまとめてコミットします
+app.config.setdefault("WRITE_BEHIND", os.environ.get("PANTRY_WRITE_BEHIND") == "1")
+
+# テンプレートは最初のリクエストではなく、起動時にまとめてコンパイルしておきます
+startup.run_step("templates", lambda: {"templates": templating.precompile_templates(app)})
+
+
+def create_app():
+    """起動の準備（マイグレーション・スキーマの確認・キャッシュ・接続）を済ませた app を返す
+
+    gunicorn --preload --workers 4 --worker-class gthread --threads 8 'app:create_app()'
+    なら、マスターで一度だけマイグレーションを流して温めてから、ワーカーを fork します
+    （くわしくは startup.py）。
+    """
+    startup.warm_up(app)
+    return app
+
+
+def current_staff_id():
+    # 「担当者を選ぶ」で選んだスタッフ（まだ選んでいなければ 1:マスター）
+    return session.get("staff_id", 1)
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 店舗（複数店舗のときだけ）
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+@app.route("/store")
+def choose_store():
+    if not tenants.enabled():
+        abort(404)
+    return render_template(
+        "choose_store.html",
+        stores=tenants.list_stores(),
+        selected=tenants.requested_store(),
+        by_subdomain=tenants.store_from_host(request.host) is not None,
+    )
+
+
+@app.route("/store/<store>", methods=["POST"])
+def select_store(store):
+    if not tenants.enabled():
+        abort(404)
+    try:
+        tenants.database_for(store)
+    except tenants.UnknownStore:
+        flash("その店舗は見つかりませんでした", "error")
+        return redirect(url_for("choose_store"))
+
+    # 担当者は店舗ごとに違うので、選び直してもらいます
+    if session.get("store") != store:
+        session.pop("staff_id", None)
+        session.pop("staff_name", None)
+    session["store"] = store
+    return redirect(url_for("index"))
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 担当者
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+@app.route("/staff")
+def choose_staff():
+    try:
+        with get_db_connection() as conn:
+            staffs = conn.execute("SELECT id, name, role FROM staffs ORDER BY id").fetchall()
+    except sqlite3.Error as e:
+        flash(f"データベースエラー: {str(e)}", "error")
+        staffs = []
+
+    return render_template("choose_staff.html", staffs=staffs)
+
+
+@app.route("/staff/<int:staff_id>", methods=["POST"])
+def select_staff(staff_id):
+    try:
+        with get_db_connection() as conn:
+            staff = conn.execute(
+                "SELECT id, name FROM staffs WHERE id = ?", (staff_id,)
+            ).fetchone()
+    except sqlite3.Error as e:
+        flash(f"データベースエラー: {str(e)}", "error")
+        return redirect(url_for("choose_staff"))
+
+    if not staff:
+        flash("スタッフが見つかりませんでした", "error")
+        return redirect(url_for("choose_staff"))
+
+    # これ以降の操作履歴は、このスタッフの記録として残ります
+    session["staff_id"] = staff["id"]
+    session["staff_name"] = staff["name"]
+    flash(f" {staff['name']} さんに切り替えました", "success")
+    return redirect(url_for("index"))
 
 
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 # index
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 @app.route("/")
+@http_cache.generation_etag
 def index():
     try:
         with get_db_connection() as conn:
             # 1. 在庫一覧を取得
-            query = """
-                SELECT p.*, c.name AS category_name
-                FROM products p
-                LEFT JOIN categories c ON p.category_id = c.id
-                WHERE p.is_active = 1
-                ORDER BY p.updated_at DESC
-            """
-            products = conn.execute(query).fetchall()
+            products = cache.active_products_recent(conn)
 
             # 2. お買い物が必要な商品の件数を数える
-            count_query = """
-                SELECT COUNT(*) FROM products 
-                WHERE is_active = 1 AND current_stock <= reorder_level
-            """
-            low_stock_count = conn.execute(count_query).fetchone()[0]
+            low_stock_count = cache.low_stock_count(conn)
 
         return render_template(
             "index.html", products=products, low_stock_count=low_stock_count
@@ -58,6 +176,19 @@ def index():
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 # 商品登録
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 商品・スタッフの書き込みも、在庫と同じく run_write（書き込みロック・非同期モードでは
+# 書き込み専用のスレッド）で行います
+def insert_product(conn, values):
+    conn.execute(
+        """
+        INSERT INTO products (name, category_id, origin, current_stock, unit, reorder_level, image_path, is_active)
+        VALUES (?, ?, ?, ?, ?, ?, ?, 1)
+        """,
+        values,
+    )
+    # 在庫一覧の検索にもすぐ出るよう、同じトランザクションで索引に入れます
+    search.sync_index(conn)
+
 
 @app.route("/add_product", methods=["GET", "POST"])
 def add_product():
@@ -68,17 +199,22 @@ def add_product():
         current_stock = float(request.form.get("current_stock", 0))
         unit = request.form["unit"]
         reorder_level = float(request.form.get("reorder_level", 1))
+
+        # 画像が選ばれていれば保存して、サイズ違いを作っておきます
+        image_path = None
+        image = request.files.get("image")
+        if image and image.filename:
+            try:
+                image_path = images.save_product_image(image)
+            except ValueError as e:
+                flash(str(e), "error")
+                return redirect(url_for("add_product"))
         
         try:
-            with get_db_connection() as conn:
-                conn.execute(
-                    """
-                    INSERT INTO products (name, category_id, origin, current_stock, unit, reorder_level, is_active)
-                    VALUES (?, ?, ?, ?, ?, ?, 1)
-                    """,
-                    (name, category_id, origin, current_stock, unit, reorder_level)
-                )
-
+            run_write(
+                insert_product,
+                (name, category_id, origin, current_stock, unit, reorder_level, image_path),
+            )
             flash(f' {name} を登録しました！', 'success')
             return redirect(url_for("manage_products"))
         
@@ -89,7 +225,7 @@ def add_product():
     # GETリクエスト時
     try:
         with get_db_connection() as conn:
-            categories = conn.execute("SELECT * FROM categories").fetchall()
+            categories = cache.categories(conn)
     except sqlite3.Error as e:
         flash(f'エラー: {str(e)}', 'error')
         categories = []
@@ -99,21 +235,25 @@ def add_product():
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 # 出庫
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+def tap_stock(product_id, delta, staff_id, event, quantity, floor=None):
+    # 書き込みが終わってから返すので、どちらでもリダイレクト後の画面には反映済みです
+    if app.config["WRITE_BEHIND"]:
+        return write_behind.change_stock(product_id, delta, staff_id, event, quantity, floor)
+    return change_stock(product_id, delta, staff_id, event, quantity, floor=floor)
+
+
 @app.route("/reduce/<int:product_id>", methods=["POST"])
 def reduce_stock(product_id):
     try:
-        with get_db_connection() as conn:
-            conn.execute(
-                "UPDATE products SET current_stock = MAX(0, current_stock - 1) WHERE id = ?",
-                (product_id,),
-            )
+        # 0 を下回らないように1つ減らします（0 のときは在庫もログも動きません）
+        product = tap_stock(product_id, -1.0, current_staff_id(), LogEvent.DEPARTURE, 1.0, floor=0)
 
-            conn.execute(
-                "INSERT INTO inventory_logs (product_id, staff_id, type, quantity) VALUES (?, ?, ?, ?)",
-                (product_id, 1, "出庫", 1.0),
-            )
-        
-        flash(" 在庫を1つ減らしました", "success")
+        if product is None:
+            flash("商品が見つかりませんでした", "error")
+        elif not product["applied"]:
+            flash("在庫がもう0なので、減らしませんでした", "error")
+        else:
+            flash(" 在庫を1つ減らしました", "success")
         
     except sqlite3.Error as e:
         flash(f"エラー: {str(e)}", "error")
@@ -127,16 +267,7 @@ def reduce_stock(product_id):
 @app.route("/add_stock/<int:product_id>", methods=["POST"])
 def add_stock(product_id):
     try:
-        with get_db_connection() as conn:
-            conn.execute(
-                "UPDATE products SET current_stock = current_stock + 1 WHERE id = ?",
-                (product_id,),
-            )
-
-            conn.execute(
-                "INSERT INTO inventory_logs (product_id, staff_id, type, quantity) VALUES (?, ?, ?, ?)",
-                (product_id, 1, "入庫", 1.0),
-            )
+        tap_stock(product_id, 1.0, current_staff_id(), LogEvent.ARRIVAL, 1.0)
         
         flash(" 在庫を1つ追加しました", "success")
         
@@ -150,12 +281,11 @@ def add_stock(product_id):
 # 廃棄
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 @app.route("/waste/select")
+@http_cache.generation_etag
 def waste_select():
     try:
         with get_db_connection() as conn:
-            products = conn.execute(
-                "SELECT * FROM products WHERE is_active = 1 ORDER BY name"
-            ).fetchall()
+            products = cache.active_products_by_name(conn)
         
         return render_template(
             "choose_product.html",
@@ -186,7 +316,7 @@ def edit_product(product_id):
             product = conn.execute(
                 "SELECT * FROM products WHERE id = ?", (product_id,)
             ).fetchone()
-            categories = conn.execute("SELECT * FROM categories").fetchall()
+            categories = cache.categories(conn)
 
         if not product:
             flash("商品が見つかりませんでした", "error")
@@ -198,6 +328,29 @@ def edit_product(product_id):
         flash(f"データベースエラー: {str(e)}", "error")
         return redirect(url_for("manage_products"))
 
+def update_product_row(conn, product_id, values, staff_id, log_details):
+    # データベースの情報を書き換える（Update）
+    conn.execute(
+        """
+        UPDATE products
+        SET name = ?, origin = ?, category_id = ?, current_stock = ?, reorder_level = ?, unit = ?,
+            image_path = COALESCE(?, image_path)
+        WHERE id = ?
+        """,
+        (*values, product_id),
+    )
+    # 名前が変わっていれば、検索の索引も同じトランザクションで書き換えます
+    search.sync_index(conn)
+
+    conn.execute(
+        """
+        INSERT INTO inventory_logs (product_id, staff_id, event, details, quantity)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        (product_id, staff_id, LogEvent.PRODUCT_EDITED, log_details, 0),
+    )
+
+
 @app.route("/update_product/<int:product_id>", methods=["POST"])
 def update_product(product_id):
     # 1. 画面から送られてきたデータを受け取る
@@ -208,28 +361,30 @@ def update_product(product_id):
     reorder_level = request.form["reorder_level"]
     unit = request.form["unit"]
 
-    try:
-        with get_db_connection() as conn:
-            # 2. データベースの情報を書き換える（Update）
-            conn.execute(
-                """
-                UPDATE products 
-                SET name = ?, origin = ?, category_id = ?, current_stock = ?, reorder_level = ?, unit = ?
-                WHERE id = ?
-                """,
-                (name, origin, category_id, current_stock, reorder_level, unit, product_id),
-            )
-
-            # 3. ログを詳しく記録する
-            log_details = (
-                f"修正完了 [名前:{name} / 在庫:{current_stock}{unit} / 発注点:{reorder_level}]"
-            )
+    # 新しい画像が選ばれたときだけ差し替えます
+    image = request.files.get("image")
+    if image and image.filename:
+        try:
+            image_path = images.save_product_image(image)
+        except ValueError as e:
+            flash(str(e), "error")
+            return redirect(url_for("edit_product", product_id=product_id))
+    else:
+        image_path = None
 
-            conn.execute(
-                "INSERT INTO inventory_logs (product_id, staff_id, type, quantity) VALUES (?, ?, ?, ?)",
-                (product_id, 1, log_details, 0),
-            )
+    # ログには変更後の内容を details に JSON で残します
+    log_details = encode_details(
+        {"name": name, "stock": current_stock, "unit": unit, "reorder_level": reorder_level}
+    )
 
+    try:
+        run_write(
+            update_product_row,
+            product_id,
+            (name, origin, category_id, current_stock, reorder_level, unit, image_path),
+            current_staff_id(),
+            log_details,
+        )
         flash(f" {name} を更新しました", "success")
         
     except sqlite3.Error as e:
@@ -238,19 +393,21 @@ def update_product(product_id):
     return redirect(url_for("index"))
 
 
+def deactivate_product(conn, product_id, staff_id):
+    # 1. 論理削除：is_active を 0 に更新（一覧に出なくする）
+    conn.execute("UPDATE products SET is_active = 0 WHERE id = ?", (product_id,))
+
+    # 2. 削除したことをログに記録する
+    conn.execute(
+        "INSERT INTO inventory_logs (product_id, staff_id, event, quantity) VALUES (?, ?, ?, ?)",
+        (product_id, staff_id, LogEvent.PRODUCT_DELETED, 0),
+    )
+
+
 @app.route("/delete_product/<int:product_id>", methods=["POST"])
 def delete_product(product_id):
     try:
-        with get_db_connection() as conn:
-            # 1. 論理削除：is_active を 0 に更新（一覧に出なくする）
-            conn.execute("UPDATE products SET is_active = 0 WHERE id = ?", (product_id,))
-
-            # 2. 削除したことをログに記録する
-            conn.execute(
-                "INSERT INTO inventory_logs (product_id, staff_id, type, quantity) VALUES (?, ?, ?, ?)",
-                (product_id, 1, "商品削除", 0),
-            )
-
+        run_write(deactivate_product, product_id, current_staff_id())
         flash(" 商品を削除しました", "success")
         
     except sqlite3.Error as e:
@@ -263,52 +420,118 @@ def delete_product(product_id):
 @app.route("/shopping_list")
 def shopping_list():
     try:
+        # 日別集計（裏のスレッドが更新します）をもとに発注数を提案します
         with get_db_connection() as conn:
-            query = """
-                SELECT p.*, c.name AS category_name
-                FROM products p
-                LEFT JOIN categories c ON p.category_id = c.id
-                WHERE p.is_active = 1 AND p.current_stock <= p.reorder_level
-            """
-            items = conn.execute(query).fetchall()
+            items = cache.low_stock_items(conn)
+            forecasts = analytics.product_forecasts(conn)
+
+        suggestions = {
+            item["id"]: analytics.suggested_quantity(item, forecasts.get(item["id"]))
+            for item in items
+        }
+        soon = analytics.running_out_soon(forecasts, suggestions)
         
-        return render_template("shopping_list.html", items=items)
+        return render_template(
+            "shopping_list.html",
+            items=items,
+            forecasts=forecasts,
+            suggestions=suggestions,
+            soon=soon,
+        )
         
     except sqlite3.Error as e:
         flash(f"データベースエラー: {str(e)}", "error")
-        return render_template("shopping_list.html", items=[])
+        return render_template(
+            "shopping_list.html", items=[], forecasts={}, suggestions={}, soon=[]
+        )
 
     # ログ
 
 
+def logs_next_url(next_cursor):
+    """絞り込み条件を引き継いだ「続きを読み込む」URL"""
+    if not next_cursor:
+        return None
+    args = {key: value for key, value in request.args.items() if key != "cursor" and value}
+    return url_for("view_logs_rows", cursor=next_cursor, **args)
+
+
+def fetch_logs_for(month, filters, cursor=None):
+    # 保管ファイルに移した月は、その月のファイルから読みます（読み取り専用）
+    if month:
+        with closing(archive.open_archive(month)) as conn:
+            return fetch_logs_page(conn, filters, cursor)
+    with get_db_connection() as conn:
+        return fetch_logs_page(conn, filters, cursor)
+
+
 @app.route("/logs")
 def view_logs():
+    # 全件ではなく、新しい順に1ページ分だけ表示します（続きは無限スクロール）
+    try:
+        filters = parse_filters(request.args)
+    except ValueError:
+        flash("絞り込み条件が正しくありません", "error")
+        filters = {}
+    month = request.args.get("month", "")
+
+    try:
+        logs, next_cursor = fetch_logs_for(month, filters)
+    except (ValueError, FileNotFoundError):
+        flash("その月の記録は見つかりませんでした", "error")
+        logs, next_cursor = [], None
+    except sqlite3.Error as e:
+        flash(f"データベースエラー: {str(e)}", "error")
+        logs, next_cursor = [], None
+
     try:
         with get_db_connection() as conn:
-            query = """
-                SELECT l.*, p.name AS product_name, s.name AS staff_name
-                FROM inventory_logs l
-                JOIN products p ON l.product_id = p.id
-                JOIN staffs s ON l.staff_id = s.id
-                ORDER BY l.created_at DESC
-            """
-            logs = conn.execute(query).fetchall()
-        
-        return render_template("logs.html", logs=logs)
-        
+            products = conn.execute("SELECT id, name FROM products ORDER BY name").fetchall()
+            staffs = conn.execute("SELECT id, name FROM staffs ORDER BY id").fetchall()
     except sqlite3.Error as e:
         flash(f"データベースエラー: {str(e)}", "error")
-        return render_template("logs.html", logs=[])
+        products, staffs = [], []
+
+    return render_template(
+        "logs.html",
+        logs=logs,
+        next_url=logs_next_url(next_cursor),
+        filters=request.args,
+        products=products,
+        staffs=staffs,
+        log_events=LOG_EVENTS,
+        archived_months=archive.archived_months(),
+    )
+
+
+# 操作履歴の続き（無限スクロール用の行だけのHTML）
+@app.route("/logs/rows")
+def view_logs_rows():
+    try:
+        filters = parse_filters(request.args)
+        cursor = parse_cursor(request.args.get("cursor"))
+    except ValueError:
+        return "絞り込み条件が正しくありません", 400
+
+    try:
+        logs, next_cursor = fetch_logs_for(request.args.get("month", ""), filters, cursor)
+    except (ValueError, FileNotFoundError):
+        return "その月の記録は見つかりませんでした", 404
+    except sqlite3.Error as e:
+        return f"データベースエラー: {str(e)}", 500
+
+    return render_template(
+        "fragments/log_rows.html", logs=logs, next_url=logs_next_url(next_cursor)
+    )
 
 
 # --- 入庫（買ってきた） ---
 @app.route("/arrival/select")
+@http_cache.generation_etag
 def arrival_select():
     try:
         with get_db_connection() as conn:
-            products = conn.execute(
-                "SELECT * FROM products WHERE is_active = 1 ORDER BY name"
-            ).fetchall()
+            products = cache.active_products_by_name(conn)
         
         return render_template(
             "choose_product.html",
@@ -331,12 +554,11 @@ def arrival_select():
 
 # --- 出庫（使い切った） ---
 @app.route("/departure/select")
+@http_cache.generation_etag
 def departure_select():
     try:
         with get_db_connection() as conn:
-            products = conn.execute(
-                "SELECT * FROM products WHERE is_active = 1 ORDER BY name"
-            ).fetchall()
+            products = cache.active_products_by_name(conn)
         
         return render_template(
             "choose_product.html",
@@ -386,6 +608,7 @@ def entry_quantity(mode, product_id):
             mode=mode,
             title=title,
             bg_color=bg_color,
+            event_label=mode_to_change(mode)[1].label,
         )
         
     except sqlite3.Error as e:
@@ -395,62 +618,34 @@ def entry_quantity(mode, product_id):
 
 @app.route("/<mode>/execute/<int:product_id>", methods=["POST"])
 def execute_stock_update(mode, product_id):
-    quantity = float(request.form.get("quantity", 0))
-    current_staff_id = session.get("staff_id", 1)
+    try:
+        quantity = parse_quantity(request.form.get("quantity", 0))
+    except ValueError:
+        quantity = 0
+    if not quantity > 0:
+        flash("数量は0より大きい数で入力してください", "error")
+        return redirect(url_for("entry_quantity", mode=mode, product_id=product_id))
+    staff_id = current_staff_id()
     
+    sign, event = mode_to_change(mode)
+
     try:
-        with get_db_connection() as conn:
-            # 現在の在庫と発注点を取得
-            product = conn.execute(
-                "SELECT name, current_stock, reorder_level FROM products WHERE id = ?",
-                (product_id,),
-            ).fetchone()
+        # 読み取り→計算→書き込みではなく、1つのUPDATEで在庫を増減します
+        product = change_stock(product_id, sign * quantity, staff_id, event, quantity)
 
-            if not product:
-                flash("商品が見つかりませんでした", "error")
-                return redirect(url_for(f"{mode}_select"))
-
-            # 在庫を計算
-            if mode == "arrival":
-                new_stock = product["current_stock"] + quantity
-                log_type = "入庫"
-            elif mode == "waste":
-                new_stock = product["current_stock"] - quantity
-                log_type = "廃棄"
-            else:  # departure
-                new_stock = product["current_stock"] - quantity
-                log_type = "出庫"
-                
-                # 発注点を下回ったら警告
-                if new_stock <= product["reorder_level"]:
-                    flash(
-                        f"「{product['name']}」の在庫が残りわずかです。お買い物リストに追加しました！"
-                    )
-
-            # 在庫を更新
-            conn.execute(
-                """
-                UPDATE products 
-                SET current_stock = ?, 
-                    updated_at = CURRENT_TIMESTAMP, 
-                    touch_count = touch_count + 1
-                WHERE id = ?
-                """, 
-                (new_stock, product_id)
-            )
+        if not product:
+            flash("商品が見つかりませんでした", "error")
+            return redirect(url_for(f"{mode}_select"))
 
-            # ログに記録
-            conn.execute(
-                """
-                INSERT INTO inventory_logs (product_id, staff_id, type, quantity) 
-                VALUES (?, ?, ?, ?)
-                """,
-                (product_id, current_staff_id, log_type, quantity),
+        # 発注点をまたいだときだけお知らせします（下回ったまま減った場合は出しません）
+        if product["crossed_low"]:
+            flash(
+                f"「{product['name']}」の在庫が残りわずかです。お買い物リストに追加しました！"
             )
-            
-            #  with文を抜けるときに自動commit
+        elif product["recovered"]:
+            flash(f"「{product['name']}」をお買い物リストから外しました", "success")
 
-        flash(f" {product['name']} を {quantity} 個 {log_type} しました！", "success")
+        flash(f" {product['name']} を {quantity} 個 {event.label} しました！", "success")
         return redirect(url_for(f"{mode}_select"))
         
     except sqlite3.Error as e:
@@ -464,50 +659,16 @@ def execute_bulk_arrival():
     # フォームから送られてきたすべてのデータを取り出します
     form_data = request.form
 
-    # セッションからスタッフIDを取得（いなければ1:マスター）
-    current_staff_id = session.get("staff_id", 1)
-
     try:
-        with get_db_connection() as conn:
-            # 送られてきたデータの中から「qty_商品ID」という名前のものを探してループします
-            for key, value in form_data.items():
-                if key.startswith("qty_"):
-                    # 名前から商品IDを取り出します（例: 'qty_5' -> 5）
-                    product_id = int(key.replace("qty_", ""))
-                    quantity = float(value) if value else 0
-
-                    if quantity > 0:
-                        # 1. 現在の在庫を調べて、新しい在庫を計算します
-                        product = conn.execute(
-                            "SELECT current_stock FROM products WHERE id = ?", (product_id,)
-                        ).fetchone()
-                        
-                        if product:
-                            new_stock = product["current_stock"] + quantity
-
-                            # 2. 在庫（productsテーブル）を更新
-                            conn.execute(
-                                """
-                                UPDATE products 
-                                SET current_stock = ?, 
-                                    updated_at = CURRENT_TIMESTAMP,
-                                    touch_count = touch_count + 1
-                                WHERE id = ?
-                                """,
-                                (new_stock, product_id),
-                            )
-
-                            # 3. 履歴（inventory_logsテーブル）に記録
-                            conn.execute(
-                                """
-                                INSERT INTO inventory_logs (product_id, staff_id, type, quantity) 
-                                VALUES (?, ?, ?, ?)
-                                """,
-                                (product_id, current_staff_id, "一括入庫", quantity),
-                            )
+        # フォーム全体を先に読み取り、1つのトランザクションでまとめて入庫します
+        quantities = parse_bulk_form(form_data)
+        bulk_arrival(quantities, current_staff_id())
 
         flash(" 一括入庫が完了しました", "success")
-        
+
+    except ValueError:
+        flash("数量の入力が正しくありません", "error")
+
     except sqlite3.Error as e:
         flash(f"エラー: {str(e)}", "error")
 
@@ -515,21 +676,168 @@ def execute_bulk_arrival():
     return redirect(url_for("index"))
 
 
+# ハンディスキャナーなどから納品分をまとめて送るためのJSON版
+@app.route("/api/bulk_arrival", methods=["POST"])
+def api_bulk_arrival():
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify(error="JSONで送信してください"), 400
+
+    try:
+        staff_id = int(payload.get("staff_id", current_staff_id()))
+    except (TypeError, ValueError):
+        return jsonify(error="staff_id が正しくありません"), 400
+
+    try:
+        quantities = parse_bulk_items(payload.get("items"))
+    except (KeyError, TypeError, ValueError):
+        return jsonify(error="items の形式が正しくありません"), 400
+
+    try:
+        # 画面から選ぶときと同じく、登録されていないスタッフの記録は残しません
+        with get_db_connection() as conn:
+            if not staff_exists(conn, staff_id):
+                return jsonify(error="スタッフが見つかりませんでした"), 400
+        applied, missing = bulk_arrival(quantities, staff_id)
+    except sqlite3.Error as e:
+        return jsonify(error=f"データベースエラー: {str(e)}"), 500
+
+    return jsonify(applied=applied, missing=missing)
+
+
+# タブレットが電波の切れている間に積んでおいた操作をまとめて反映する（static/js/sync_queue.js）
+@app.route("/api/sync", methods=["POST"])
+def api_sync():
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify(error="JSONで送信してください"), 400
+
+    # 別の店舗で積んだ操作は、その店舗を選び直してから送ってもらいます
+    store = payload.get("store") or None
+    if store != tenants.current_store():
+        return jsonify(error="店舗が違います", store=tenants.current_store()), 409
+
+    try:
+        ops = sync.parse_sync_ops(payload.get("ops"), current_staff_id())
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    try:
+        result = run_write(sync.apply_sync_ops, ops)
+    except sqlite3.Error as e:
+        return jsonify(error=f"データベースエラー: {str(e)}"), 500
+
+    return jsonify(result)
+
+
+# Service Worker はサイト全体を受け持つので、/static/ ではなくルートから配ります
+@app.route("/sw.js")
+def service_worker():
+    response = send_from_directory(os.path.join(app.static_folder, "js"), "sw.js", max_age=0)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+# 電波がなく、まだ一度も開いていない画面を開いたときに Service Worker が見せる画面
+@app.route("/offline")
+def offline():
+    return render_template("offline.html")
+
+
 @app.route("/stock_list")
+@http_cache.generation_etag
 def stock_list():
+    # 1ページ目だけを表示し、検索・絞り込み・続きは /stock_list/items から読み込みます
+    try:
+        filters = search.parse_stock_filters(request.args)
+    except ValueError:
+        flash("絞り込み条件が正しくありません", "error")
+        filters = search.parse_stock_filters({})
+
     try:
+        if "q" in filters:
+            # 直接編集された商品名があれば、探す前に索引へ反映します（なければ読むだけです）
+            search.refresh_index()
         with get_db_connection() as conn:
-            # 商品一覧を取得
-            products = conn.execute("SELECT * FROM products WHERE is_active = 1").fetchall()
-            # カテゴリ一覧をデータベースから取得（←ここを追加しますわ）
-            categories = conn.execute("SELECT * FROM categories").fetchall()
-        
-        # テンプレートに categories も渡します
-        return render_template("stock_list.html", products=products, categories=categories)
-        
+            products, next_offset, fuzzy = search.fetch_stock_page(conn, filters)
+            categories = cache.categories(conn)
     except sqlite3.Error as e:
         flash(f"データベースエラー: {str(e)}", "error")
-        return render_template("stock_list.html", products=[], categories=[])
+        products, next_offset, fuzzy, categories = [], None, False, []
+
+    return render_template(
+        "stock_list.html",
+        products=products,
+        categories=categories,
+        filters=filters,
+        fuzzy=fuzzy,
+        filtered=len(filters) > 1,
+        first_page=True,
+        next_url=stock_items_next_url(next_offset),
+    )
+
+
+def stock_items_next_url(next_offset):
+    """検索・絞り込みの条件を引き継いだ「続きを読み込む」URL"""
+    if next_offset is None:
+        return None
+    args = {key: value for key, value in request.args.items() if key != "offset" and value}
+    return url_for("stock_list_items", offset=next_offset, **args)
+
+
+# 在庫一覧の検索（商品カードだけのHTML。?format=json なら JSON）
+@app.route("/stock_list/items")
+def stock_list_items():
+    try:
+        filters = search.parse_stock_filters(request.args)
+        offset = search.parse_offset(request.args.get("offset"))
+    except ValueError:
+        return "絞り込み条件が正しくありません", 400
+
+    try:
+        if "q" in filters:
+            search.refresh_index()
+        with get_db_connection() as conn:
+            products, next_offset, fuzzy = search.fetch_stock_page(conn, filters, offset)
+    except sqlite3.Error as e:
+        return f"データベースエラー: {str(e)}", 500
+
+    next_url = stock_items_next_url(next_offset)
+    if request.args.get("format") == "json":
+        return jsonify(
+            products=[search.product_json(p) for p in products],
+            fuzzy=fuzzy,
+            next_offset=next_offset,
+            next_url=next_url,
+        )
+    return render_template(
+        "fragments/stock_items.html",
+        products=products,
+        fuzzy=fuzzy,
+        filters=filters,
+        filtered=len(filters) > 1,
+        first_page=offset == 0,
+        next_url=next_url,
+    )
+
+# 在庫の変更をタブレットに送り続けるルート（Server-Sent Events）
+# 1接続がずっとつながったままなので、gunicorn は --worker-class gthread --threads N
+# のようにスレッド付きのワーカーで動かしてください
+# （非同期モードの asgi.py では、このルートの代わりに live.async_event_stream が使われます）
+@app.route("/events")
+def events():
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+
+    return Response(
+        live.event_stream(last_event_id, database=current_database()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 
 @app.route("/admin")
 def admin_menu():
@@ -542,14 +850,7 @@ def admin_menu():
 def manage_products():
     try:
         with get_db_connection() as conn:
-            query = """
-                SELECT p.*, c.name AS category_name
-                FROM products p
-                LEFT JOIN categories c ON p.category_id = c.id
-                WHERE p.is_active = 1
-                ORDER BY p.category_id, p.name
-            """
-            products = conn.execute(query).fetchall()
+            products = cache.active_products_by_category(conn)
         
         return render_template("manage_products.html", products=products)
         
@@ -566,9 +867,9 @@ def add_staff():
         role = request.form.get("role", "staff")
 
         try:
-            with get_db_connection() as conn:
-                conn.execute("INSERT INTO staffs (name, role) VALUES (?, ?)", (name, role))
-            
+            run_write(
+                lambda conn: conn.execute("INSERT INTO staffs (name, role) VALUES (?, ?)", (name, role))
+            )
             flash(f' {name} さんを登録しました！', 'success')
             return redirect(url_for("admin_menu"))
             
@@ -579,6 +880,109 @@ def add_staff():
     return render_template("add_staff.html")
 
 
+# --- ヘルスチェック ---
+@app.route("/healthz")
+def healthz():
+    # プロセスが応答できるかだけを返します（データベースは見ません）
+    return jsonify({"status": "ok"})
+
+
+@app.route("/readyz")
+def readyz():
+    # ウォームアップが済んでいれば 200、失敗した・まだなら 503。ここでは結果を返すだけで待ちません。
+    # app:app で起動したとき（create_app() を通っていないとき）は、最初の呼び出しで裏で温め始めます
+    state = startup.state
+    if state.warmed_pid is None:
+        startup.warm_up_in_background(app)
+    if state.ready:
+        status = "ready"
+    elif state.warmed_pid is None:
+        status = "starting"
+    else:
+        status = "error"
+    report = {"status": status, "pid": os.getpid(), **state.report()}
+    if state.lazy:
+        report["warning"] = "app:create_app() で起動すると、最初のリクエストより前に準備できます"
+    return jsonify(report), 200 if state.ready else 503
+
+
+# --- DB接続プールの状況 ---
+@app.route("/admin/db_pool")
+def db_pool_stats():
+    # 接続待ち時間・使用中の接続数をJSONで返します（複数店舗なら、今の店舗の分と開いている店舗の数）
+    return jsonify({**current_pool().stats(), "stores": pools.stats()})
+
+
+# --- 読み取りキャッシュの状況 ---
+@app.route("/admin/cache_stats")
+def cache_stats():
+    # ヒット・ミスの回数をJSONで返します（cards は商品カードの描画結果のキャッシュ）
+    return jsonify({**cache.read_cache.stats(), "cards": templating.card_cache.stats()})
+
+
+# --- まとめ書き込みキューの状況 ---
+@app.route("/admin/write_behind")
+def write_behind_stats():
+    # タップ数・コミット数・1回あたりの件数をJSONで返します
+    return jsonify(enabled=app.config["WRITE_BEHIND"], **write_behind.queue.stats())
+
+
+# --- 使用ペースと在庫切れの見込み ---
+@app.route("/admin/analytics")
+def usage_analytics():
+    try:
+        with get_db_connection() as conn:
+            forecasts = analytics.product_forecasts(conn)
+    except sqlite3.Error as e:
+        flash(f"データベースエラー: {str(e)}", "error")
+        forecasts = {}
+
+    # なくなるのが早い順（使っていない商品は最後）に並べます
+    rows = sorted(
+        forecasts.values(),
+        key=lambda f: (f["days_until_stockout"] is None, f["days_until_stockout"] or 0),
+    )
+    return render_template(
+        "admin_analytics.html",
+        forecasts=rows[:200],
+        total=len(rows),
+        window_days=analytics.WINDOW_DAYS,
+        cover_days=analytics.COVER_DAYS,
+    )
+
+
+# --- 店舗をまたぐ集計（複数店舗のときだけ） ---
+@app.route("/admin/stores")
+def stores_report():
+    if not tenants.enabled():
+        abort(404)
+    # 店舗ごとのデータベースを並行して読み、結果をまとめます
+    results = tenants.fan_out(analytics.store_summary)
+    report = analytics.merge_store_summaries(results)
+    if request.args.get("format") == "json":
+        return jsonify(report)
+    return render_template("admin_stores.html", report=report, window_days=analytics.WINDOW_DAYS)
+
+
+# --- SQL・テンプレートの計測結果 ---
+@app.route("/admin/perf")
+def perf_report():
+    # PANTRY_PROFILE=1 で起動したときだけ集計されます（?format=json でJSON）
+    report = perf.profiler.snapshot()
+    if request.args.get("format") == "json":
+        return jsonify(enabled=app.config["PERF_PROFILING"], **report)
+    return render_template(
+        "admin_perf.html", enabled=app.config["PERF_PROFILING"], report=report
+    )
+
+
+@app.route("/admin/perf/reset", methods=["POST"])
+def perf_reset():
+    perf.profiler.reset()
+    flash("計測結果をリセットしました", "success")
+    return redirect(url_for("perf_report"))
+
+
 # --- スタッフ管理 ---
 @app.route("/admin/manage_staffs")
 def manage_staffs():
@@ -597,5 +1001,335 @@ def manage_categories():
     return "カテゴリ管理画面（準備中）"
 
 
+# --- 商品のまとめて取り込み（CSV / Excel） ---
+@app.route("/admin/import_products", methods=["GET", "POST"])
+def import_products():
+    if request.method == "GET":
+        return render_template("import_products.html", report=None, token=None)
+
+    # まずは取り込まずに、取り込んだらどうなるかを確認してもらいます
+    upload = request.files.get("file")
+    if not upload or not upload.filename:
+        flash("ファイルを選んでください", "error")
+        return redirect(url_for("import_products"))
+
+    try:
+        token = transfer.save_upload(upload)
+        report = transfer.import_products(
+            transfer.upload_path(token), current_staff_id(), dry_run=True
+        )
+    except ValueError as e:
+        flash(str(e), "error")
+        return redirect(url_for("import_products"))
+    except sqlite3.Error as e:
+        flash(f"データベースエラー: {str(e)}", "error")
+        return redirect(url_for("import_products"))
+
+    if report.error_count:
+        transfer.discard_upload(token)
+        token = None
+    return render_template(
+        "import_products.html", report=report, token=token, filename=upload.filename
+    )
+
+
+@app.route("/admin/import_products/<token>", methods=["POST"])
+def apply_product_import(token):
+    try:
+        report = transfer.import_products(
+            transfer.upload_path(token), current_staff_id(), dry_run=False
+        )
+    except FileNotFoundError:
+        flash("確認したファイルが見つかりません。もう一度選んでください", "error")
+        return redirect(url_for("import_products"))
+    except ValueError as e:
+        flash(str(e), "error")
+        return redirect(url_for("import_products"))
+    except sqlite3.Error as e:
+        flash(f"データベースエラー: {str(e)}", "error")
+        return redirect(url_for("import_products"))
+
+    if report.error_count:
+        # 確認のあとで商品が変わったなどで失敗したときは、何も取り込まれていません
+        return render_template("import_products.html", report=report, token=None, filename=None)
+
+    transfer.discard_upload(token)
+    flash(
+        f" {report.inserted} 件を追加、{report.updated} 件を更新しました",
+        "success",
+    )
+    return redirect(url_for("manage_products"))
+
+
+# --- 書き出し（CSV） ---
+# 1,000 行ずつ読みながら送るので、件数が多くてもメモリに溜めません
+@app.route("/admin/export/products.csv")
+def export_products():
+    return Response(
+        transfer.export_products(),
+        mimetype="text/csv",
+        headers={"Content-Disposition": "attachment; filename=products.csv"},
+    )
+
+
+@app.route("/admin/export/logs.csv")
+def export_logs():
+    try:
+        filters = parse_filters(request.args)
+    except ValueError:
+        return "絞り込み条件が正しくありません", 400
+
+    return Response(
+        transfer.export_logs(filters),
+        mimetype="text/csv",
+        headers={"Content-Disposition": "attachment; filename=logs.csv"},
+    )
+
+
+# --- コマンド ---
+def each_store(command):
+    """複数店舗のときは --store の店舗（省略したらすべての店舗）で順に実行する"""
+
+    @click.option("--store", default=None, help="複数店舗のとき、この店舗だけで実行する（既定はすべての店舗）")
+    @functools.wraps(command)
+    def wrapper(*args, store=None, **kwargs):
+        if not tenants.enabled():
+            tenants.ensure_migrated(current_database())
+            return command(*args, **kwargs)
+        stores = [store] if store else tenants.list_stores()
+        if not stores:
+            click.echo(f"{tenants.TENANTS_DIR} に店舗がありません")
+        for name in stores:
+            click.echo(f"== {name}")
+            try:
+                with tenants.use_store(name):
+                    command(*args, **kwargs)
+            except tenants.UnknownStore as e:
+                raise click.ClickException(str(e))
+
+    return wrapper
+
+
+@app.cli.command("create-store")
+@click.argument("store")
+def create_store_command(store):
+    """新しい店舗のデータベースを作ります（複数店舗のとき）"""
+    if not tenants.enabled():
+        raise click.ClickException("PANTRY_TENANTS_DIR を設定してください")
+    try:
+        path = tenants.create_store(store)
+    except (tenants.UnknownStore, ValueError) as e:
+        raise click.ClickException(str(e))
+    click.echo(f"{path} を作りました")
+
+
+@app.cli.command("stores-report")
+def stores_report_command():
+    """店舗ごとの商品数・発注点割れ・直近の使用量をまとめて表示します（複数店舗のとき）"""
+    # コマンドでは裏の集計スレッドを待たずに、先に各店舗の集計を最新にします
+    tenants.fan_out(analytics.refresh_rollups)
+    report = analytics.merge_store_summaries(tenants.fan_out(analytics.store_summary))
+    for row in report["stores"]:
+        if "error" in row:
+            click.echo(f"{row['store']}: 読めませんでした（{row['error']}）")
+            continue
+        click.echo(
+            f"{row['store']}: 商品 {row['products']} / 発注点割れ {row['low_stock']} / "
+            f"在庫切れ {row['out_of_stock']} / 使用 {row['consumed']:g} / 廃棄 {row['wasted']:g}"
+        )
+    totals = report["totals"]
+    click.echo(f"合計: 商品 {totals['products']} / 発注点割れ {totals['low_stock']} / 使用 {totals['consumed']:g}")
+
+
+@app.cli.command("migrate")
+@each_store
+def migrate_command():
+    """未適用のマイグレーションを適用します（flask --app app migrate）"""
+    applied = run_migrations()
+    if applied:
+        for version in applied:
+            click.echo(f"適用しました: {version}")
+    else:
+        click.echo("スキーマは最新です")
+
+
+@app.cli.command("check-query-plans")
+@each_store
+def check_query_plans_command():
+    """主要ルートのクエリが全件スキャンになっていないか確認します"""
+    with get_db_connection() as conn:
+        problems = check_query_plans(conn)
+
+    for name, detail in problems:
+        click.echo(f"全件スキャン: {name}: {detail}")
+    if problems:
+        raise SystemExit(1)
+    click.echo("すべてのクエリがインデックスを使っています")
+
+
+@app.cli.command("rebuild-search-index")
+@each_store
+def rebuild_search_index_command():
+    """在庫一覧の商品名検索の索引を、すべての商品について作り直します"""
+    count = run_write(search.rebuild_index)
+    click.echo(f"{count} 件の商品を索引に入れました")
+
+
+@app.cli.command("rollup-usage")
+@each_store
+def rollup_usage_command():
+    """前回から増えた操作履歴を、日別の使用量集計に反映します"""
+    count = analytics.refresh_rollups()
+    click.echo(f"{count} 件のログを集計しました")
+
+
+@app.cli.command("archive-logs")
+@each_store
+@click.option(
+    "--older-than-days",
+    type=int,
+    default=archive.RETENTION_DAYS,
+    show_default=True,
+    help="これより古いログを保管ファイルに移します",
+)
+@click.option("--no-compact", is_flag=True, help="移したあとのファイルの切り詰めをしない")
+def archive_logs_command(older_than_days, no_compact):
+    """古い操作履歴を月別の保管ファイルに移し、データベースを切り詰めます
+
+    cron などで毎晩動かす想定です（例: 0 4 * * * flask --app app archive-logs）。
+    """
+    moved = archive.archive_old_logs(older_than_days)
+    for month, count in sorted(moved.items()):
+        click.echo(f"{month}: {count} 件を {archive.archive_path(month)} に移しました")
+    if not moved:
+        click.echo("移すログはありませんでした")
+
+    if not no_compact:
+        compact_current_db()
+
+
+@app.cli.command("build-css")
+def build_css_command():
+    """Tailwind CSS を static/css/tailwind.css にビルドします（デプロイのたびに実行します）"""
+    try:
+        path = startup.build_css(app)
+    except (RuntimeError, OSError, subprocess.SubprocessError) as e:
+        raise click.ClickException(f"Tailwind CSS をビルドできませんでした: {e}")
+    click.echo(f"{path} をビルドしました（{os.path.getsize(path)} バイト）")
+
+
+@app.cli.command("sync-rejected")
+@each_store
+@click.option("--limit", type=int, default=100, show_default=True, help="表示する件数")
+def sync_rejected_command(limit):
+    """タブレットから届いたのに受け付けなかったオフライン操作を、新しい順に表示します"""
+    with get_db_connection() as conn:
+        rows = sync.rejected_ops(conn, limit)
+    for row in rows:
+        click.echo(f"{row['applied_at']}  {row['op_id']}  {row['error']}  {row['payload']}")
+    if not rows:
+        click.echo("受け付けなかった操作はありません")
+
+
+@app.cli.command("compact-db")
+@each_store
+@click.option(
+    "--convert",
+    is_flag=True,
+    help="auto_vacuum=INCREMENTAL でない古いデータベースを VACUUM で切り替える（書き込みが止まります）",
+)
+def compact_db_command(convert):
+    """空きページをファイルから返し、WAL をチェックポイントします
+
+    --convert は最初の1回だけ、営業時間外にアプリを止めてから実行してください。
+    """
+    compact_current_db(convert)
+
+
+def compact_current_db(convert=False):
+    freed, converted = archive.compact(convert=convert)
+    if converted:
+        click.echo("auto_vacuum=INCREMENTAL に切り替えるため、VACUUM しました")
+    if freed is None:
+        click.echo(
+            "auto_vacuum=INCREMENTAL ではないため、空きページは返していません"
+            "（営業時間外に flask compact-db --convert を一度実行してください）"
+        )
+        return
+    click.echo(f"{freed} ページを空けました")
+
+
+@app.cli.command("backup-db")
+@each_store
+@click.option(
+    "--keep",
+    type=int,
+    default=backup.BACKUP_KEEP,
+    show_default=True,
+    help="残しておくスナップショットの数",
+)
+@click.option("--force", is_flag=True, help="前回から変わっていなくても作る")
+def backup_db_command(keep, force):
+    """動いたままのデータベースのスナップショットを作り、古いものを消します
+
+    毎回データベース全体をコピーします（前回から変わっていなければ作りません）。
+    数百ページずつコピーするので、その間も在庫の操作は止まりません。
+    cron などで定期的に動かす想定です（例: 0 * * * * flask --app app backup-db）。
+    """
+    try:
+        result = backup.create_snapshot(keep=keep, force=force)
+    except (backup.BackupError, sqlite3.Error) as e:
+        click.echo(f"バックアップに失敗しました: {e}", err=True)
+        raise SystemExit(1)
+    if result is None:
+        click.echo("前回のスナップショットから変更がないため、作りませんでした")
+        return
+    click.echo(f"{result['path']} を作りました（{result['seconds']:.2f} 秒）")
+    for path in result["removed"]:
+        click.echo(f"古いスナップショットを消しました: {path}")
+
+
+@app.cli.command("restore-db")
+@click.argument("snapshot", type=click.Path(dir_okay=False))
+@click.option("--yes", is_flag=True, help="確認せずに書き戻す")
+@click.option("--store", default=None, help="書き戻す店舗（複数店舗のときは必須）")
+def restore_db_command(snapshot, yes, store):
+    """スナップショットの整合性を確認してから、データベースに書き戻します
+
+    アプリを止めてから実行してください。書き戻す前の状態も backups に残します。
+    """
+    if tenants.enabled() and not store:
+        raise click.ClickException("複数店舗のときは --store で書き戻す店舗を指定してください")
+    try:
+        backup.check_integrity(snapshot)
+    except backup.BackupError as e:
+        click.echo(f"このスナップショットは使えません: {e}", err=True)
+        raise SystemExit(1)
+    if not yes:
+        click.confirm(f"{snapshot} の内容でデータベースを置き換えますか？", abort=True)
+
+    try:
+        with tenants.use_store(store) if tenants.enabled() else nullcontext():
+            safety_path = backup.restore_snapshot(snapshot)
+    except (backup.BackupError, tenants.UnknownStore, sqlite3.Error) as e:
+        click.echo(f"書き戻しに失敗しました: {e}", err=True)
+        raise SystemExit(1)
+    if safety_path:
+        click.echo(f"書き戻す前のデータベースを {safety_path} に残しました")
+    click.echo(f"{snapshot} から書き戻しました")
+
+
+@app.cli.command("build-thumbnails")
+@click.option("--workers", type=int, default=None, help="同時に処理するプロセス数")
+def build_thumbnails_command(workers):
+    """static/products の画像のサイズ違い・WebP版をまとめて作ります"""
+    built, failures = images.backfill(workers)
+    click.echo(f"{built} 枚の画像を処理しました")
+    for name, error in failures:
+        click.echo(f"失敗: {name}: {error}")
+    if failures:
+        raise SystemExit(1)
+
+
 if __name__ == "__main__":
     app.run()
@@ -0,0 +1,161 @@
+import os
+import re
+import sqlite3
+from contextlib import closing
+from datetime import datetime, timedelta, timezone
+
+import analytics
+import tenants
+from db import current_database, get_db_connection
+from stock import run_write
+
+# 何日より古いログを月別の保管ファイルに移すか
+RETENTION_DAYS = int(os.environ.get("PANTRY_LOG_RETENTION_DAYS", "365"))
+# 保管ファイルの置き場所（logs-YYYY-MM.db が月ごとにできます）
+# 未設定ならデータベースと同じフォルダーの archive/。複数店舗なら店舗ごとに分かれます
+ARCHIVE_DIR = os.environ.get("PANTRY_ARCHIVE_DIR")
+# 1回のトランザクションで移す件数
+ARCHIVE_CHUNK_SIZE = 5_000
+# 1回の incremental_vacuum で空けるページ数の上限（0 なら空きページをすべて）
+VACUUM_PAGES = 0
+
+_MONTH = re.compile(r"^\d{4}-\d{2}$")
+
+ARCHIVE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS inventory_logs (
+        id INTEGER PRIMARY KEY,
+        product_id INTEGER NOT NULL,
+        staff_id INTEGER NOT NULL,
+        quantity REAL NOT NULL DEFAULT 0,
+        created_at DATETIME,
+        event INTEGER,
+        details TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_logs_created ON inventory_logs (created_at, id);
+    CREATE INDEX IF NOT EXISTS idx_logs_product_created ON inventory_logs (product_id, created_at, id);
+    CREATE INDEX IF NOT EXISTS idx_logs_staff_created ON inventory_logs (staff_id, created_at, id);
+    CREATE INDEX IF NOT EXISTS idx_logs_event_created ON inventory_logs (event, created_at, id);
+"""
+
+LOG_COLUMNS = "id, product_id, staff_id, quantity, created_at, event, details"
+
+
+def default_archive_dir():
+    return tenants.data_dir("archive", ARCHIVE_DIR)
+
+
+def archive_path(month, archive_dir=None):
+    if not _MONTH.match(month or ""):
+        raise ValueError("月は YYYY-MM の形式で指定してください")
+    return os.path.join(archive_dir or default_archive_dir(), f"logs-{month}.db")
+
+
+def archived_months(archive_dir=None):
+    """保管ファイルのある月の一覧（新しい順）"""
+    archive_dir = archive_dir or default_archive_dir()
+    try:
+        names = os.listdir(archive_dir)
+    except OSError:
+        return []
+    months = [name[5:12] for name in names if re.match(r"^logs-\d{4}-\d{2}\.db$", name)]
+    return sorted(months, reverse=True)
+
+
+def _write_archive(month, rows, archive_dir):
+    """保管ファイルに書き込んでコミットする（同じ id は上書きしないので、やり直しても安全）"""
+    os.makedirs(archive_dir, exist_ok=True)
+    with closing(sqlite3.connect(archive_path(month, archive_dir))) as conn:
+        conn.executescript(ARCHIVE_SCHEMA)
+        with conn:
+            conn.executemany(
+                f"INSERT OR IGNORE INTO inventory_logs ({LOG_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+
+def _delete_logs(conn, ids):
+    conn.executemany("DELETE FROM inventory_logs WHERE id = ?", [(log_id,) for log_id in ids])
+
+
+def archive_old_logs(retention_days=RETENTION_DAYS, archive_dir=None, chunk_size=ARCHIVE_CHUNK_SIZE):
+    """retention_days 日より古いログを月別の保管ファイルに移し、{月: 件数} を返す
+
+    先に日別集計を最新にしてから、集計済みのログだけを移すので、使用量の合計は変わりません。
+    1チャンクごとに「保管ファイルへ書いてコミット → 本体から削除」を繰り返すので、
+    途中で止まっても次の実行で続きから移せます。
+    """
+    archive_dir = archive_dir or default_archive_dir()
+    # created_at は CURRENT_TIMESTAMP（UTC）なので、境目も UTC で比べます
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=retention_days)).strftime("%Y-%m-%d %H:%M:%S")
+
+    analytics.refresh_rollups()
+    with get_db_connection() as conn:
+        watermark = analytics.rollup_watermark(conn)
+
+    moved = {}
+    while True:
+        with get_db_connection() as conn:
+            rows = conn.execute(
+                f"""
+                SELECT {LOG_COLUMNS} FROM inventory_logs
+                WHERE created_at < ? AND id <= ?
+                ORDER BY created_at, id
+                LIMIT ?
+                """,
+                (cutoff, watermark, chunk_size),
+            ).fetchall()
+        if not rows:
+            return moved
+
+        by_month = {}
+        for row in rows:
+            by_month.setdefault(row["created_at"][:7], []).append(tuple(row))
+        for month, month_rows in by_month.items():
+            _write_archive(month, month_rows, archive_dir)
+            moved[month] = moved.get(month, 0) + len(month_rows)
+
+        run_write(_delete_logs, [row["id"] for row in rows])
+
+
+def compact(database=None, pages=VACUUM_PAGES, convert=False):
+    """空いたページをファイルから返し、WAL をチェックポイントして切り詰める
+
+    incremental_vacuum は auto_vacuum=INCREMENTAL のデータベースでしか効きません。
+    新しいデータベースは最初からそうなっていますが（migrations.run_migrations）、
+    それより前に作ったものは一度 VACUUM でファイルを作り直す必要があります。
+    VACUUM の間は書き込みがすべて止まるので、convert=True のとき（営業時間外に
+    flask compact-db --convert）だけ行い、毎晩の archive-logs では行いません。
+    (空けたページ数（切り替えていなければ None）, VACUUM をしたか) を返します。
+    """
+    database = database or current_database()
+    with closing(sqlite3.connect(database, timeout=30.0)) as conn:
+        converted = False
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2 and convert:
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+            converted = True
+
+        freed = None
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+            freed = before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+    return freed, converted
+
+
+def open_archive(month, database=None, archive_dir=None):
+    """保管ファイルを読み取り専用で開き、商品・スタッフ名を引けるように本体もつなぐ
+
+    保管ファイルには inventory_logs しかないので、logs.build_logs_query の SQL が
+    そのまま使えます（products / staffs は本体の表が使われます）。
+    """
+    path = archive_path(month, archive_dir)
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    conn.row_factory = sqlite3.Row
+    database = database or current_database()
+    conn.execute("ATTACH DATABASE ? AS live", (f"file:{os.path.abspath(database)}?mode=ro",))
+    return conn
@@ -0,0 +1,253 @@
+"""非同期で動かすときの入り口（ASGI）
+
+    gunicorn -k uvicorn.workers.UvicornWorker --workers 4 --preload asgi:app
+
+（uvicorn --workers N で複数プロセスにすると、ワーカーに渡るソケットに TCP_NODELAY が
+付かず、1リクエストごとに 40ms ほど待たされます。プロセスの管理は gunicorn に任せてください）
+
+/events（つなぎっぱなしの SSE）はイベントループの上で待つので、何百台つないでも
+スレッドを使いません。それ以外のルートは今の Flask のまま、上限のあるスレッドプールで
+実行します（URL もテンプレートも同期モードと同じです）。
+
+データベースの書き込み（在庫・商品・スタッフの登録や修正、同期、取り込み、集計や索引の更新）は
+すべて stock.run_write を通り、dbexec の書き込み専用スレッドに店舗ごとに順番に流れます。
+読み取りは、ルートを実行するスレッド（/events のつなぎ直しの取りこぼし分も同じプール）から
+ワーカーの接続プールで読みます。スレッドの数は PANTRY_ASYNC_THREADS、接続の数は
+PANTRY_DB_POOL_SIZE までなので、どちらも上限があります（読み取り専用のスレッドは
+ルートのスレッドとの往復が増えるだけだったので、置いていません）。
+
+    PANTRY_ASYNC_THREADS  Flask のルートを実行するスレッド数（既定 16）
+    PANTRY_DB_WRITERS     書き込み用のスレッド数（既定 4。同じ店舗の書き込みはいつも同じ1本）
+"""
+import asyncio
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+from urllib.parse import parse_qs
+
+import dbexec
+import live
+import tenants
+from app import create_app
+
+# Flask のルートを同時に実行するスレッド数
+ASYNC_THREADS = int(os.environ.get("PANTRY_ASYNC_THREADS", "16"))
+# リクエスト本文をメモリに置く上限（超えたら一時ファイルに書きます）
+BODY_MEMORY_LIMIT = 64 * 1024
+
+
+def build_environ(scope, body):
+    """ASGI の scope から WSGI の environ を組み立てる（PEP 3333）"""
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"], environ["REMOTE_PORT"] = scope["client"][0], str(scope["client"][1])
+
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name == "CONTENT_TYPE" or name == "CONTENT_LENGTH":
+            key = name
+        else:
+            key = f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def run_wsgi(wsgi_app, environ, send):
+    """スレッドの中で Flask を呼び、返ってきた本文を send する
+
+    イベントループとの往復は GIL の取り合いで遅くなるので、本文はためておき、
+    ふつうのページなら開始と本文をまとめて1回で渡します。
+    """
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response["status"] = int(status.split(" ", 1)[0])
+        response["headers"] = [
+            (name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers
+        ]
+        return lambda data: None
+
+    messages = []
+    buffered = []
+    size = 0
+
+    def flush(more_body):
+        nonlocal size
+        if not messages and not response.get("started"):
+            messages.append(
+                {"type": "http.response.start", "status": response["status"], "headers": response["headers"]}
+            )
+            response["started"] = True
+        messages.append({"type": "http.response.body", "body": b"".join(buffered), "more_body": more_body})
+        send(messages)
+        messages.clear()
+        buffered.clear()
+        size = 0
+
+    iterable = wsgi_app(environ, start_response)
+    try:
+        for chunk in iterable:
+            buffered.append(chunk)
+            size += len(chunk)
+            # 大きなファイルなどは、ため込みすぎないように途中で送ります
+            if size >= BODY_MEMORY_LIMIT:
+                flush(more_body=True)
+    finally:
+        if hasattr(iterable, "close"):
+            iterable.close()
+    flush(more_body=False)
+
+
+class PantryASGI:
+    """/events だけを非同期で受け持ち、残りは Flask に渡す ASGI アプリ"""
+
+    def __init__(self, wsgi_app, threads=ASYNC_THREADS):
+        self.wsgi_app = wsgi_app
+        self.threads = threads
+        self._pool = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] != "http":
+            return
+        elif scope["path"] == "/events" and scope["method"] == "GET":
+            await self.events(scope, receive, send)
+        else:
+            await self.call_wsgi(scope, receive, send)
+
+    def startup(self):
+        self._pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="flask")
+        dbexec.start()
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        dbexec.stop()
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self.startup()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def call_wsgi(self, scope, receive, send):
+        if self._pool is None:
+            # lifespan を送ってこないサーバーでも動くように
+            self.startup()
+        loop = asyncio.get_running_loop()
+
+        with SpooledTemporaryFile(max_size=BODY_MEMORY_LIMIT) as body:
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    return
+                body.write(message.get("body", b""))
+                if not message.get("more_body"):
+                    break
+            body.seek(0)
+
+            async def send_all(messages):
+                for message in messages:
+                    await send(message)
+
+            def send_from_thread(messages):
+                asyncio.run_coroutine_threadsafe(send_all(list(messages)), loop).result()
+
+            environ = build_environ(scope, body)
+            await loop.run_in_executor(self._pool, run_wsgi, self.wsgi_app, environ, send_from_thread)
+
+    def store_database(self, scope):
+        """複数店舗のとき、/events の店舗のデータベース（サブドメインか Flask のセッションから）"""
+        with self.wsgi_app.request_context(build_environ(scope, io.BytesIO())):
+            store = tenants.requested_store()
+            try:
+                return tenants.database_for(store) if store else None
+            except tenants.UnknownStore:
+                return None
+
+    async def events(self, scope, receive, send):
+        if self._pool is None:
+            self.startup()
+
+        database = None
+        if tenants.enabled():
+            # セッションの読み込みやマイグレーションはスレッドで（ループを止めないように）
+            loop = asyncio.get_running_loop()
+            database = await loop.run_in_executor(self._pool, self.store_database, scope)
+            if database is None:
+                await send({"type": "http.response.start", "status": 404, "headers": []})
+                await send({"type": "http.response.body", "body": b""})
+                return
+
+        headers = dict(scope.get("headers", []))
+        query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        last_event_id = (
+            headers.get(b"last-event-id", b"").decode("latin-1")
+            or query.get("last_event_id", [None])[0]
+        )
+        try:
+            last_event_id = int(last_event_id) if last_event_id else None
+        except ValueError:
+            last_event_id = None
+
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/event-stream; charset=utf-8"),
+                (b"cache-control", b"no-cache"),
+                (b"x-accel-buffering", b"no"),
+            ],
+        })
+
+        stream = live.async_event_stream(last_event_id, database=database, executor=self._pool)
+
+        async def pump():
+            async for chunk in stream:
+                await send({"type": "http.response.body", "body": chunk.encode("utf-8"), "more_body": True})
+
+        async def wait_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+
+        # 端末が切断したら、イベント待ちをやめて購読を外します
+        tasks = {asyncio.ensure_future(pump()), asyncio.ensure_future(wait_disconnect())}
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await stream.aclose()
+        await send({"type": "http.response.body", "body": b""})
+
+
+# 読み込んだときに起動の準備を済ませます（--preload ならマスターで一度だけ。startup.py）
+flask_app = create_app()
+app = PantryASGI(flask_app)
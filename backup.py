@@ -0,0 +1,234 @@
+"""動いているデータベースのスナップショット（バックアップ）と、その書き戻し
+
+スナップショットは毎回データベース全体をコピーした1ファイルです（差分だけを取る
+増分バックアップではありません）。前回のスナップショットから中身が変わっていなければ、
+コピーせずに終わります（fingerprint()）。
+"""
+import json
+import os
+import sqlite3
+import time
+from contextlib import closing
+from datetime import datetime
+
+import tenants
+from db import current_database
+
+# スナップショットの置き場所と、残しておく数
+# 未設定ならデータベースと同じフォルダーの backups/。複数店舗なら店舗ごとに分かれます
+BACKUP_DIR = os.environ.get("PANTRY_BACKUP_DIR")
+BACKUP_KEEP = int(os.environ.get("PANTRY_BACKUP_KEEP", "14"))
+
+# 1回にコピーするページ数と、その合間に休む秒数（この間に書き込みが進めます）
+BACKUP_PAGES = 256
+BACKUP_SLEEP = 0.005
+# コピー中に書き込みがあるとやり直しになるので、この回数を超えたら一度に読み切ります
+MAX_RESTARTS = 5
+
+SNAPSHOT_PREFIX = "pantry-"
+STATE_FILE = "latest.json"
+
+
+class BackupError(Exception):
+    """スナップショットが壊れている・見つからないときのエラー"""
+
+
+class _Restarted(Exception):
+    pass
+
+
+def fingerprint(conn):
+    """前回のスナップショットから中身が変わったかを見るための値"""
+    row = conn.execute(
+        """
+        SELECT
+            (SELECT COALESCE(MAX(seq), 0) FROM product_changes),
+            (SELECT COALESCE(MAX(generation), 0) FROM cache_generation),
+            (SELECT COALESCE(MAX(id), 0) FROM inventory_logs),
+            (SELECT COUNT(*) FROM staffs)
+        """
+    ).fetchone()
+    schema_version = conn.execute("PRAGMA schema_version").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    return [*row, schema_version, page_count]
+
+
+def _copy(source, target, pages=BACKUP_PAGES, sleep=BACKUP_SLEEP):
+    """backup API で pages ページずつコピーする
+
+    コピー中にほかの接続が書き込むと最初からやり直しになるので、それが続くときは
+    1回の読み取りトランザクションで読み切ります（WAL なので書き込みは止まりません）。
+    """
+    restarts = 0
+    last_remaining = None
+
+    def progress(status, remaining, total):
+        nonlocal restarts, last_remaining
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts > MAX_RESTARTS:
+                raise _Restarted()
+        last_remaining = remaining
+
+    try:
+        source.backup(target, pages=pages, progress=progress, sleep=sleep)
+        return restarts
+    except _Restarted:
+        source.backup(target, pages=-1)
+        return restarts
+
+
+def check_integrity(path):
+    """スナップショットを読み取り専用で開いて、integrity_check と必須の表を確認する"""
+    if not os.path.exists(path):
+        raise BackupError(f"ファイルが見つかりません: {path}")
+    try:
+        with closing(sqlite3.connect(f"file:{path}?mode=ro", uri=True)) as conn:
+            result = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+            tables = {
+                row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+            }
+    except sqlite3.DatabaseError as e:
+        raise BackupError(f"データベースとして開けません: {e}") from e
+
+    if result != ["ok"]:
+        raise BackupError("integrity_check に失敗しました: " + "; ".join(result[:5]))
+    missing = {"products", "inventory_logs", "schema_migrations"} - tables
+    if missing:
+        raise BackupError(f"必要な表がありません: {', '.join(sorted(missing))}")
+
+
+def default_backup_dir():
+    return tenants.data_dir("backups", BACKUP_DIR)
+
+
+def list_snapshots(backup_dir=None):
+    """スナップショットのパス（古い順）"""
+    backup_dir = backup_dir or default_backup_dir()
+    try:
+        names = os.listdir(backup_dir)
+    except OSError:
+        return []
+    return [
+        os.path.join(backup_dir, name)
+        for name in sorted(names)
+        if name.startswith(SNAPSHOT_PREFIX) and name.endswith(".db")
+    ]
+
+
+def _read_state(backup_dir):
+    try:
+        with open(os.path.join(backup_dir, STATE_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_state(backup_dir, state):
+    path = os.path.join(backup_dir, STATE_FILE)
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def rotate(backup_dir=None, keep=BACKUP_KEEP):
+    """新しいものから keep 個を残して、古いスナップショットを消す"""
+    snapshots = list_snapshots(backup_dir)
+    removed = snapshots[:-keep] if keep > 0 else []
+    for path in removed:
+        os.remove(path)
+    return removed
+
+
+def create_snapshot(database=None, backup_dir=None, keep=BACKUP_KEEP, force=False):
+    """動いているデータベースのスナップショットを作る
+
+    前回から何も変わっていなければ作らずに None を返します（force=True なら必ず作る）。
+    作ったときは {"path", "seconds", "restarts", "removed"} を返します。
+    """
+    database = database or current_database()
+    backup_dir = backup_dir or default_backup_dir()
+    os.makedirs(backup_dir, exist_ok=True)
+
+    with closing(sqlite3.connect(database, timeout=10.0)) as source:
+        current = fingerprint(source)
+        state = _read_state(backup_dir)
+        if (
+            not force
+            and state.get("fingerprint") == current
+            and state.get("path") in list_snapshots(backup_dir)
+        ):
+            return None
+
+        name = f"{SNAPSHOT_PREFIX}{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.db"
+        path = os.path.join(backup_dir, name)
+        tmp_path = f"{path}.tmp"
+
+        started = time.perf_counter()
+        with closing(sqlite3.connect(tmp_path)) as target:
+            restarts = _copy(source, target)
+            # スナップショットは1ファイルで持ち運べるように、WAL ではなく通常のジャーナルにします
+            target.execute("PRAGMA journal_mode=DELETE")
+        seconds = time.perf_counter() - started
+        # コピーが始まった時点の中身なので、指紋もコピー後ではなく前の値を記録します
+
+    try:
+        check_integrity(tmp_path)
+    except BackupError:
+        os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+
+    _write_state(backup_dir, {"fingerprint": current, "path": path})
+    removed = rotate(backup_dir, keep)
+    return {"path": path, "seconds": seconds, "restarts": restarts, "removed": removed}
+
+
+def _generation(conn):
+    """キャッシュの世代（cache_generation がまだない古いデータベースなら None）"""
+    try:
+        return conn.execute("SELECT COALESCE(MAX(generation), 0) FROM cache_generation").fetchone()[0]
+    except sqlite3.OperationalError:
+        return None
+
+
+def restore_snapshot(path, database=None, backup_dir=None):
+    """スナップショットの整合性を確認してから、データベースに書き戻す
+
+    書き戻す前に今のデータベースも pre-restore として保存します（そのパスを返します）。
+    書き戻し中は書き込みロックを取るので、アプリを止めてから実行してください。
+    """
+    check_integrity(path)
+
+    database = database or current_database()
+    backup_dir = backup_dir or default_backup_dir()
+    os.makedirs(backup_dir, exist_ok=True)
+    safety_path = None
+    generation = None
+    if os.path.exists(database):
+        safety_path = os.path.join(
+            backup_dir, f"pre-restore-{datetime.now().strftime('%Y%m%d-%H%M%S')}.db"
+        )
+        with closing(sqlite3.connect(database, timeout=10.0)) as current, closing(
+            sqlite3.connect(safety_path)
+        ) as target:
+            current.backup(target)
+            generation = _generation(current)
+
+    with closing(sqlite3.connect(f"file:{path}?mode=ro", uri=True)) as snapshot, closing(
+        sqlite3.connect(database, timeout=30.0)
+    ) as target:
+        snapshot.backup(target)
+        result = target.execute("PRAGMA integrity_check").fetchone()[0]
+        if result != "ok":
+            raise BackupError(f"書き戻したデータベースの integrity_check に失敗しました: {result}")
+        # 世代を戻すと、キャッシュや ETag が古い中身のまま当たってしまうので先に進めます
+        if _generation(target) is not None:
+            with target:
+                target.execute(
+                    "UPDATE cache_generation SET generation = MAX(generation, ?) + 1 WHERE id = 1",
+                    (generation or 0,),
+                )
+        # 書き戻したデータベースも WAL で使います
+        target.execute("PRAGMA journal_mode=WAL")
+    return safety_path
@@ -0,0 +1,154 @@
+"""在庫の書き込みを流し続けながらスナップショットを取り、中身が一貫しているかを確かめます
+
+    python bench/backup_under_load.py --size medium --threads 8 --snapshots 3
+
+書き込みは対象商品への +1 入庫だけにしておくので、どの時点のスナップショットでも
+「在庫の増えた分 = その商品の入庫ログの合計」が成り立つはずです。
+あわせて、バックアップ中の書き込みの最大待ち時間と、書き戻し（restore）も確認します。
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+
+
+def prepare(size):
+    sys.path.insert(0, BENCH_DIR)
+    from generate_db import SIZES, generate
+
+    source = os.path.join(BENCH_DIR, "data", f"{size}.db")
+    if not os.path.exists(source):
+        generate(source, *SIZES[size])
+
+    workdir = tempfile.mkdtemp(prefix="pantry-backup-")
+    path = os.path.join(workdir, "live.db")
+    shutil.copyfile(source, path)
+    return workdir, path
+
+
+def baseline(path, products):
+    with sqlite3.connect(path) as conn:
+        stocks = dict(
+            conn.execute("SELECT id, current_stock FROM products WHERE id <= ?", (products,))
+        )
+        last_log_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM inventory_logs").fetchone()[0]
+    return stocks, last_log_id
+
+
+def check_snapshot(path, products, stocks, last_log_id):
+    """スナップショットの在庫と入庫ログが食い違っていないかを確認し、反映済みの書き込み数を返す"""
+    with sqlite3.connect(path) as conn:
+        current = dict(
+            conn.execute("SELECT id, current_stock FROM products WHERE id <= ?", (products,))
+        )
+        logged = dict(
+            conn.execute(
+                """
+                SELECT product_id, SUM(quantity) FROM inventory_logs
+                WHERE id > ? AND product_id <= ?
+                GROUP BY product_id
+                """,
+                (last_log_id, products),
+            )
+        )
+    mismatched = [
+        product_id for product_id, stock in current.items()
+        if stock - stocks[product_id] != logged.get(product_id, 0)
+    ]
+    return sum(logged.values()), mismatched
+
+
+def main():
+    parser = argparse.ArgumentParser(description="書き込み中のバックアップの確認")
+    parser.add_argument("--size", default="medium")
+    parser.add_argument("--threads", type=int, default=8, help="書き込み続けるスレッド数")
+    parser.add_argument("--products", type=int, default=20, help="書き込む商品の数")
+    parser.add_argument("--snapshots", type=int, default=3, help="取るスナップショットの数")
+    args = parser.parse_args()
+
+    workdir, path = prepare(args.size)
+    os.environ["PANTRY_DATABASE"] = path
+    sys.path.insert(0, ROOT_DIR)
+    import backup
+    import stock
+    from logs import LogEvent
+
+    backup_dir = os.path.join(workdir, "backups")
+    stocks, last_log_id = baseline(path, args.products)
+
+    stop = threading.Event()
+    backing_up = threading.Event()
+    writes = [0] * args.threads
+    slowest = [0.0] * args.threads
+    slowest_idle = [0.0] * args.threads
+
+    def writer(index):
+        product_id = index % args.products + 1
+        while not stop.is_set():
+            started = time.perf_counter()
+            stock.change_stock(product_id, 1.0, 1, LogEvent.ARRIVAL, 1.0)
+            elapsed = time.perf_counter() - started
+            if backing_up.is_set():
+                slowest[index] = max(slowest[index], elapsed)
+            else:
+                slowest_idle[index] = max(slowest_idle[index], elapsed)
+            writes[index] += 1
+            product_id = product_id % args.products + 1
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(args.threads)]
+    ok = True
+    try:
+        for t in threads:
+            t.start()
+        time.sleep(0.5)
+
+        for _ in range(args.snapshots):
+            before = sum(writes)
+            backing_up.set()
+            result = backup.create_snapshot(backup_dir=backup_dir, force=True)
+            backing_up.clear()
+            during = sum(writes) - before
+
+            applied, mismatched = check_snapshot(
+                result["path"], args.products, stocks, last_log_id
+            )
+            ok = ok and not mismatched
+            print(
+                f"{os.path.basename(result['path'])}: {result['seconds']:.2f}秒"
+                f"（やり直し {result['restarts']} 回）, 間の書き込み {during} 件, "
+                f"反映済み {applied:.0f} 件, 食い違い {len(mismatched)} 件"
+            )
+            time.sleep(0.2)
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+
+    print(
+        f"書き込みの最大待ち時間: バックアップ中 {max(slowest) * 1000:.1f}ms / "
+        f"それ以外 {max(slowest_idle) * 1000:.1f}ms"
+    )
+
+    # 最後のスナップショットを別のファイルに書き戻して、もう一度確かめます
+    restored = os.path.join(workdir, "restored.db")
+    shutil.copyfile(path, restored)
+    backup.restore_snapshot(result["path"], database=restored, backup_dir=backup_dir)
+    _, mismatched = check_snapshot(restored, args.products, stocks, last_log_id)
+    ok = ok and not mismatched
+    print("書き戻し:", "一致" if not mismatched else f"食い違い {len(mismatched)} 件")
+
+    shutil.rmtree(workdir, ignore_errors=True)
+    print("結果:", "一貫しています" if ok else "一貫していません")
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
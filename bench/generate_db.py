@@ -0,0 +1,187 @@
+"""ベンチマーク用の架空の喫茶店データベースを作ります
+
+    python bench/generate_db.py --size medium --out bench/data/medium.db
+
+同じ --seed なら毎回同じ中身になるので、結果を比べられます。
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from logs import LogEvent  # noqa: E402
+
+# サイズ名: (商品数, ログ件数)
+SIZES = {
+    "small": (100, 10_000),
+    "medium": (10_000, 200_000),
+    "large": (100_000, 1_200_000),
+}
+
+# カテゴリと、商品数の偏り（重み）
+CATEGORIES = [
+    ("コーヒー豆", 20),
+    ("乳製品", 10),
+    ("シロップ", 8),
+    ("茶葉", 8),
+    ("焼き菓子", 12),
+    ("フルーツ", 10),
+    ("冷凍食品", 6),
+    ("調味料", 8),
+    ("消耗品", 12),
+    ("包材", 6),
+]
+
+# スタッフと、操作回数の偏り（重み）
+STAFFS = [
+    ("マスター", "admin", 30),
+    ("店長", "admin", 20),
+    ("スタッフA", "staff", 15),
+    ("スタッフB", "staff", 12),
+    ("スタッフC", "staff", 10),
+    ("スタッフD", "staff", 7),
+    ("アルバイトE", "staff", 4),
+    ("アルバイトF", "staff", 2),
+]
+
+# ログの種別と割合
+LOG_EVENTS = [
+    (LogEvent.DEPARTURE, 60),
+    (LogEvent.ARRIVAL, 22),
+    (LogEvent.BULK_ARRIVAL, 10),
+    (LogEvent.WASTE, 6),
+    (LogEvent.PRODUCT_DELETED, 2),
+]
+
+UNITS = ["袋", "本", "個", "kg", "箱", "パック"]
+ORIGINS = ["", "", "ブラジル", "エチオピア", "コロンビア", "北海道", "静岡", "インド"]
+
+BATCH_SIZE = 10_000
+
+
+def _weighted(rng, items, count):
+    """(値, ..., 重み) の並びから、重みに従って count 個選ぶ"""
+    population = [item[0] for item in items]
+    weights = [item[-1] for item in items]
+    return rng.choices(population, weights=weights, k=count)
+
+
+def generate(path, products, logs, seed=42, days=365):
+    """path に products 件の商品と logs 件のログを持つデータベースを作る"""
+    if os.path.exists(path):
+        os.remove(path)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    # migrations は db 経由で PANTRY_DATABASE を読むので、使うときに読み込みます
+    from migrations import run_migrations
+
+    run_migrations(path)
+
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+
+    conn.executemany("INSERT INTO categories (name) VALUES (?)", [(c[0],) for c in CATEGORIES])
+    conn.execute("DELETE FROM staffs")
+    conn.executemany(
+        "INSERT INTO staffs (id, name, role) VALUES (?, ?, ?)",
+        [(i + 1, name, role) for i, (name, role, _) in enumerate(STAFFS)],
+    )
+
+    category_ids = _weighted(
+        rng, [(i + 1, w) for i, (_, w) in enumerate(CATEGORIES)], products
+    )
+    rows = []
+    for i, category_id in enumerate(category_ids):
+        reorder_level = rng.choice([1, 2, 3, 5, 10])
+        # 1割くらいは発注点を割っている状態にします
+        if rng.random() < 0.1:
+            stock = rng.randint(0, reorder_level)
+        else:
+            stock = rng.randint(reorder_level + 1, reorder_level * 6 + 10)
+        rows.append(
+            (
+                f"{CATEGORIES[category_id - 1][0]} {i + 1:06d}",
+                category_id,
+                rng.choice(ORIGINS),
+                stock,
+                rng.choice(UNITS),
+                reorder_level,
+            )
+        )
+    conn.executemany(
+        """
+        INSERT INTO products (name, category_id, origin, current_stock, unit, reorder_level)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        rows,
+    )
+
+    # よく動く商品に偏らせるため、商品IDをパレート分布っぽく選びます
+    start = datetime.now() - timedelta(days=days)
+    span = days * 24 * 60 * 60
+    staff_ids = [(i + 1, s[2]) for i, s in enumerate(STAFFS)]
+    offsets = sorted(rng.random() * span for _ in range(logs))
+
+    batch = []
+    for offset in offsets:
+        if rng.random() < 0.5:
+            product_id = min(products, int(rng.paretovariate(1.2)))
+        else:
+            product_id = rng.randint(1, products)
+        event = _weighted(rng, LOG_EVENTS, 1)[0]
+        quantity = 0 if event == LogEvent.PRODUCT_DELETED else rng.choice([1, 1, 1, 2, 3, 5])
+        batch.append(
+            (
+                product_id,
+                _weighted(rng, staff_ids, 1)[0],
+                int(event),
+                quantity,
+                (start + timedelta(seconds=offset)).strftime("%Y-%m-%d %H:%M:%S"),
+            )
+        )
+        if len(batch) >= BATCH_SIZE:
+            _insert_logs(conn, batch)
+            batch = []
+    _insert_logs(conn, batch)
+
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+
+
+def _insert_logs(conn, batch):
+    conn.executemany(
+        """
+        INSERT INTO inventory_logs (product_id, staff_id, event, quantity, created_at)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        batch,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ベンチマーク用のデータベースを作ります")
+    parser.add_argument("--size", choices=SIZES, default="small")
+    parser.add_argument("--products", type=int, help="商品数（--size より優先）")
+    parser.add_argument("--logs", type=int, help="ログ件数（--size より優先）")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", help="出力先（省略時は bench/data/<size>.db）")
+    args = parser.parse_args()
+
+    products, logs = SIZES[args.size]
+    products = args.products or products
+    logs = args.logs or logs
+    out = args.out or os.path.join(os.path.dirname(__file__), "data", f"{args.size}.db")
+
+    generate(out, products, logs, seed=args.seed)
+    print(f"{out}: 商品 {products} 件 / ログ {logs} 件")
+
+
+if __name__ == "__main__":
+    main()
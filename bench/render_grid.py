@@ -0,0 +1,137 @@
+"""在庫一覧・商品選択のカードの描画時間を、商品数を変えて測ります
+
+    python bench/render_grid.py --products 1000 10000 --repeat 5 --out bench/results/render_grid.json
+
+商品数ごとに全商品のカードを1画面に描き、次の4つの場合を比べます。
+
+    uncached   カードのキャッシュなし（毎回すべて描く）
+    cold       キャッシュが空の状態から1回（起動直後の1回目）
+    warm       すべてのカードがキャッシュにある状態
+    changed    1% の商品の在庫を動かした直後（その分だけ描き直す）
+
+データベースは bench/data/grid-<商品数>.db を使います（なければ generate_db.py で作ります）。
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+from generate_db import generate  # noqa: E402
+
+# 描画を測るだけなので、ログは少しで十分です
+LOGS = 1_000
+CHANGED_RATIO = 0.01
+
+
+def db_path(products):
+    path = os.path.join(BENCH_DIR, "data", f"grid-{products}.db")
+    if not os.path.exists(path):
+        generate(path, products, LOGS)
+    return path
+
+
+def timed(fn, repeat):
+    """fn を repeat 回実行した時間の中央値（ミリ秒）"""
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        durations.append((time.perf_counter() - started) * 1000)
+    return statistics.median(durations)
+
+
+def measure(app, path, repeat):
+    import cache
+    import templating
+    from db import get_db_connection, use_database
+    from flask import render_template
+    from logs import LogEvent
+    from search import STOCK_SELECT
+    from stock import change_stock
+
+    def load():
+        with get_db_connection() as conn:
+            stock_rows = conn.execute(f"{STOCK_SELECT} WHERE p.is_active = 1 ORDER BY p.id").fetchall()
+            choose_rows = cache.active_products_by_name(conn)
+        return stock_rows, choose_rows
+
+    def render(stock_rows, choose_rows):
+        render_template(
+            "fragments/stock_items.html",
+            products=stock_rows, fuzzy=False, first_page=False, filtered=False, next_url=None,
+        )
+        render_template(
+            "choose_product.html", products=choose_rows, mode="departure", title="", bg_color=""
+        )
+
+    results = {}
+    with use_database(path), app.test_request_context("/"):
+        stock_rows, choose_rows = load()
+        count = len(stock_rows)
+
+        max_size = templating.card_cache.max_size
+        templating.card_cache.max_size = 0
+        results["uncached"] = timed(lambda: render(stock_rows, choose_rows), repeat)
+        templating.card_cache.max_size = max_size
+
+        templating.card_cache.invalidate()
+        results["cold"] = timed(lambda: render(stock_rows, choose_rows), 1)
+        results["warm"] = timed(lambda: render(stock_rows, choose_rows), repeat)
+
+        # 在庫を動かした商品だけ、updated_at と在庫が変わって描き直しになります
+        changed = max(1, int(count * CHANGED_RATIO))
+        for row in stock_rows[:changed]:
+            change_stock(row["id"], 1.0, 1, LogEvent.ARRIVAL, 1.0)
+        stock_rows, choose_rows = load()
+        misses = templating.card_cache.misses
+        results["changed"] = timed(lambda: render(stock_rows, choose_rows), 1)
+        results["rerendered_cards"] = templating.card_cache.misses - misses
+
+    results["products"] = count
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="商品カードの描画時間を測ります")
+    parser.add_argument("--products", type=int, nargs="+", default=[1_000, 10_000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--out", help="結果を JSON で保存する先")
+    args = parser.parse_args()
+
+    paths = [db_path(products) for products in args.products]
+    # app は読み込んだときに PANTRY_DATABASE のマイグレーションを流すので、先に決めておきます
+    os.environ["PANTRY_DATABASE"] = paths[0]
+    import templating
+    from app import app
+
+    app.jinja_env.cache.clear()
+    started = time.perf_counter()
+    compiled = templating.precompile_templates(app)
+    precompile_ms = (time.perf_counter() - started) * 1000
+    print(f"テンプレートのコンパイル: {compiled} 件 {precompile_ms:.1f} ms")
+
+    report = {"precompile_ms": precompile_ms, "templates": compiled, "grids": []}
+    print(f"{'商品数':>8} {'キャッシュなし':>12} {'1回目':>10} {'キャッシュあり':>12} {'1%変更後':>10}")
+    for path in paths:
+        result = measure(app, path, args.repeat)
+        report["grids"].append(result)
+        print(
+            f"{result['products']:>8} {result['uncached']:>10.1f}ms {result['cold']:>8.1f}ms "
+            f"{result['warm']:>10.1f}ms {result['changed']:>8.1f}ms"
+            f"（描き直し {result['rerendered_cards']} 枚）"
+        )
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
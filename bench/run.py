@@ -0,0 +1,429 @@
+"""app.py の全ルートを同時アクセスで叩いて、レイテンシとスループットを測ります
+
+    # Flask のテストクライアントで（サーバーなし）
+    python bench/run.py --size small --clients 8 --out bench/results/small.json
+
+    # gunicorn を起動して HTTP で
+    python bench/run.py --size medium --server gunicorn --workers 4 --clients 16
+
+    # 非同期モード（asgi.py）。/events を 24 本つないだままにして、同期モードと比べる
+    python bench/run.py --size small --server asgi --workers 2 --threads 8 --hold-streams 24
+
+    # 保存しておいた結果と比べて、遅くなったルートがあれば終了コード 1
+    python bench/run.py --size small --baseline bench/results/small.json
+
+データベースは bench/data/<size>.db を使います（なければ generate_db.py と同じ手順で作ります）。
+計測のたびに元のデータベースをコピーして使うので、書き込み系のルートを叩いても結果は毎回同じ条件です。
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+from generate_db import SIZES, generate  # noqa: E402
+
+
+def build_routes(db_path, rng):
+    """(名前, メソッド, パスを返す関数, フォーム or JSON) の一覧"""
+    conn = sqlite3.connect(db_path)
+    product_count = conn.execute("SELECT MAX(id) FROM products").fetchone()[0]
+    cursor_row = conn.execute(
+        "SELECT created_at, id FROM inventory_logs ORDER BY created_at DESC, id DESC LIMIT 1 OFFSET 500"
+    ).fetchone()
+    conn.close()
+
+    def product_id():
+        return rng.randint(1, product_count)
+
+    def bulk_form():
+        return {f"qty_{product_id()}": str(rng.randint(1, 5)) for _ in range(20)}
+
+    def bulk_json():
+        return {
+            "items": [
+                {"product_id": product_id(), "quantity": rng.randint(1, 5)} for _ in range(20)
+            ]
+        }
+
+    def sync_json():
+        # 操作IDは毎回新しく作るので、すべて新しい操作として反映されます
+        return {
+            "ops": [
+                {
+                    "op_id": f"bench-{rng.getrandbits(64):016x}",
+                    "mode": rng.choice(["arrival", "departure", "waste"]),
+                    "product_id": product_id(),
+                    "quantity": 1,
+                }
+                for _ in range(10)
+            ]
+        }
+
+    logs_cursor = f"{cursor_row[0]}|{cursor_row[1]}" if cursor_row else ""
+
+    return [
+        ("GET /", "GET", lambda: "/", None),
+        ("GET /stock_list", "GET", lambda: "/stock_list", None),
+        (
+            "GET /stock_list/items?q",
+            "GET",
+            lambda: "/stock_list/items?" + urlencode({"q": rng.choice(["コーヒー", "kohi", "豆", "乳製品"])}),
+            None,
+        ),
+        ("GET /shopping_list", "GET", lambda: "/shopping_list", None),
+        ("GET /logs", "GET", lambda: "/logs", None),
+        ("GET /logs?product_id", "GET", lambda: f"/logs?product_id={product_id()}", None),
+        ("GET /logs/rows", "GET", lambda: "/logs/rows?" + urlencode({"cursor": logs_cursor}), None),
+        ("GET /arrival/select", "GET", lambda: "/arrival/select", None),
+        ("GET /admin/manage_products", "GET", lambda: "/admin/manage_products", None),
+        ("GET /admin/analytics", "GET", lambda: "/admin/analytics", None),
+        ("GET /<mode>/entry/<id>", "GET", lambda: f"/departure/entry/{product_id()}", None),
+        ("GET /edit_product/<id>", "GET", lambda: f"/edit_product/{product_id()}", None),
+        (
+            "POST /<mode>/execute/<id>",
+            "POST",
+            lambda: f"/{rng.choice(['arrival', 'departure', 'waste'])}/execute/{product_id()}",
+            lambda: {"quantity": "1"},
+        ),
+        ("POST /reduce/<id>", "POST", lambda: f"/reduce/{product_id()}", lambda: {}),
+        ("POST /add_stock/<id>", "POST", lambda: f"/add_stock/{product_id()}", lambda: {}),
+        ("POST /execute_bulk_arrival", "POST", lambda: "/execute_bulk_arrival", bulk_form),
+        ("POST /api/bulk_arrival", "JSON", lambda: "/api/bulk_arrival", bulk_json),
+        ("POST /api/sync", "JSON", lambda: "/api/sync", sync_json),
+    ]
+
+
+class TestClientDriver:
+    """Flask のテストクライアント（スレッドごとに1つ）"""
+
+    def __init__(self, db_path):
+        import db
+
+        if db.DATABASE != db_path:
+            raise RuntimeError("PANTRY_DATABASE は app を読み込む前に設定してください")
+        from app import app
+
+        self.app = app
+        self._local = threading.local()
+
+    def request(self, method, path, body):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        if method == "GET":
+            response = client.get(path)
+        elif method == "JSON":
+            response = client.post(path, json=body)
+        else:
+            response = client.post(path, data=body)
+        return response.status_code
+
+    def close(self):
+        pass
+
+
+class GunicornDriver:
+    """gunicorn を起動して、keep-alive の HTTP 接続で叩く"""
+
+    name = "gunicorn"
+
+    def __init__(self, db_path, workers, threads):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            self.port = s.getsockname()[1]
+
+        env = dict(os.environ, PANTRY_DATABASE=db_path, PANTRY_ASYNC_THREADS=str(threads))
+        self.process = subprocess.Popen(self.command(workers, threads), cwd=ROOT_DIR, env=env)
+        self._wait_ready()
+        self._local = threading.local()
+        self._streams = []
+
+    def command(self, workers, threads):
+        return [
+            sys.executable, "-m", "gunicorn",
+            "--workers", str(workers),
+            "--worker-class", "gthread",
+            "--threads", str(threads),
+            "--bind", f"127.0.0.1:{self.port}",
+            "--log-level", "warning",
+            "--preload",
+            "app:create_app()",
+        ]
+
+    def _wait_ready(self, timeout=30):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                with socket.create_connection(("127.0.0.1", self.port), timeout=1):
+                    return
+            except OSError:
+                time.sleep(0.1)
+        self.close()
+        raise RuntimeError(f"{self.name} が起動しませんでした")
+
+    def request(self, method, path, body):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=60)
+
+        headers = {}
+        payload = None
+        if method == "JSON":
+            payload = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        elif method == "POST":
+            payload = urlencode(body)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+
+        try:
+            conn.request("GET" if method == "GET" else "POST", path, body=payload, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            self._local.conn = None
+            raise
+
+    def hold_streams(self, count):
+        """/events を count 本つないだままにする（タブレットが開きっぱなしの状態）"""
+        for _ in range(count):
+            sock = socket.create_connection(("127.0.0.1", self.port), timeout=60)
+            sock.sendall(b"GET /events HTTP/1.1\r\nHost: bench\r\nAccept: text/event-stream\r\n\r\n")
+            self._streams.append(sock)
+            threading.Thread(target=self._drain, args=(sock,), daemon=True).start()
+
+    @staticmethod
+    def _drain(sock):
+        try:
+            while sock.recv(65536):
+                pass
+        except OSError:
+            pass
+
+    def close(self):
+        for sock in self._streams:
+            sock.close()
+        self.process.terminate()
+        self.process.wait(timeout=10)
+
+
+class AsgiDriver(GunicornDriver):
+    """asgi.py を uvicorn のワーカーで起動する（--threads は Flask のルートを実行するスレッド数）"""
+
+    name = "asgi"
+
+    def command(self, workers, threads):
+        return [
+            sys.executable, "-m", "gunicorn",
+            "--workers", str(workers),
+            "--worker-class", "uvicorn.workers.UvicornWorker",
+            "--bind", f"127.0.0.1:{self.port}",
+            "--log-level", "warning",
+            "--preload",
+            "asgi:app",
+        ]
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(p / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def run_route(driver, route, clients, requests_per_client):
+    """1つのルートを clients 本のスレッドで同時に叩き、結果を集計する"""
+    name, method, make_path, make_body = route
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def worker():
+        nonlocal errors
+        local_latencies = []
+        local_errors = 0
+        for _ in range(requests_per_client):
+            path = make_path()
+            body = make_body() if make_body else None
+            started = time.perf_counter()
+            try:
+                status = driver.request(method, path, body)
+            except Exception:
+                status = None
+            elapsed = time.perf_counter() - started
+            if status is None or status >= 400:
+                local_errors += 1
+            else:
+                local_latencies.append(elapsed)
+        with lock:
+            latencies.extend(local_latencies)
+            errors += local_errors
+
+    threads = [threading.Thread(target=worker) for _ in range(clients)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "p50_ms": _ms(percentile(latencies, 50)),
+        "p95_ms": _ms(percentile(latencies, 95)),
+        "p99_ms": _ms(percentile(latencies, 99)),
+        "throughput_rps": round(len(latencies) / wall, 1) if wall else None,
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def compare(results, baseline, threshold, min_delta_ms):
+    """基準の結果より p95 が threshold 以上遅くなったルートを返す"""
+    regressions = []
+    for name, current in results["routes"].items():
+        base = baseline.get("routes", {}).get(name)
+        if not base or base.get("p95_ms") is None or current.get("p95_ms") is None:
+            continue
+        delta = current["p95_ms"] - base["p95_ms"]
+        if delta > min_delta_ms and current["p95_ms"] > base["p95_ms"] * (1 + threshold):
+            regressions.append((name, base["p95_ms"], current["p95_ms"]))
+    return regressions
+
+
+def prepare_database(size):
+    # 書き込み系のルートで元データが変わらないよう、毎回コピーを使います
+    workdir = tempfile.mkdtemp(prefix="pantry-bench-")
+    db_path = os.path.join(workdir, "bench.db")
+    # db モジュールは読み込んだ時点の PANTRY_DATABASE を使うので、先に設定しておきます
+    os.environ["PANTRY_DATABASE"] = db_path
+
+    source = os.path.join(BENCH_DIR, "data", f"{size}.db")
+    if not os.path.exists(source):
+        products, logs = SIZES[size]
+        print(f"{source} を作成しています（商品 {products} 件 / ログ {logs} 件）...")
+        generate(source, products, logs)
+
+    shutil.copyfile(source, db_path)
+    return workdir, db_path
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="全ルートのベンチマーク")
+    parser.add_argument("--size", choices=SIZES, default="small")
+    parser.add_argument(
+        "--server", choices=["testclient", "gunicorn", "asgi"], default="testclient"
+    )
+    parser.add_argument("--clients", type=int, default=8, help="同時に叩くクライアント数")
+    parser.add_argument("--requests", type=int, default=50, help="クライアント1つあたりのリクエスト数")
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn のワーカー数")
+    parser.add_argument("--threads", type=int, default=8, help="ワーカーあたりのスレッド数")
+    parser.add_argument(
+        "--hold-streams", type=int, default=0, help="計測中に /events をこの本数つないだままにする"
+    )
+    parser.add_argument("--route", action="append", help="この名前を含むルートだけ測る（複数可）")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="結果の JSON の保存先")
+    parser.add_argument("--baseline", help="比べる基準の JSON")
+    parser.add_argument("--threshold", type=float, default=0.2, help="p95 が何割遅くなったら退行とみなすか")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="これより小さい差は無視")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    workdir, db_path = prepare_database(args.size)
+    routes = build_routes(db_path, rng)
+    if args.route:
+        routes = [r for r in routes if any(part in r[0] for part in args.route)]
+
+    if args.server == "gunicorn":
+        driver = GunicornDriver(db_path, args.workers, args.threads)
+    elif args.server == "asgi":
+        driver = AsgiDriver(db_path, args.workers, args.threads)
+    else:
+        driver = TestClientDriver(db_path)
+    if args.hold_streams:
+        if args.server == "testclient":
+            parser.error("--hold-streams は --server gunicorn / asgi のときだけ使えます")
+        driver.hold_streams(args.hold_streams)
+
+    results = {
+        "meta": {
+            "size": args.size,
+            "server": args.server,
+            "clients": args.clients,
+            "requests_per_client": args.requests,
+            "workers": args.workers if args.server != "testclient" else None,
+            "threads": args.threads if args.server != "testclient" else None,
+            "hold_streams": args.hold_streams,
+            "git": git_revision(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "routes": {},
+    }
+
+    try:
+        for route in routes:
+            stats = run_route(driver, route, args.clients, args.requests)
+            results["routes"][route[0]] = stats
+            print(
+                f"{route[0]:<32} p50 {stats['p50_ms']}ms  p95 {stats['p95_ms']}ms  "
+                f"p99 {stats['p99_ms']}ms  {stats['throughput_rps']} req/s  "
+                f"エラー {stats['errors']}"
+            )
+    finally:
+        driver.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"結果を保存しました: {args.out}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        for key in ("size", "server", "clients"):
+            if baseline.get("meta", {}).get(key) != results["meta"][key]:
+                print(f"注意: 基準と {key} が違います（{baseline.get('meta', {}).get(key)} → {results['meta'][key]}）")
+        regressions = compare(results, baseline, args.threshold, args.min_delta_ms)
+        for name, before, after in regressions:
+            print(f"退行: {name}: p95 {before}ms → {after}ms")
+        if regressions:
+            sys.exit(1)
+        print("基準からの退行はありません")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""/events の負荷試験：何百台ものタブレットがつなぎっぱなしにしている状態を再現します
+
+    gunicorn --worker-class gthread --threads 300 -w 2 app:app &
+    python bench/sse_load.py --url http://127.0.0.1:8000 --subscribers 300 --writes 20
+
+全員がつながったあとに /add_stock/<id> で在庫を変え、各接続にイベントが届くまでの
+時間（p50/p95/最大）と、届かなかった接続の数を表示します。
+"""
+import argparse
+import http.client
+import json
+import statistics
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+def subscriber(host, port, ready, received, stop, errors):
+    try:
+        conn = http.client.HTTPConnection(host, port, timeout=60)
+        conn.request("GET", "/events", headers={"Accept": "text/event-stream"})
+        response = conn.getresponse()
+        ready.release()
+        while not stop.is_set():
+            line = response.fp.readline()
+            if not line:
+                break
+            if line.startswith(b"data: "):
+                event = json.loads(line[6:])
+                received.append((time.perf_counter(), event.get("seq")))
+    except OSError as e:
+        errors.append(str(e))
+        ready.release()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--subscribers", type=int, default=300)
+    parser.add_argument("--writes", type=int, default=20)
+    parser.add_argument("--product-id", type=int, default=1)
+    parser.add_argument("--interval", type=float, default=1.0, help="書き込みの間隔（秒）")
+    args = parser.parse_args()
+
+    url = urlsplit(args.url)
+    host, port = url.hostname, url.port or 80
+
+    ready = threading.Semaphore(0)
+    stop = threading.Event()
+    errors = []
+    inboxes = [[] for _ in range(args.subscribers)]
+    threads = [
+        threading.Thread(
+            target=subscriber, args=(host, port, ready, inbox, stop, errors), daemon=True
+        )
+        for inbox in inboxes
+    ]
+    for t in threads:
+        t.start()
+    for _ in threads:
+        ready.acquire()
+    print(f"接続済み: {args.subscribers - len(errors)} / 失敗: {len(errors)}")
+
+    latencies = []
+    missed = 0
+    for _ in range(args.writes):
+        counts = [len(inbox) for inbox in inboxes]
+        conn = http.client.HTTPConnection(host, port, timeout=30)
+        sent_at = time.perf_counter()
+        conn.request("POST", f"/add_stock/{args.product_id}")
+        conn.getresponse().read()
+        conn.close()
+
+        time.sleep(args.interval)
+        for inbox, count in zip(inboxes, counts):
+            if len(inbox) > count:
+                latencies.append(inbox[count][0] - sent_at)
+            else:
+                missed += 1
+
+    stop.set()
+    if latencies:
+        latencies.sort()
+        p95 = latencies[int(len(latencies) * 0.95) - 1]
+        print(
+            f"配信: {len(latencies)} 件 / 未着: {missed} 件 / "
+            f"p50 {statistics.median(latencies) * 1000:.1f}ms / "
+            f"p95 {p95 * 1000:.1f}ms / 最大 {latencies[-1] * 1000:.1f}ms"
+        )
+    else:
+        print(f"イベントが1件も届きませんでした（未着: {missed} 件）")
+
+
+if __name__ == "__main__":
+    main()
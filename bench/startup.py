@@ -0,0 +1,155 @@
+"""gunicorn の起動のしかたごとに、起動にかかる時間と最初のリクエストの遅さを測ります
+
+    python bench/startup.py --size medium --workers 4 --out bench/results/startup.json
+
+Tailwind CSS をビルドしていないと /readyz が 200 にならないので、先に npm install しておきます。
+
+次の3つを比べます。
+
+    lazy      app:app（最初の /readyz で裏で温め始める。温まるのは /readyz が呼ばれたワーカーだけ）
+    factory   app:create_app()（ワーカーごとに温める）
+    preload   --preload app:create_app()（マスターで一度だけ温めてから fork）
+
+起動してから /healthz が応答するまで（listen）と /readyz が 200 になるまで（ready）の時間、
+そのあと新しい接続で各画面を最初に開いたときのレイテンシ（first request）を出します。
+ワーカーの割り振りはカーネル任せなので、画面ごとにワーカー数の2倍の回数だけ開いて
+中央値と最大を見ます。リリースごとの比較には /readyz（と PANTRY_STARTUP_LOG）の
+ステップごとの時間も残します。
+"""
+import argparse
+import http.client
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from generate_db import SIZES  # noqa: E402
+from run import git_revision, prepare_database  # noqa: E402
+
+MODES = {
+    "lazy": ["app:app"],
+    "factory": ["app:create_app()"],
+    "preload": ["--preload", "app:create_app()"],
+}
+
+# 最初に開いたときの遅さを測る画面
+PAGES = ["/", "/arrival/select", "/departure/select", "/stock_list", "/shopping_list"]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def get(port, path, timeout=60):
+    """新しい接続で GET し、(ステータス, 本文, ミリ秒) を返す"""
+    started = time.perf_counter()
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+    try:
+        conn.request("GET", path)
+        response = conn.getresponse()
+        body = response.read()
+    finally:
+        conn.close()
+    return response.status, body, (time.perf_counter() - started) * 1000
+
+
+def wait_for(port, path, started, process, timeout):
+    """path が 200 を返すまで待ち、起動からのミリ秒と本文を返す"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("gunicorn が終了しました")
+        try:
+            status, body, _ = get(port, path, timeout=5)
+            if status == 200:
+                return (time.perf_counter() - started) * 1000, body
+        except OSError:
+            pass
+        time.sleep(0.01)
+    raise RuntimeError(f"{path} が {timeout} 秒以内に 200 になりませんでした")
+
+
+def measure(mode, db_path, workers, threads, timeout):
+    port = free_port()
+    command = [
+        sys.executable, "-m", "gunicorn",
+        "--workers", str(workers),
+        "--worker-class", "gthread",
+        "--threads", str(threads),
+        "--bind", f"127.0.0.1:{port}",
+        "--log-level", "warning",
+        *MODES[mode],
+    ]
+    env = dict(os.environ, PANTRY_DATABASE=db_path)
+
+    started = time.perf_counter()
+    process = subprocess.Popen(command, cwd=ROOT_DIR, env=env)
+    try:
+        listen_ms, _ = wait_for(port, "/healthz", started, process, timeout)
+        ready_ms, body = wait_for(port, "/readyz", started, process, timeout)
+        readyz = json.loads(body)
+
+        pages = {}
+        for path in PAGES:
+            durations = sorted(get(port, path)[2] for _ in range(workers * 2))
+            pages[path] = {"p50_ms": statistics.median(durations), "max_ms": durations[-1]}
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+    return {
+        "listen_ms": listen_ms,
+        "ready_ms": ready_ms,
+        "import_ms": readyz.get("import_ms"),
+        "warm_up_ms": readyz.get("warm_up_ms"),
+        "steps": readyz.get("steps"),
+        "first_requests": pages,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="起動時間と最初のリクエストの遅さを測ります")
+    parser.add_argument("--size", choices=SIZES, default="small")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--timeout", type=float, default=120, help="起動を待つ最大秒数")
+    parser.add_argument("--out", help="結果を JSON で保存する先")
+    args = parser.parse_args()
+
+    report = {"revision": git_revision(), "size": args.size, "workers": args.workers, "modes": {}}
+    print(f"{'起動方法':<8} {'listen':>9} {'ready':>9} {'温め':>9} {'最初の画面 p50':>14} {'最大':>9}")
+    for mode in args.modes:
+        workdir, db_path = prepare_database(args.size)
+        try:
+            result = measure(mode, db_path, args.workers, args.threads, args.timeout)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        report["modes"][mode] = result
+
+        firsts = result["first_requests"].values()
+        p50 = statistics.median(page["p50_ms"] for page in firsts)
+        worst = max(page["max_ms"] for page in firsts)
+        print(
+            f"{mode:<8} {result['listen_ms']:>7.0f}ms {result['ready_ms']:>7.0f}ms "
+            f"{result['warm_up_ms'] or 0:>7.0f}ms {p50:>12.1f}ms {worst:>7.1f}ms"
+        )
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
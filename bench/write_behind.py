@@ -0,0 +1,136 @@
+"""+1/-1 ボタンの連打を、1件ずつ書く場合とまとめ書きの場合で比べます
+
+    python bench/write_behind.py --size small --threads 16 --taps 200
+
+同じデータベースのコピーに同じタップを流し、1秒あたりのタップ数・コミット数と、
+最後の在庫・ログ件数が両方で一致するかを表示します。
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+
+# 床（0未満にしない）に当たると順番で結果が変わるので、対象商品の在庫を先に増やしておきます
+START_STOCK = 1_000_000
+
+
+def prepare(size, products):
+    sys.path.insert(0, BENCH_DIR)
+    from generate_db import SIZES, generate
+
+    source = os.path.join(BENCH_DIR, "data", f"{size}.db")
+    if not os.path.exists(source):
+        generate(source, *SIZES[size])
+
+    workdir = tempfile.mkdtemp(prefix="pantry-write-behind-")
+    paths = {}
+    for mode in ("sync", "write_behind"):
+        path = os.path.join(workdir, f"{mode}.db")
+        shutil.copyfile(source, path)
+        conn = sqlite3.connect(path)
+        conn.execute(
+            "UPDATE products SET current_stock = ? WHERE id <= ?", (START_STOCK, products)
+        )
+        conn.commit()
+        conn.close()
+        paths[mode] = path
+    return workdir, paths
+
+
+def run_mode(args):
+    """子プロセス側: PANTRY_DATABASE のデータベースにタップを流して結果を JSON で出す"""
+    sys.path.insert(0, ROOT_DIR)
+    import stock
+    import write_behind
+    from logs import LogEvent
+
+    change = write_behind.change_stock if args.mode == "write_behind" else stock.change_stock
+
+    def worker(index):
+        rng = random.Random(args.seed + index)
+        for _ in range(args.taps):
+            product_id = rng.randint(1, args.products)
+            if rng.random() < 0.7:
+                change(product_id, -1.0, 1, LogEvent.DEPARTURE, 1.0, 0)
+            else:
+                change(product_id, 1.0, 1, LogEvent.ARRIVAL, 1.0)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.threads)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    taps = args.threads * args.taps
+    commits = write_behind.queue.stats()["batches"] if args.mode == "write_behind" else taps
+    print(json.dumps({"taps": taps, "commits": commits, "seconds": elapsed}))
+
+
+def snapshot(path, products):
+    conn = sqlite3.connect(path)
+    stocks = conn.execute(
+        "SELECT id, current_stock FROM products WHERE id <= ? ORDER BY id", (products,)
+    ).fetchall()
+    logs = conn.execute(
+        "SELECT product_id, event, COUNT(*), SUM(quantity) FROM inventory_logs "
+        "GROUP BY product_id, event ORDER BY product_id, event"
+    ).fetchall()
+    conn.close()
+    return stocks, logs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="まとめ書き込みのベンチマーク")
+    parser.add_argument("--size", default="small")
+    parser.add_argument("--threads", type=int, default=16, help="同時に連打するスタッフ数")
+    parser.add_argument("--taps", type=int, default=200, help="1スレッドあたりのタップ数")
+    parser.add_argument("--products", type=int, default=20, help="連打する商品の数（人気商品）")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--mode", choices=["sync", "write_behind"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args)
+        return
+
+    workdir, paths = prepare(args.size, args.products)
+    results = {}
+    try:
+        for mode, path in paths.items():
+            output = subprocess.check_output(
+                [sys.executable, __file__, "--mode", mode]
+                + ["--threads", str(args.threads), "--taps", str(args.taps)]
+                + ["--products", str(args.products), "--seed", str(args.seed)],
+                env=dict(os.environ, PANTRY_DATABASE=path),
+                text=True,
+            )
+            result = json.loads(output.strip().splitlines()[-1])
+            results[mode] = result
+            print(
+                f"{mode:<13} {result['taps']} タップ / {result['commits']} コミット / "
+                f"{result['seconds']:.2f}秒  → {result['taps'] / result['seconds']:.0f} タップ/秒, "
+                f"{result['commits'] / result['seconds']:.0f} コミット/秒"
+            )
+
+        same = snapshot(paths["sync"], args.products) == snapshot(paths["write_behind"], args.products)
+        print("在庫とログの結果:", "一致" if same else "不一致")
+        if not same:
+            sys.exit(1)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import threading
+
+from db import current_database
+from queries import (
+    ACTIVE_PRODUCTS_BY_CATEGORY,
+    ACTIVE_PRODUCTS_BY_NAME,
+    ACTIVE_PRODUCTS_RECENT,
+    CATEGORIES,
+    LOW_STOCK_COUNT,
+    LOW_STOCK_ITEMS,
+)
+
+
+def current_generation(conn):
+    """商品・カテゴリの世代番号（トリガーで書き込みのたびに増えます）
+
+    PRAGMA data_version は接続ごとの値でプール内の接続同士では比べられないので、
+    全ワーカー共通の世代カウンター行を見ます。
+    """
+    row = conn.execute("SELECT generation FROM cache_generation WHERE id = 1").fetchone()
+    return row[0] if row else None
+
+
+class ReadCache:
+    """世代番号つきの読み取りキャッシュ（ワーカープロセスごと）"""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, conn, key, loader):
+        """世代が変わっていなければキャッシュを、変わっていれば loader(conn) の結果を返す"""
+        # 世代番号は店舗（データベース）ごとなので、キャッシュも店舗ごとに分けます
+        key = (current_database(), key)
+        # 先に世代を読んでおけば、途中で書き込みがあっても古いデータが残ることはありません
+        generation = current_generation(conn)
+        if generation is None:
+            self.misses += 1
+            return loader(conn)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == generation:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        value = loader(conn)
+        with self._lock:
+            self._entries[key] = (generation, value)
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+read_cache = ReadCache()
+
+
+def _rows(query):
+    return lambda conn: conn.execute(query).fetchall()
+
+
+def active_products_recent(conn):
+    return read_cache.get(conn, "active_products_recent", _rows(ACTIVE_PRODUCTS_RECENT))
+
+
+def active_products_by_name(conn):
+    return read_cache.get(conn, "active_products_by_name", _rows(ACTIVE_PRODUCTS_BY_NAME))
+
+
+def active_products_by_category(conn):
+    return read_cache.get(
+        conn, "active_products_by_category", _rows(ACTIVE_PRODUCTS_BY_CATEGORY)
+    )
+
+
+def categories(conn):
+    return read_cache.get(conn, "categories", _rows(CATEGORIES))
+
+
+def low_stock_count(conn):
+    return read_cache.get(
+        conn, "low_stock_count", lambda c: c.execute(LOW_STOCK_COUNT).fetchone()[0]
+    )
+
+
+def low_stock_items(conn):
+    return read_cache.get(conn, "low_stock_items", _rows(LOW_STOCK_ITEMS))
@@ -0,0 +1,348 @@
+import contextvars
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+DATABASE = os.environ.get("PANTRY_DATABASE", "pantry_track.db")
+
+# 1ワーカーあたりの最大接続数
+POOL_SIZE = int(os.environ.get("PANTRY_DB_POOL_SIZE", "5"))
+# 接続の空きを待つ最大秒数
+POOL_TIMEOUT = float(os.environ.get("PANTRY_DB_POOL_TIMEOUT", "10.0"))
+# 1ワーカーで同時に接続を開いておく店舗（データベース）の数
+MAX_OPEN_STORES = int(os.environ.get("PANTRY_MAX_OPEN_STORES", "32"))
+
+# 接続を作ったときに一度だけ流す PRAGMA
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",  # 約16MB
+    "PRAGMA mmap_size=268435456",  # 256MB
+    "PRAGMA busy_timeout=10000",
+)
+
+
+# SQLITE_BUSY のときのリトライ回数と待ち時間（秒）
+BUSY_RETRIES = 5
+BUSY_BACKOFF = 0.05
+
+
+class PoolTimeout(sqlite3.OperationalError):
+    """プールに空きが出ないまま待ち時間を過ぎたときのエラー"""
+
+
+def is_busy_error(e):
+    """ロック競合（SQLITE_BUSY / SQLITE_LOCKED）かどうか"""
+    if not isinstance(e, sqlite3.OperationalError):
+        return False
+    code = getattr(e, "sqlite_errorcode", None)
+    if code is not None:
+        return code & 0xFF in (5, 6)
+    message = str(e)
+    return "locked" in message or "busy" in message
+
+
+def retry_busy(attempt):
+    """attempt() を実行し、ロック競合で失敗したときは少しずつ待ち時間を延ばしてやり直す"""
+    for n in range(BUSY_RETRIES + 1):
+        try:
+            return attempt()
+        except sqlite3.OperationalError as e:
+            if not is_busy_error(e) or n == BUSY_RETRIES:
+                raise
+            delay = BUSY_BACKOFF * (2 ** n)
+            time.sleep(delay + random.uniform(0, delay))
+
+
+class ConnectionPool:
+    """ワーカープロセスごとの SQLite 接続プール"""
+
+    def __init__(self, database, size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self._idle = []
+        self._created = 0
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self._stats = {
+            "checkouts": 0,
+            "connects": 0,
+            "health_check_failures": 0,
+            "timeouts": 0,
+            "wait_total": 0.0,
+            "wait_max": 0.0,
+            "peak_in_use": 0,
+        }
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database, timeout=10.0, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    @staticmethod
+    def _is_healthy(conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+        except sqlite3.Error:
+            return False
+        return True
+
+    def acquire(self):
+        """接続を1本借りる（空きがなければ timeout 秒まで待つ）"""
+        started = time.perf_counter()
+        deadline = started + self.timeout
+        conn = None
+
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._created < self.size:
+                    # 枠だけ先に確保して、実際の接続はロックの外で作る
+                    self._created += 1
+                    break
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeout("データベース接続の空き待ちがタイムアウトしました")
+                self._cond.wait(remaining)
+
+            self._in_use += 1
+            self._stats["peak_in_use"] = max(self._stats["peak_in_use"], self._in_use)
+
+        try:
+            if conn is not None and not self._is_healthy(conn):
+                self._stats["health_check_failures"] += 1
+                self._close_quietly(conn)
+                conn = None
+            if conn is None:
+                conn = self._connect()
+                self._stats["connects"] += 1
+        except Exception:
+            with self._cond:
+                self._created -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        waited = time.perf_counter() - started
+        with self._cond:
+            self._stats["checkouts"] += 1
+            self._stats["wait_total"] += waited
+            self._stats["wait_max"] = max(self._stats["wait_max"], waited)
+        return conn
+
+    def release(self, conn, discard=False):
+        """借りた接続を返す（壊れていれば捨てる）"""
+        if not discard and conn.in_transaction:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                discard = True
+
+        with self._cond:
+            self._in_use -= 1
+            if discard:
+                self._created -= 1
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+        if discard:
+            self._close_quietly(conn)
+
+    def prime(self, count=None):
+        """起動時に接続を count 本（省略時はプールの大きさまで）作っておき、作った数を返す
+
+        最初のリクエストで接続を作ったりスキーマを読んだりして待たせないためのものです。
+        """
+        count = self.size if count is None else min(count, self.size)
+        with self._cond:
+            missing = max(0, count - self._created)
+            self._created += missing
+
+        conns = []
+        try:
+            for _ in range(missing):
+                conn = self._connect()
+                conns.append(conn)
+                # スキーマを読み込ませ、先頭のページをキャッシュに載せておきます
+                conn.execute("SELECT 1 FROM products LIMIT 1").fetchall()
+        finally:
+            with self._cond:
+                self._created -= missing - len(conns)
+                self._stats["connects"] += len(conns)
+                self._idle.extend(conns)
+                self._cond.notify_all()
+        return len(conns)
+
+    def reset(self):
+        """fork 後の子プロセスで、親から引き継いだ接続を捨てる"""
+        self._idle = []
+        self._created = 0
+        self._in_use = 0
+        self._cond = threading.Condition()
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+        for conn in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        """待ち時間と使用中の接続数"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update(
+                size=self.size,
+                in_use=self._in_use,
+                idle=len(self._idle),
+                open=self._created,
+            )
+        checkouts = stats["checkouts"]
+        stats["wait_avg"] = stats["wait_total"] / checkouts if checkouts else 0.0
+        return stats
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+
+class PoolRegistry:
+    """データベースファイルごとの接続プール（複数店舗のとき用）
+
+    プールは最初に使われたときに作り、開いている数が max_open を超えたら
+    いちばん長く使われていない店舗の接続を閉じます（使用中の店舗は閉じません）。
+    """
+
+    def __init__(self, max_open=MAX_OPEN_STORES):
+        self.max_open = max_open
+        self._pools = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, database):
+        with self._lock:
+            pool = self._pools.get(database)
+            if pool is None:
+                pool = self._pools[database] = ConnectionPool(database)
+            self._pools.move_to_end(database)
+            evicted = self._evict()
+        for old in evicted:
+            old.close_all()
+        return pool
+
+    def _evict(self):
+        evicted = []
+        for database in list(self._pools):
+            if len(self._pools) <= self.max_open:
+                break
+            pool = self._pools[database]
+            if pool.stats()["in_use"]:
+                continue
+            evicted.append(self._pools.pop(database))
+            self.evictions += 1
+        return evicted
+
+    def discard(self, database):
+        """ファイルを差し替えたときなどに、その店舗の接続を閉じる"""
+        with self._lock:
+            pool = self._pools.pop(database, None)
+        if pool is not None:
+            pool.close_all()
+
+    def reset(self):
+        """fork 後の子プロセスで、親から引き継いだ接続を捨てる"""
+        for pool in self._pools.values():
+            pool.reset()
+        self._pools = OrderedDict()
+        self._lock = threading.Lock()
+
+    def databases(self):
+        """接続を開いている店舗のデータベースの一覧"""
+        with self._lock:
+            return list(self._pools)
+
+    def stats(self):
+        with self._lock:
+            return {"open_stores": len(self._pools), "max_open": self.max_open, "evictions": self.evictions}
+
+
+pools = PoolRegistry()
+
+# このリクエスト（スレッド）が使うデータベース。1店舗だけなら DATABASE のままです
+_current_database = contextvars.ContextVar("pantry_database", default=DATABASE)
+
+
+def current_database():
+    return _current_database.get()
+
+
+def set_database(database):
+    """このリクエストのデータベースを切り替え、元に戻すためのトークンを返す
+
+    tenants.py がリクエストの最初に呼び、終わりに reset_database(トークン) で戻します。
+    """
+    return _current_database.set(database)
+
+
+def reset_database(token):
+    _current_database.reset(token)
+
+
+@contextmanager
+def use_database(database):
+    """ブロックの中だけ、別の店舗のデータベースを使う"""
+    token = _current_database.set(database)
+    try:
+        yield database
+    finally:
+        _current_database.reset(token)
+
+
+def current_pool():
+    return pools.get(current_database())
+
+
+# 借りた接続を包む関数（perf.init_app が SQL の計測を有効にしたときだけ入ります）
+connection_hook = None
+
+# gunicorn がワーカーを fork したら、親の接続は使わずに作り直す
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=pools.reset)
+
+
+@contextmanager
+def get_db_connection():
+    """データベース接続を管理するコンテキストマネージャー"""
+    pool = current_pool()
+    conn = pool.acquire()
+    discard = False
+    try:
+        yield conn if connection_hook is None else connection_hook(conn)
+    except Exception:
+        try:
+            conn.rollback()
+        except sqlite3.Error:
+            discard = True
+        raise
+    else:
+        try:
+            conn.commit()
+        except sqlite3.Error:
+            discard = True
+            raise
+    finally:
+        pool.release(conn, discard=discard)
@@ -0,0 +1,136 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from db import MAX_OPEN_STORES, POOL_TIMEOUT, PRAGMAS, PoolTimeout, current_database, retry_busy
+
+# 書き込み用のスレッドの数（店舗ごとにどれか1本に決まるので、複数店舗のときだけ効きます）
+WRITERS = int(os.environ.get("PANTRY_DB_WRITERS", "4"))
+# 実行待ちにできる処理の数（これを超えたら PoolTimeout で断ります）
+MAX_PENDING = int(os.environ.get("PANTRY_DB_MAX_PENDING", "256"))
+
+
+class SQLiteExecutor:
+    """SQLite の書き込みを専用のスレッドで実行する
+
+    書き込みは1つの店舗（データベース）につき1本のスレッドが順番に実行します。
+    同じワーカーの中では書き込み同士がロックを取り合わないので、SQLITE_BUSY になるのは
+    CLI の処理やバックアップなど、ほかのプロセスがロックを持っているときだけです
+    （そのときは書き込み用のスレッドの中で、待ち時間を延ばしながらやり直します）。
+    どの店舗のデータベースを使うかは、呼び出した側の db.current_database() で決まります。
+
+    読み取りはここでは受け持ちません。Flask のルートはもともと上限のあるスレッドプール
+    （asgi.py の PANTRY_ASYNC_THREADS）で動き、ワーカーの接続プール（PANTRY_DB_POOL_SIZE）
+    から読むので、読み取り専用のスレッドに渡し直しても往復が増えるだけでした。
+    """
+
+    def __init__(self, writers=WRITERS, max_pending=MAX_PENDING):
+        self.writers = writers
+        self._local = threading.local()
+        self._pending = threading.BoundedSemaphore(max_pending)
+        # 店舗ごとに決まった1本に流すので、同じ店舗の書き込みは来た順に実行されます
+        self._write_pools = [
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"db-write-{i}") for i in range(writers)
+        ]
+        self._stats_lock = threading.Lock()
+        self._stats = {"writes": 0, "rejected": 0}
+
+    def _connection(self, database):
+        # スレッドごと・店舗ごとに1本だけ作り、以後は使い回します
+        conns = getattr(self._local, "conns", None)
+        if conns is None:
+            conns = self._local.conns = OrderedDict()
+        conn = conns.get(database)
+        if conn is None:
+            conn = sqlite3.connect(database, timeout=10.0)
+            conn.row_factory = sqlite3.Row
+            for pragma in PRAGMAS:
+                conn.execute(pragma)
+            conns[database] = conn
+            # 店舗が多いときは、しばらく使っていない店舗の接続から閉じます
+            while len(conns) > MAX_OPEN_STORES:
+                conns.popitem(last=False)[1].close()
+        conns.move_to_end(database)
+        return conn
+
+    def _run_write(self, database, work, args, kwargs):
+        conn = self._connection(database)
+
+        def attempt():
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = work(conn, *args, **kwargs)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            return result
+
+        return retry_busy(attempt)
+
+    def _write_pool(self, database):
+        return self._write_pools[zlib.crc32(database.encode("utf-8")) % self.writers]
+
+    def _submit(self, work, args, kwargs, block):
+        if not self._pending.acquire(blocking=block, timeout=POOL_TIMEOUT if block else None):
+            with self._stats_lock:
+                self._stats["rejected"] += 1
+            raise PoolTimeout("データベースの処理待ちがいっぱいです")
+        with self._stats_lock:
+            self._stats["writes"] += 1
+        database = current_database()
+        future = self._write_pool(database).submit(self._run_write, database, work, args, kwargs)
+        future.add_done_callback(lambda _: self._pending.release())
+        return future
+
+    def write(self, work, *args, **kwargs):
+        """BEGIN IMMEDIATE のあと work(conn, ...) を書き込み用のスレッドで実行し、コミットする"""
+        return self._submit(work, args, kwargs, block=True).result()
+
+    async def awrite(self, work, *args, **kwargs):
+        # イベントループを止めないよう、待ちがいっぱいならすぐに断ります
+        future = self._submit(work, args, kwargs, block=False)
+        return await asyncio.wrap_future(future)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats.update(writers=self.writers)
+        return stats
+
+    def shutdown(self):
+        # 接続は各スレッドが持っているので、スレッドごと終わらせます
+        for pool in self._write_pools:
+            pool.shutdown(wait=True)
+
+
+# 非同期モード（asgi.py）で起動したときだけ作られます
+executor = None
+
+
+def start(writers=WRITERS):
+    global executor
+    if executor is None:
+        executor = SQLiteExecutor(writers)
+    return executor
+
+
+def stop():
+    global executor
+    if executor is not None:
+        executor.shutdown()
+        executor = None
+
+
+def _reset_after_fork():
+    # 親のスレッドは子プロセスにはないので、必要になったら作り直します
+    global executor
+    executor = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,159 @@
+import gzip
+import hashlib
+import os
+import sqlite3
+from functools import wraps
+
+from flask import current_app, make_response, request, session
+
+import tenants
+from cache import current_generation
+from db import get_db_connection
+
+try:
+    import brotli
+except ImportError:  # brotli が入っていなければ gzip だけ使います
+    brotli = None
+
+# 圧縮する Content-Type と最小サイズ（バイト）
+COMPRESSIBLE_TYPES = {
+    "text/html",
+    "text/css",
+    "text/plain",
+    "application/javascript",
+    "application/json",
+    "image/svg+xml",
+}
+COMPRESS_MIN_SIZE = 500
+
+# ?v=<ハッシュ> 付きの静的ファイルは中身が変わるとURLも変わるので、1年キャッシュさせます
+STATIC_MAX_AGE = 60 * 60 * 24 * 365
+
+_static_hashes = {}
+
+
+def _hash_files(*directories):
+    digest = hashlib.md5()
+    for directory in directories:
+        for root, dirs, files in os.walk(directory):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                digest.update(path.encode())
+                with open(path, "rb") as f:
+                    digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+def static_file_hash(static_folder, filename):
+    """静的ファイルの中身のハッシュ（更新日時が変わったときだけ計算し直す）"""
+    path = os.path.join(static_folder, filename)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+
+    cached = _static_hashes.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    with open(path, "rb") as f:
+        file_hash = hashlib.md5(f.read()).hexdigest()[:12]
+    _static_hashes[path] = (mtime, file_hash)
+    return file_hash
+
+
+def generation_etag(view):
+    """商品・カテゴリの世代番号から ETag を作り、変わっていなければ 304 を返す
+
+    フラッシュメッセージが残っているときは、毎回描画します。
+    """
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method != "GET" or session.get("_flashes"):
+            return view(*args, **kwargs)
+
+        try:
+            with get_db_connection() as conn:
+                generation = current_generation(conn)
+        except sqlite3.Error:
+            generation = None
+        if generation is None:
+            return view(*args, **kwargs)
+
+        # ヘッダーに担当者名が出るので、担当者ごとに別の ETag にします
+        # （複数店舗なら、同じ URL でも店舗ごとに世代が違うので店舗名も入れます）
+        etag = f"{current_app.config['BUILD_ID']}-{generation}-{session.get('staff_id', 1)}"
+        store = tenants.current_store()
+        if store:
+            etag = f"{store}-{etag}"
+        if request.if_none_match.contains_weak(etag):
+            response = current_app.response_class(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200 or session.get("_flashes"):
+                return response
+
+        response.set_etag(etag, weak=True)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+
+    return wrapper
+
+
+def _compress(response):
+    if (
+        response.status_code != 200
+        or response.direct_passthrough
+        or response.is_streamed
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESSIBLE_TYPES
+    ):
+        return response
+
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+
+    encodings = request.accept_encodings
+    if brotli is not None and encodings["br"]:
+        response.set_data(brotli.compress(data, quality=5))
+        response.headers["Content-Encoding"] = "br"
+    elif encodings["gzip"]:
+        response.set_data(gzip.compress(data, compresslevel=6))
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        return response
+
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def init_app(app):
+    """静的ファイルのハッシュ付きURL・長期キャッシュ・レスポンス圧縮を設定する"""
+    # テンプレートや CSS/JS が変わったら ETag も変わるように、中身のハッシュを混ぜます
+    app.config.setdefault(
+        "BUILD_ID",
+        _hash_files(
+            app.template_folder and os.path.join(app.root_path, app.template_folder),
+            os.path.join(app.static_folder, "css"),
+            os.path.join(app.static_folder, "js"),
+        ),
+    )
+
+    @app.url_defaults
+    def add_static_hash(endpoint, values):
+        if endpoint == "static" and "filename" in values and "v" not in values:
+            file_hash = static_file_hash(app.static_folder, values["filename"])
+            if file_hash:
+                values["v"] = file_hash
+
+    @app.after_request
+    def cache_and_compress(response):
+        if request.endpoint == "static" and request.args.get("v"):
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = STATIC_MAX_AGE
+            response.cache_control.immutable = True
+        return _compress(response)
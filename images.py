@@ -0,0 +1,211 @@
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import url_for
+from PIL import Image, ImageOps
+
+PRODUCTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "products")
+# 縮小した画像の置き場所（中身のハッシュをファイル名にするので、同じ画像は作り直しません）
+VARIANTS_DIR = os.path.join(PRODUCTS_DIR, "variants")
+
+# サイズ名と長辺のピクセル数（元画像より大きくはしません）
+SIZES = {
+    "thumb": 192,
+    "card": 480,
+    "full": 1200,
+}
+
+# 拡張子と Pillow の保存設定
+FORMATS = {
+    "jpg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True}),
+    "webp": ("WEBP", {"quality": 80, "method": 4}),
+}
+
+ALLOWED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+
+
+def file_digest(path):
+    with open(path, "rb") as f:
+        return hashlib.md5(f.read()).hexdigest()[:16]
+
+
+def _manifest_path(digest):
+    return os.path.join(VARIANTS_DIR, f"{digest}.json")
+
+
+def _save_atomic(image, path, fmt, options):
+    tmp_path = f"{path}.tmp"
+    image.save(tmp_path, fmt, **options)
+    os.replace(tmp_path, path)
+
+
+def build_variants(source_path):
+    """元画像からサイズ違い・WebP版を作り、{サイズ名: [幅, 高さ]} を返す"""
+    digest = file_digest(source_path)
+    manifest_path = _manifest_path(digest)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    os.makedirs(VARIANTS_DIR, exist_ok=True)
+    with Image.open(source_path) as original:
+        image = ImageOps.exif_transpose(original).convert("RGB")
+
+    dimensions = {}
+    for size, max_px in SIZES.items():
+        resized = image.copy()
+        resized.thumbnail((max_px, max_px), Image.LANCZOS)
+        for ext, (fmt, options) in FORMATS.items():
+            path = os.path.join(VARIANTS_DIR, f"{digest}-{size}.{ext}")
+            _save_atomic(resized, path, fmt, options)
+        dimensions[size] = list(resized.size)
+
+    # 目録は最後に書くので、目録があれば全サイズそろっています
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(dimensions, f)
+    os.replace(tmp_path, manifest_path)
+    return dimensions
+
+
+class ImageVariants:
+    """テンプレートで srcset を組み立てるための、1枚の画像のサイズ違い一覧"""
+
+    def __init__(self, digest, dimensions):
+        self.digest = digest
+        self.dimensions = dimensions
+
+    def path(self, size, ext="jpg"):
+        return f"products/variants/{self.digest}-{size}.{ext}"
+
+    def src(self, size="card", ext="jpg"):
+        return url_for("static", filename=self.path(size, ext))
+
+    def srcset(self, ext="jpg"):
+        return ", ".join(
+            f"{self.src(size, ext)} {width}w"
+            for size, (width, _) in self.dimensions.items()
+        )
+
+    def width(self, size="card"):
+        return self.dimensions[size][0]
+
+    def height(self, size="card"):
+        return self.dimensions[size][1]
+
+
+# {image_path: (元画像の更新日時, 確認したときの variants_version(), ImageVariants or None)}
+_variants_cache = {}
+_variants_lock = threading.Lock()
+
+
+def variants_version():
+    """サイズ違いの置き場所の更新日時（ファイルを作るたびに変わります。なければ None）
+
+    ほかのプロセス（flask build-thumbnails など）が作ったかどうかも、これでわかります。
+    """
+    try:
+        return os.stat(VARIANTS_DIR).st_mtime_ns
+    except OSError:
+        return None
+
+
+def forget_variants(image_path=None):
+    """覚えている確認結果を捨てる（image_path を省略したらすべて）"""
+    with _variants_lock:
+        if image_path is None:
+            _variants_cache.clear()
+        else:
+            _variants_cache.pop(image_path, None)
+
+
+def image_variants(image_path):
+    """サイズ違いが作ってあれば ImageVariants を、なければ None を返す"""
+    if not image_path:
+        return None
+
+    source_path = os.path.join(PRODUCTS_DIR, image_path)
+    try:
+        mtime = os.path.getmtime(source_path)
+    except OSError:
+        return None
+
+    with _variants_lock:
+        cached = _variants_cache.get(image_path)
+    if cached and cached[0] == mtime:
+        # まだ作っていない画像は、置き場所に何か作られるまで元画像を読み直しません
+        if cached[2] is not None or cached[1] == variants_version():
+            return cached[2]
+
+    # 目録を見る前に読んでおけば、その間に作られた分は次の呼び出しで見つかります
+    version = variants_version()
+    digest = file_digest(source_path)
+    variants = None
+    try:
+        with open(_manifest_path(digest), encoding="utf-8") as f:
+            variants = ImageVariants(digest, json.load(f))
+    except (OSError, ValueError):
+        pass
+
+    with _variants_lock:
+        _variants_cache[image_path] = (mtime, version, variants)
+    return variants
+
+
+def save_product_image(file_storage):
+    """アップロードされた画像を保存してサイズ違いを作り、image_path を返す"""
+    ext = os.path.splitext(file_storage.filename or "")[1].lower()
+    if ext not in ALLOWED_EXTENSIONS:
+        raise ValueError("画像は jpg / png / webp でアップロードしてください")
+
+    data = file_storage.read()
+    digest = hashlib.md5(data).hexdigest()[:16]
+    image_path = f"{digest}{ext}"
+    source_path = os.path.join(PRODUCTS_DIR, image_path)
+
+    os.makedirs(PRODUCTS_DIR, exist_ok=True)
+    with open(source_path, "wb") as f:
+        f.write(data)
+
+    try:
+        build_variants(source_path)
+    except Image.DecompressionBombError as e:
+        os.remove(source_path)
+        raise ValueError("画像が大きすぎます（画素数を減らしてからアップロードしてください）") from e
+    except OSError as e:
+        os.remove(source_path)
+        raise ValueError("画像を読み込めませんでした") from e
+    finally:
+        forget_variants(image_path)
+    return image_path
+
+
+def _source_images():
+    for name in sorted(os.listdir(PRODUCTS_DIR)):
+        path = os.path.join(PRODUCTS_DIR, name)
+        if os.path.isfile(path) and os.path.splitext(name)[1].lower() in ALLOWED_EXTENSIONS:
+            yield path
+
+
+def backfill(workers=None):
+    """static/products にある画像のサイズ違いを、プロセスプールでまとめて作る
+
+    (作った枚数, 失敗した [(ファイル名, エラー)]) を返します。
+    """
+    sources = list(_source_images())
+    built = 0
+    failures = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(build_variants, path): path for path in sources}
+        for future, path in futures.items():
+            try:
+                future.result()
+                built += 1
+            except (OSError, Image.DecompressionBombError) as e:
+                # 壊れた画像・大きすぎる画像があっても、ほかの画像は作り続けます
+                failures.append((os.path.basename(path), str(e)))
+    forget_variants()
+    return built, failures
@@ -0,0 +1,285 @@
+import asyncio
+import json
+import queue
+import sqlite3
+import threading
+import time
+
+from db import current_database, get_db_connection, use_database
+
+# 変更フィードを見に行く間隔と、何もないときに送る keep-alive の間隔（秒）
+POLL_INTERVAL = 0.5
+HEARTBEAT_INTERVAL = 15.0
+# 1接続あたりにためておけるイベント数（あふれたら切断して、再接続してもらいます）
+SUBSCRIBER_QUEUE_SIZE = 100
+
+CHANGES_SINCE = """
+    SELECT p.id, p.current_stock, p.reorder_level, p.stock_status, MAX(c.seq) AS seq
+    FROM product_changes c
+    JOIN products p ON p.id = c.product_id
+    WHERE c.seq > ?
+    GROUP BY p.id
+"""
+
+
+def latest_seq(conn):
+    return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM product_changes").fetchone()[0]
+
+
+def changes_since(conn, seq):
+    """seq より後に変わった商品をまとめたイベントを返す（なければ None）
+
+    もう消えてしまった範囲からの続きを求められたときは reload イベントを返します。
+    """
+    oldest = conn.execute("SELECT MIN(seq) FROM product_changes").fetchone()[0]
+    if oldest is not None and seq < oldest - 1:
+        return {"seq": latest_seq(conn), "reload": True}
+
+    rows = conn.execute(CHANGES_SINCE, (seq,)).fetchall()
+    if not rows:
+        return None
+
+    low_stock_count = conn.execute("SELECT COUNT(*) FROM low_stock_products").fetchone()[0]
+    return {
+        "seq": max(row["seq"] for row in rows),
+        "low_stock_count": low_stock_count,
+        "products": [
+            {
+                "id": row["id"],
+                "current_stock": row["current_stock"],
+                "reorder_level": row["reorder_level"],
+                # 在庫の状態は書き込みのときにトリガーで決めてあります（migrations 0012）
+                "status": row["stock_status"],
+            }
+            for row in rows
+        ],
+    }
+
+
+def format_event(event):
+    return f"id: {event['seq']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+class Subscriber:
+    """スレッドで待つ接続（WSGI の /events 用）"""
+
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def offer(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            return False
+        return True
+
+    def close(self):
+        # 読み残しを1件捨ててでも、終わりの合図（None）を入れます
+        try:
+            self.queue.get_nowait()
+        except queue.Empty:
+            pass
+        self.queue.put_nowait(None)
+
+    def get(self, timeout):
+        """次のイベント（timeout 秒来なければ queue.Empty）"""
+        return self.queue.get(timeout=timeout)
+
+
+class AsyncSubscriber:
+    """イベントループで待つ接続（asgi.py の /events 用）
+
+    broker のスレッドからはループに直接触れないので、call_soon_threadsafe で渡します。
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def offer(self, event):
+        # ループの外から見た件数なので目安ですが、あふれた分は _put で切断します
+        if self.queue.qsize() >= SUBSCRIBER_QUEUE_SIZE:
+            return False
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # ループがもう閉じている
+            return False
+        return True
+
+    def _put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self._close()
+
+    def close(self):
+        try:
+            self.loop.call_soon_threadsafe(self._close)
+        except RuntimeError:
+            pass
+
+    def _close(self):
+        try:
+            self.queue.get_nowait()
+        except asyncio.QueueEmpty:
+            pass
+        self.queue.put_nowait(None)
+
+    async def get(self, timeout):
+        """次のイベント（timeout 秒来なければ queue.Empty）"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            raise queue.Empty from None
+
+
+class ChangeBroker:
+    """ワーカーごとに1本のスレッドで変更フィードを見張り、接続中の端末に配る
+
+    どのワーカーで書き込んでもトリガーで product_changes に残るので、
+    ワーカーが何台あっても全員に届きます。複数店舗なら店舗（データベース）ごとに1つです。
+    """
+
+    def __init__(self, database, poll_interval=POLL_INTERVAL):
+        self.database = database
+        self.poll_interval = poll_interval
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._last_seq = None
+
+    def subscribe(self, q=None):
+        q = q or Subscriber()
+        with self._lock:
+            self._subscribers.add(q)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="change-broker", daemon=True)
+                self._thread.start()
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    # 誰も見ていなければスレッドを止め、次の接続で作り直します
+                    self._thread = None
+                    self._last_seq = None
+                    return
+            try:
+                self.poll()
+            except sqlite3.Error:
+                pass
+            time.sleep(self.poll_interval)
+
+    def poll(self):
+        with use_database(self.database), get_db_connection() as conn:
+            if self._last_seq is None:
+                self._last_seq = latest_seq(conn)
+                return
+            if latest_seq(conn) <= self._last_seq:
+                return
+            event = changes_since(conn, self._last_seq)
+
+        if event is None:
+            return
+        self._last_seq = event["seq"]
+        self.publish(event)
+
+    def publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            if not q.offer(event):
+                # 読むのが遅すぎる接続は切って、Last-Event-ID で再接続してもらいます
+                self.unsubscribe(q)
+                q.close()
+
+
+_brokers = {}
+_brokers_lock = threading.Lock()
+
+
+def broker_for(database=None):
+    """店舗（データベース）の ChangeBroker（なければ作る）"""
+    database = database or current_database()
+    with _brokers_lock:
+        broker = _brokers.get(database)
+        if broker is None:
+            broker = _brokers[database] = ChangeBroker(database)
+        return broker
+
+
+def event_stream(last_event_id=None, heartbeat=HEARTBEAT_INTERVAL, database=None):
+    """SSE の本文を順に返すジェネレーター"""
+    database = database or current_database()
+    broker = broker_for(database)
+    q = broker.subscribe()
+    try:
+        yield "retry: 3000\n\n"
+
+        # 再接続のときは、切れていた間の変更を先に送ります
+        if last_event_id is not None:
+            with use_database(database), get_db_connection() as conn:
+                backlog = changes_since(conn, last_event_id)
+            if backlog is not None:
+                yield format_event(backlog)
+
+        while True:
+            try:
+                event = q.get(heartbeat)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            if event is None:
+                return
+            yield format_event(event)
+    finally:
+        broker.unsubscribe(q)
+
+
+def _read_changes_since(database, seq):
+    with use_database(database), get_db_connection() as conn:
+        return changes_since(conn, seq)
+
+
+async def async_event_stream(
+    last_event_id=None, heartbeat=HEARTBEAT_INTERVAL, database=None, executor=None
+):
+    """event_stream の非同期版（待っている間はスレッドを使いません）
+
+    つなぎ直しのときの取りこぼし分は、executor（asgi.py ではルート用のスレッドプール）で読みます。
+    """
+    database = database or current_database()
+    broker = broker_for(database)
+    q = broker.subscribe(AsyncSubscriber(asyncio.get_running_loop()))
+    try:
+        yield "retry: 3000\n\n"
+
+        if last_event_id is not None:
+            loop = asyncio.get_running_loop()
+            backlog = await loop.run_in_executor(
+                executor, _read_changes_since, database, last_event_id
+            )
+            if backlog is not None:
+                yield format_event(backlog)
+
+        while True:
+            try:
+                event = await q.get(heartbeat)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            if event is None:
+                return
+            yield format_event(event)
+    finally:
+        broker.unsubscribe(q)
@@ -0,0 +1,187 @@
+import json
+import re
+from datetime import date, timedelta
+from enum import IntEnum
+
+# 1ページ（1回の読み込み）で表示する件数
+PAGE_SIZE = 50
+
+
+class LogEvent(IntEnum):
+    """inventory_logs.event に保存する操作の種別（数字は保存されるので変えないでください）"""
+
+    OTHER = 0
+    ARRIVAL = 1
+    DEPARTURE = 2
+    WASTE = 3
+    BULK_ARRIVAL = 4
+    PRODUCT_DELETED = 5
+    PRODUCT_EDITED = 6
+
+    @property
+    def label(self):
+        return EVENT_LABELS[self]
+
+
+# 画面に出す名前（以前は type 列にこの文字列をそのまま入れていました）
+EVENT_LABELS = {
+    LogEvent.OTHER: "その他",
+    LogEvent.ARRIVAL: "入庫",
+    LogEvent.DEPARTURE: "出庫",
+    LogEvent.WASTE: "廃棄",
+    LogEvent.BULK_ARRIVAL: "一括入庫",
+    LogEvent.PRODUCT_DELETED: "商品削除",
+    LogEvent.PRODUCT_EDITED: "修正完了",
+}
+
+# 種別フィルターの選択肢
+LOG_EVENTS = [event for event in LogEvent if event != LogEvent.OTHER]
+
+# 在庫が増える種別（一覧で色を分けます）
+INCOMING_EVENTS = {LogEvent.ARRIVAL, LogEvent.BULK_ARRIVAL}
+
+_LEGACY_EDIT = re.compile(r"^修正完了 \[名前:(.*) / 在庫:(.*) / 発注点:(.*)\]$")
+
+
+def encode_details(details):
+    """details 列に入れる、空白なしの JSON"""
+    if not details:
+        return None
+    return json.dumps(details, ensure_ascii=False, separators=(",", ":"))
+
+
+def event_from_legacy_type(log_type):
+    """以前の type 列の文字列を (LogEvent, details の JSON) にする"""
+    for event, label in EVENT_LABELS.items():
+        if log_type == label and event != LogEvent.OTHER:
+            return event, None
+
+    match = _LEGACY_EDIT.match(log_type or "")
+    if match:
+        name, stock, reorder_level = match.groups()
+        return LogEvent.PRODUCT_EDITED, encode_details(
+            {"name": name, "stock": stock, "reorder_level": reorder_level}
+        )
+    # どれにも当てはまらない文字列は、中身を残して「その他」にします
+    return LogEvent.OTHER, encode_details({"text": log_type})
+
+
+def describe_log(log):
+    """一覧に出す種別の表示（商品の修正は変更後の内容も付けます）"""
+    try:
+        event = LogEvent(log["event"])
+    except ValueError:
+        event = LogEvent.OTHER
+    details = json.loads(log["details"]) if log["details"] else {}
+
+    if event == LogEvent.PRODUCT_EDITED and details:
+        stock = details["stock"]
+        if "unit" in details:
+            stock = f"{stock}{details['unit'] or ''}"
+        return (
+            f"{event.label} [名前:{details['name']} / 在庫:{stock} / "
+            f"発注点:{details['reorder_level']}]"
+        )
+    if event == LogEvent.OTHER and "text" in details:
+        return details["text"]
+    return event.label
+
+
+def parse_cursor(cursor):
+    """'created_at|id' 形式のカーソルを (created_at, id) にする"""
+    if not cursor:
+        return None
+    created_at, _, log_id = cursor.rpartition("|")
+    if not created_at:
+        raise ValueError("カーソルの形式が正しくありません")
+    return created_at, int(log_id)
+
+
+def make_cursor(log):
+    return f"{log['created_at']}|{log['id']}"
+
+
+def parse_filters(args):
+    """クエリ文字列から絞り込み条件を取り出す（空の項目は無視）"""
+    filters = {}
+    for key in ("product_id", "staff_id"):
+        value = args.get(key, "")
+        if value:
+            filters[key] = int(value)
+
+    event = args.get("event", "")
+    if event:
+        filters["event"] = LogEvent(int(event))
+
+    for key in ("date_from", "date_to"):
+        value = args.get(key, "")
+        if value:
+            filters[key] = date.fromisoformat(value)
+    return filters
+
+
+LOGS_SELECT = """
+    SELECT l.*, p.name AS product_name, s.name AS staff_name
+    FROM inventory_logs l
+    JOIN products p ON l.product_id = p.id
+    JOIN staffs s ON l.staff_id = s.id
+"""
+
+
+def _filter_clauses(filters):
+    """絞り込み条件から (WHERE の条件のリスト, パラメータ) を作る"""
+    where = []
+    params = []
+
+    if "product_id" in filters:
+        where.append("l.product_id = ?")
+        params.append(filters["product_id"])
+    if "staff_id" in filters:
+        where.append("l.staff_id = ?")
+        params.append(filters["staff_id"])
+    if "event" in filters:
+        where.append("l.event = ?")
+        params.append(int(filters["event"]))
+    if "date_from" in filters:
+        where.append("l.created_at >= ?")
+        params.append(filters["date_from"].isoformat())
+    if "date_to" in filters:
+        where.append("l.created_at < ?")
+        params.append((filters["date_to"] + timedelta(days=1)).isoformat())
+    return where, params
+
+
+def build_logs_query(filters, cursor=None, limit=PAGE_SIZE):
+    """操作履歴1ページ分の (SQL, パラメータ) を組み立てる"""
+    where, params = _filter_clauses(filters)
+    if cursor:
+        where.append("(l.created_at, l.id) < (?, ?)")
+        params.extend(cursor)
+
+    query = LOGS_SELECT
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    query += " ORDER BY l.created_at DESC, l.id DESC LIMIT ?"
+    params.append(limit + 1)
+    return query, params
+
+
+def build_logs_export_query(filters):
+    """書き出し用に、絞り込んだ操作履歴を古い順に全件読む (SQL, パラメータ)"""
+    where, params = _filter_clauses(filters)
+    query = LOGS_SELECT
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    query += " ORDER BY l.created_at, l.id"
+    return query, params
+
+
+def fetch_logs_page(conn, filters, cursor=None, limit=PAGE_SIZE):
+    """(created_at, id) の降順で、カーソルの次の1ページ分を取得する
+
+    (ログのリスト, 次のページのカーソル or None) を返します。
+    """
+    query, params = build_logs_query(filters, cursor, limit)
+    logs = conn.execute(query, params).fetchall()
+    next_cursor = make_cursor(logs[limit - 1]) if len(logs) > limit else None
+    return logs[:limit], next_cursor
@@ -0,0 +1,562 @@
+import sqlite3
+from datetime import date
+
+from db import current_database
+from logs import LogEvent, build_logs_query, event_from_legacy_type
+from queries import (
+    ACTIVE_PRODUCTS_BY_CATEGORY,
+    ACTIVE_PRODUCTS_BY_NAME,
+    ACTIVE_PRODUCTS_RECENT,
+    LOW_STOCK_COUNT,
+    LOW_STOCK_ITEMS,
+    PRODUCT_USAGE_SINCE,
+)
+from search import build_stock_query
+
+# 0008 で1回のトランザクションで書き換える件数
+BACKFILL_BATCH_SIZE = 10_000
+
+
+def backfill_log_events(conn, batch_size=BACKFILL_BATCH_SIZE):
+    """type 列の文字列から event / details を埋める
+
+    ログは件数が多いので、id 順に batch_size 件ずつ別々のトランザクションで書き換えます。
+    途中で止まっても、event が空の行から続きをやり直せます。
+    """
+    last_id = 0
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        rows = conn.execute(
+            """
+            SELECT id, type FROM inventory_logs
+            WHERE id > ? AND event IS NULL
+            ORDER BY id
+            LIMIT ?
+            """,
+            (last_id, batch_size),
+        ).fetchall()
+        conn.executemany(
+            "UPDATE inventory_logs SET event = ?, details = ? WHERE id = ?",
+            [(*event_from_legacy_type(log_type), log_id) for log_id, log_type in rows],
+        )
+        conn.commit()
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1][0]
+
+
+# (バージョン, 説明, SQL または関数) の一覧。バージョン名の順に適用します。
+# 一度適用したものは書き換えず、変更は新しいバージョンとして足してください。
+MIGRATIONS = [
+    (
+        "0000_base_schema",
+        "基本テーブル",
+        """
+        CREATE TABLE IF NOT EXISTS categories (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS staffs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            role TEXT NOT NULL DEFAULT 'staff'
+        );
+        CREATE TABLE IF NOT EXISTS products (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            category_id INTEGER REFERENCES categories (id),
+            origin TEXT,
+            current_stock REAL NOT NULL DEFAULT 0,
+            unit TEXT,
+            reorder_level REAL DEFAULT 1,
+            image_path TEXT,
+            is_active INTEGER NOT NULL DEFAULT 1,
+            touch_count INTEGER NOT NULL DEFAULT 0,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE IF NOT EXISTS inventory_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_id INTEGER NOT NULL REFERENCES products (id),
+            staff_id INTEGER NOT NULL REFERENCES staffs (id),
+            type TEXT NOT NULL,
+            quantity REAL NOT NULL DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+        -- スタッフ未選択のときは 1:マスター として記録しています
+        INSERT OR IGNORE INTO staffs (id, name, role) VALUES (1, 'マスター', 'admin');
+        """,
+    ),
+    (
+        "0001_logs_keyset_indexes",
+        "操作履歴のページ送り・絞り込み用インデックス",
+        """
+        CREATE INDEX IF NOT EXISTS idx_logs_created
+            ON inventory_logs (created_at, id);
+        CREATE INDEX IF NOT EXISTS idx_logs_product_created
+            ON inventory_logs (product_id, created_at, id);
+        CREATE INDEX IF NOT EXISTS idx_logs_staff_created
+            ON inventory_logs (staff_id, created_at, id);
+        CREATE INDEX IF NOT EXISTS idx_logs_type_created
+            ON inventory_logs (type, created_at, id);
+        """,
+    ),
+    (
+        "0002_products_hot_path_indexes",
+        "トップページ・お買い物リスト・商品管理用インデックス",
+        """
+        CREATE INDEX IF NOT EXISTS idx_products_active_updated
+            ON products (is_active, updated_at);
+        CREATE INDEX IF NOT EXISTS idx_products_active_stock
+            ON products (is_active, current_stock, reorder_level);
+        CREATE INDEX IF NOT EXISTS idx_products_active_name
+            ON products (is_active, name);
+        CREATE INDEX IF NOT EXISTS idx_products_active_category
+            ON products (is_active, category_id, name);
+        """,
+    ),
+    (
+        "0003_cache_generation",
+        "読み取りキャッシュ用の世代カウンター",
+        """
+        CREATE TABLE IF NOT EXISTS cache_generation (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            generation INTEGER NOT NULL DEFAULT 0
+        );
+        INSERT OR IGNORE INTO cache_generation (id, generation) VALUES (1, 0);
+
+        -- 商品・カテゴリが変わったら、同じトランザクションの中で世代を進めます
+        CREATE TRIGGER IF NOT EXISTS trg_products_insert_generation
+        AFTER INSERT ON products BEGIN
+            UPDATE cache_generation SET generation = generation + 1 WHERE id = 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_products_update_generation
+        AFTER UPDATE ON products BEGIN
+            UPDATE cache_generation SET generation = generation + 1 WHERE id = 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_products_delete_generation
+        AFTER DELETE ON products BEGIN
+            UPDATE cache_generation SET generation = generation + 1 WHERE id = 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_categories_insert_generation
+        AFTER INSERT ON categories BEGIN
+            UPDATE cache_generation SET generation = generation + 1 WHERE id = 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_categories_update_generation
+        AFTER UPDATE ON categories BEGIN
+            UPDATE cache_generation SET generation = generation + 1 WHERE id = 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_categories_delete_generation
+        AFTER DELETE ON categories BEGIN
+            UPDATE cache_generation SET generation = generation + 1 WHERE id = 1;
+        END;
+        """,
+    ),
+    (
+        "0004_low_stock_products",
+        "発注点を下回った商品の一覧（トリガーで更新）",
+        """
+        CREATE TABLE IF NOT EXISTS low_stock_products (
+            product_id INTEGER PRIMARY KEY REFERENCES products (id),
+            since DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+
+        INSERT OR IGNORE INTO low_stock_products (product_id)
+            SELECT id FROM products
+            WHERE is_active = 1 AND current_stock <= reorder_level;
+
+        CREATE TRIGGER IF NOT EXISTS trg_products_insert_low_stock
+        AFTER INSERT ON products
+        WHEN NEW.is_active = 1 AND NEW.current_stock <= NEW.reorder_level
+        BEGIN
+            INSERT OR IGNORE INTO low_stock_products (product_id) VALUES (NEW.id);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_products_update_low_stock
+        AFTER UPDATE OF current_stock, reorder_level, is_active ON products
+        BEGIN
+            DELETE FROM low_stock_products
+            WHERE product_id = OLD.id
+              AND NOT (NEW.is_active = 1 AND NEW.current_stock <= NEW.reorder_level);
+            INSERT OR IGNORE INTO low_stock_products (product_id)
+            SELECT NEW.id
+            WHERE NEW.is_active = 1 AND NEW.current_stock <= NEW.reorder_level;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_products_delete_low_stock
+        AFTER DELETE ON products
+        BEGIN
+            DELETE FROM low_stock_products WHERE product_id = OLD.id;
+        END;
+        """,
+    ),
+    (
+        "0005_product_changes",
+        "リアルタイム更新用の変更フィード",
+        """
+        CREATE TABLE IF NOT EXISTS product_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_id INTEGER NOT NULL,
+            changed_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+
+        CREATE TRIGGER IF NOT EXISTS trg_products_insert_change
+        AFTER INSERT ON products BEGIN
+            INSERT INTO product_changes (product_id) VALUES (NEW.id);
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_products_update_change
+        AFTER UPDATE ON products BEGIN
+            INSERT INTO product_changes (product_id) VALUES (NEW.id);
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_logs_insert_change
+        AFTER INSERT ON inventory_logs BEGIN
+            INSERT INTO product_changes (product_id) VALUES (NEW.product_id);
+        END;
+
+        -- 直近1万件だけ残します（それより古い続きを求められたら、画面ごと読み直してもらいます）
+        CREATE TRIGGER IF NOT EXISTS trg_product_changes_prune
+        AFTER INSERT ON product_changes BEGIN
+            DELETE FROM product_changes WHERE seq <= NEW.seq - 10000;
+        END;
+        """,
+    ),
+    (
+        "0006_daily_product_usage",
+        "商品ごと・日ごとの使用量の集計と、集計済みのログの位置",
+        """
+        CREATE TABLE IF NOT EXISTS daily_product_usage (
+            product_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            consumed REAL NOT NULL DEFAULT 0,
+            wasted REAL NOT NULL DEFAULT 0,
+            received REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (product_id, day)
+        ) WITHOUT ROWID;
+        -- 期間で絞って合計するときに表を読まずに済むよう、数量も含めておきます
+        CREATE INDEX IF NOT EXISTS idx_daily_usage_day
+            ON daily_product_usage (day, product_id, consumed, wasted, received);
+
+        -- inventory_logs のどの id まで集計したか（1行だけのテーブル）
+        CREATE TABLE IF NOT EXISTS usage_rollup_watermark (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_log_id INTEGER NOT NULL DEFAULT 0,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+        INSERT OR IGNORE INTO usage_rollup_watermark (id, last_log_id) VALUES (1, 0);
+        """,
+    ),
+    (
+        "0007_log_event_columns",
+        "操作履歴に種別の番号と詳細（JSON）の列を追加",
+        """
+        ALTER TABLE inventory_logs ADD COLUMN event INTEGER;
+        ALTER TABLE inventory_logs ADD COLUMN details TEXT;
+        """,
+    ),
+    (
+        "0008_log_event_backfill",
+        "既存の操作履歴の type 文字列を event / details に書き換え",
+        backfill_log_events,
+    ),
+    (
+        "0009_log_event_index",
+        "種別の索引を番号に切り替え、type 列を削除",
+        """
+        DROP INDEX IF EXISTS idx_logs_type_created;
+        CREATE INDEX IF NOT EXISTS idx_logs_event_created
+            ON inventory_logs (event, created_at, id);
+        ALTER TABLE inventory_logs DROP COLUMN type;
+        """,
+    ),
+    (
+        "0010_products_search",
+        "在庫一覧の商品名検索（FTS5 trigram）と、索引の作り直し待ちの一覧",
+        """
+        -- rowid は products.id。kana は表記をそろえた名前、romaji はそのローマ字読み（search.py）
+        CREATE VIRTUAL TABLE IF NOT EXISTS products_fts
+            USING fts5(kana, romaji, tokenize = 'trigram');
+
+        -- 読み仮名は SQL で作れないので、名前が変わった商品をここに積んでおき、
+        -- search.sync_index() で products_fts に反映します
+        CREATE TABLE IF NOT EXISTS product_search_dirty (
+            product_id INTEGER PRIMARY KEY
+        );
+        INSERT OR IGNORE INTO product_search_dirty (product_id) SELECT id FROM products;
+
+        CREATE TRIGGER IF NOT EXISTS trg_products_insert_search
+        AFTER INSERT ON products BEGIN
+            INSERT OR IGNORE INTO product_search_dirty (product_id) VALUES (NEW.id);
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_products_update_search
+        AFTER UPDATE OF name ON products
+        WHEN NEW.name IS NOT OLD.name
+        BEGIN
+            INSERT OR IGNORE INTO product_search_dirty (product_id) VALUES (NEW.id);
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_products_delete_search
+        AFTER DELETE ON products BEGIN
+            DELETE FROM products_fts WHERE rowid = OLD.id;
+            DELETE FROM product_search_dirty WHERE product_id = OLD.id;
+        END;
+        """,
+    ),
+    (
+        "0011_sync_ops",
+        "オフライン操作の受付済みID",
+        """
+        -- タブレットが作った操作IDごとに、反映済みかどうかを覚えておきます（sync.py）。
+        -- 同じ操作が再送されても二重に在庫を動かさないためのもので、古いものから消します
+        CREATE TABLE IF NOT EXISTS sync_ops (
+            op_id TEXT PRIMARY KEY,
+            product_id INTEGER,
+            status TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_sync_ops_applied_at ON sync_ops (applied_at);
+        """,
+    ),
+    (
+        "0012_products_display",
+        "商品カードのアイコンと在庫の状態（トリガーで更新）",
+        """
+        -- 商品カードに出すアイコンと状態は、画面を出すたびに全商品ぶん判定せず、
+        -- 書き込みのときに決めておきます（templates/macros/product_card.html）
+        ALTER TABLE products ADD COLUMN icon TEXT;
+        ALTER TABLE products ADD COLUMN stock_status TEXT;
+
+        UPDATE products SET
+            icon = CASE
+                WHEN instr(name, 'コーヒー') THEN '☕'
+                WHEN instr(name, '牛乳') OR instr(name, 'ミルク') THEN '🥛'
+                WHEN instr(name, 'クリーム') THEN '🍶'
+                WHEN instr(name, '砂糖') THEN '🧂'
+                WHEN instr(name, '豆') THEN '🫘'
+                WHEN instr(name, 'チョコ') THEN '🍫'
+                WHEN instr(name, '茶') THEN '🍵'
+                ELSE '📦'
+            END,
+            stock_status = CASE
+                WHEN NOT is_active THEN 'inactive'
+                WHEN current_stock <= 0 THEN 'out'
+                WHEN current_stock <= reorder_level THEN 'low'
+                ELSE 'ok'
+            END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_products_insert_display
+        AFTER INSERT ON products BEGIN
+            UPDATE products SET
+                icon = CASE
+                    WHEN instr(NEW.name, 'コーヒー') THEN '☕'
+                    WHEN instr(NEW.name, '牛乳') OR instr(NEW.name, 'ミルク') THEN '🥛'
+                    WHEN instr(NEW.name, 'クリーム') THEN '🍶'
+                    WHEN instr(NEW.name, '砂糖') THEN '🧂'
+                    WHEN instr(NEW.name, '豆') THEN '🫘'
+                    WHEN instr(NEW.name, 'チョコ') THEN '🍫'
+                    WHEN instr(NEW.name, '茶') THEN '🍵'
+                    ELSE '📦'
+                END,
+                stock_status = CASE
+                    WHEN NOT NEW.is_active THEN 'inactive'
+                    WHEN NEW.current_stock <= 0 THEN 'out'
+                    WHEN NEW.current_stock <= NEW.reorder_level THEN 'low'
+                    ELSE 'ok'
+                END
+            WHERE id = NEW.id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_products_update_icon
+        AFTER UPDATE OF name ON products
+        WHEN NEW.name IS NOT OLD.name
+        BEGIN
+            UPDATE products SET
+                icon = CASE
+                    WHEN instr(NEW.name, 'コーヒー') THEN '☕'
+                    WHEN instr(NEW.name, '牛乳') OR instr(NEW.name, 'ミルク') THEN '🥛'
+                    WHEN instr(NEW.name, 'クリーム') THEN '🍶'
+                    WHEN instr(NEW.name, '砂糖') THEN '🧂'
+                    WHEN instr(NEW.name, '豆') THEN '🫘'
+                    WHEN instr(NEW.name, 'チョコ') THEN '🍫'
+                    WHEN instr(NEW.name, '茶') THEN '🍵'
+                    ELSE '📦'
+                END
+            WHERE id = NEW.id;
+        END;
+
+        -- 在庫の増減のたびではなく、状態が変わるとき（発注点・0をまたぐとき）だけ書き込みます
+        CREATE TRIGGER IF NOT EXISTS trg_products_update_status
+        AFTER UPDATE OF current_stock, reorder_level, is_active ON products
+        WHEN NEW.stock_status IS NOT CASE
+            WHEN NOT NEW.is_active THEN 'inactive'
+            WHEN NEW.current_stock <= 0 THEN 'out'
+            WHEN NEW.current_stock <= NEW.reorder_level THEN 'low'
+            ELSE 'ok'
+        END
+        BEGIN
+            UPDATE products SET
+                stock_status = CASE
+                    WHEN NOT NEW.is_active THEN 'inactive'
+                    WHEN NEW.current_stock <= 0 THEN 'out'
+                    WHEN NEW.current_stock <= NEW.reorder_level THEN 'low'
+                    ELSE 'ok'
+                END
+            WHERE id = NEW.id;
+        END;
+        """,
+    ),
+    (
+        "0013_products_search_long_vowels",
+        "長音を母音に置き換える読み仮名で、商品名検索の索引を作り直し",
+        """
+        -- 読み仮名は SQL で作れないので、全商品を積み直して起動時の search.refresh_index() に任せます
+        DELETE FROM products_fts;
+        INSERT OR IGNORE INTO product_search_dirty (product_id) SELECT id FROM products;
+        """,
+    ),
+    (
+        "0014_sync_ops_rejected",
+        "受け付けなかったオフライン操作の理由と中身",
+        """
+        -- タブレットは rejected の操作もキューから消すので、あとから確かめられるように残します
+        ALTER TABLE sync_ops ADD COLUMN error TEXT;
+        ALTER TABLE sync_ops ADD COLUMN payload TEXT;
+        """,
+    ),
+]
+
+# 実行計画をチェックするルートのクエリ（名前, SQL, パラメータ）
+QUERY_PLAN_CHECKS = [
+    ("index: 在庫一覧", ACTIVE_PRODUCTS_RECENT, ()),
+    ("index: 残りわずかの件数", LOW_STOCK_COUNT, ()),
+    ("shopping_list", LOW_STOCK_ITEMS, ()),
+    ("arrival/departure/waste_select", ACTIVE_PRODUCTS_BY_NAME, ()),
+    ("manage_products", ACTIVE_PRODUCTS_BY_CATEGORY, ()),
+    ("shopping_list: 使用量", PRODUCT_USAGE_SINCE, ("2000-01-01",)),
+    ("view_logs", *build_logs_query({})),
+    ("view_logs: 続き", *build_logs_query({}, ("2000-01-01 00:00:00", 1))),
+    ("view_logs: 商品", *build_logs_query({"product_id": 1})),
+    ("view_logs: 担当者", *build_logs_query({"staff_id": 1})),
+    ("view_logs: 種別", *build_logs_query({"event": LogEvent.ARRIVAL})),
+    (
+        "view_logs: 期間",
+        *build_logs_query({"date_from": date(2000, 1, 1), "date_to": date(2000, 1, 31)}),
+    ),
+    ("stock_list", *build_stock_query({"sort": "stock-asc"})),
+    ("stock_list: 補充が必要", *build_stock_query({"sort": "stock-asc", "status": "low"})),
+    ("stock_list: 在庫切れ", *build_stock_query({"sort": "stock-asc", "status": "out"})),
+    ("stock_list: カテゴリ", *build_stock_query({"sort": "name", "category_id": 1})),
+    ("stock_list: 検索", *build_stock_query({"sort": "stock-asc", "q": "コーヒー豆"})),
+]
+
+# マスタ表や発注点割れの一覧のように、全件読むのが前提のテーブル
+FULL_SCAN_ALLOWED = {"categories", "staffs", "low_stock_products"}
+
+# インデックス順にたどって LIMIT で止まるので、全件は読まないと確かめてある (名前, 実行計画の行)。
+# SQL に LIMIT があるかどうかでは判断しません（サブクエリの全件スキャンを見逃すため）
+ORDERED_SCANS_ALLOWED = {
+    ("view_logs", "SCAN l USING INDEX idx_logs_created"),
+}
+
+
+def applied_versions(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version TEXT PRIMARY KEY,
+            description TEXT,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    return {row[0] for row in conn.execute("SELECT version FROM schema_migrations")}
+
+
+def _statements(script):
+    """SQL の文を1つずつ返す（トリガーの BEGIN ... END の中の ; では区切りません）"""
+    statement = ""
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            yield statement
+            statement = ""
+    if statement.strip():
+        yield statement
+
+
+def _begin_unless_applied(conn, version):
+    """書き込みロックを取ってから適用済みかを確かめ、適用済みなら False を返す
+
+    gunicorn のワーカーが同時に起動しても、同じバージョンを二重に流しません。
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    if version in applied_versions(conn):
+        conn.rollback()
+        return False
+    return True
+
+
+def run_migrations(database=None):
+    """未適用のマイグレーションを順番に適用し、適用したバージョンを返す"""
+    database = database or current_database()
+    conn = sqlite3.connect(database, timeout=10.0)
+    try:
+        # 新しいデータベースは最初から auto_vacuum=INCREMENTAL にして、archive.compact() の
+        # incremental_vacuum が使えるようにします。先に WAL にされているとヘッダーが書かれて
+        # いるので VACUUM で切り替えます（表がまだないので一瞬です。既存のものには触れません）
+        if not conn.execute("SELECT EXISTS (SELECT 1 FROM sqlite_master)").fetchone()[0]:
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+        done = applied_versions(conn)
+        conn.commit()
+
+        applied = []
+        for version, description, sql in sorted(MIGRATIONS):
+            if version in done or not _begin_unless_applied(conn, version):
+                continue
+            if callable(sql):
+                # 大きな表を書き換えるものは、関数の中で小分けにコミットします
+                # （途中からやり直せるように書いてあるので、ほかのワーカーと重なっても大丈夫です）
+                conn.commit()
+                sql(conn)
+                if not _begin_unless_applied(conn, version):
+                    continue
+            else:
+                # executescript は始める前に COMMIT してしまうので、1文ずつ流して
+                # スキーマ変更と記録を同じトランザクションに入れます
+                for statement in _statements(sql):
+                    conn.execute(statement)
+            conn.execute(
+                "INSERT INTO schema_migrations (version, description) VALUES (?, ?)",
+                (version, description),
+            )
+            conn.commit()
+            applied.append(version)
+        return applied
+    except sqlite3.Error:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def check_query_plans(conn, checks=QUERY_PLAN_CHECKS):
+    """EXPLAIN QUERY PLAN で全件スキャンになっているクエリを探す
+
+    問題のあった (名前, 実行計画の行) のリストを返します（空なら問題なし）。
+    """
+    problems = []
+    for name, query, params in checks:
+        for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params):
+            detail = row[3]
+            if not detail.startswith("SCAN "):
+                continue
+            table = detail.split()[1]
+            if table in FULL_SCAN_ALLOWED:
+                continue
+            # FTS5 の表は「SCAN ... VIRTUAL TABLE INDEX 0:M2」のように出ます。
+            # 0: のあとに何か付いていれば、全文検索の索引か rowid で引いています
+            if " VIRTUAL TABLE INDEX " in detail and not detail.endswith(":"):
+                continue
+            if (name, detail) in ORDERED_SCANS_ALLOWED:
+                continue
+            problems.append((name, detail))
+    return problems
@@ -0,0 +1,293 @@
+import os
+import threading
+import time
+from collections import deque
+
+from flask import before_render_template, g, has_request_context, request, template_rendered
+
+import db
+
+# 遅いクエリとして記録するしきい値（ミリ秒）と、覚えておく件数
+SLOW_QUERY_MS = float(os.environ.get("PANTRY_SLOW_QUERY_MS", "50"))
+SLOW_QUERY_LOG_SIZE = 200
+
+# ヒストグラムの区切り（ミリ秒）。最後の None は「それより遅い」
+HISTOGRAM_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, None)
+
+# 記録しないルート（静的ファイルと、ロードバランサーが何度も叩くヘルスチェック）
+UNPROFILED_ENDPOINTS = {"static", "healthz", "readyz"}
+
+# ルートごとに覚えておく SQL の種類の上限
+MAX_STATEMENTS_PER_ROUTE = 50
+
+
+def _bucket(ms):
+    for i, upper in enumerate(HISTOGRAM_BUCKETS):
+        if upper is None or ms <= upper:
+            return i
+
+
+class ProfiledCursor:
+    """実行と取り出しの時間・行数を、リクエストの記録に足していくカーソル"""
+
+    def __init__(self, cursor, entry):
+        self._cursor = cursor
+        self._entry = entry
+
+    def _timed(self, fetch):
+        started = time.perf_counter()
+        result = fetch()
+        self._entry["duration"] += time.perf_counter() - started
+        return result
+
+    def fetchone(self):
+        row = self._timed(self._cursor.fetchone)
+        if row is not None:
+            self._entry["rows"] += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._timed(lambda: self._cursor.fetchmany(size or self._cursor.arraysize))
+        self._entry["rows"] += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(self._cursor.fetchall)
+        self._entry["rows"] += len(rows)
+        return rows
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class ProfiledConnection:
+    """execute / executemany / executescript を計測する接続のラッパー"""
+
+    def __init__(self, conn, statements):
+        self._conn = conn
+        self._statements = statements
+
+    def _run(self, method, sql, *args):
+        entry = {"sql": sql, "duration": 0.0, "rows": 0}
+        started = time.perf_counter()
+        try:
+            cursor = method(sql, *args)
+        finally:
+            entry["duration"] = time.perf_counter() - started
+            self._statements.append(entry)
+        if cursor.rowcount > 0:
+            entry["rows"] = cursor.rowcount
+        return ProfiledCursor(cursor, entry)
+
+    def execute(self, sql, parameters=()):
+        return self._run(self._conn.execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._run(self._conn.executemany, sql, seq_of_parameters)
+
+    def executescript(self, script):
+        return self._run(self._conn.executescript, script)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def _wrap_connection(conn):
+    """リクエスト中に借りた接続だけ計測する（バックグラウンドのスレッドはそのまま）"""
+    if not has_request_context():
+        return conn
+    statements = g.get("perf_statements")
+    if statements is None:
+        return conn
+    return ProfiledConnection(conn, statements)
+
+
+class Profiler:
+    """ルートごとの SQL・テンプレート・応答時間の集計（ワーカープロセスごと）"""
+
+    def __init__(self, slow_query_ms=SLOW_QUERY_MS):
+        self.slow_query_ms = slow_query_ms
+        self._routes = {}
+        self._slow_queries = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+        self._lock = threading.Lock()
+
+    def _route_stats(self, route):
+        stats = self._routes.get(route)
+        if stats is None:
+            stats = self._routes[route] = {
+                "requests": 0,
+                "statements": 0,
+                "max_statements": 0,
+                "total_ms": 0.0,
+                "db_ms": 0.0,
+                "render_ms": 0.0,
+                "histogram": [0] * len(HISTOGRAM_BUCKETS),
+                "templates": {},
+                "sql": {},
+            }
+        return stats
+
+    def record(self, route, total, statements, templates):
+        """1リクエスト分の計測結果を集計に足す"""
+        total_ms = total * 1000
+        db_ms = sum(s["duration"] for s in statements) * 1000
+        render_ms = sum(duration for _, duration in templates) * 1000
+
+        with self._lock:
+            stats = self._route_stats(route)
+            stats["requests"] += 1
+            stats["statements"] += len(statements)
+            stats["max_statements"] = max(stats["max_statements"], len(statements))
+            stats["total_ms"] += total_ms
+            stats["db_ms"] += db_ms
+            stats["render_ms"] += render_ms
+            stats["histogram"][_bucket(total_ms)] += 1
+            for name, duration in templates:
+                per_template = stats["templates"].setdefault(name, [0, 0.0])
+                per_template[0] += 1
+                per_template[1] += duration * 1000
+
+            for statement in statements:
+                ms = statement["duration"] * 1000
+                sql = " ".join(statement["sql"].split())
+                per_sql = stats["sql"].get(sql)
+                if per_sql is None:
+                    if len(stats["sql"]) >= MAX_STATEMENTS_PER_ROUTE:
+                        per_sql = None
+                    else:
+                        per_sql = stats["sql"][sql] = {"count": 0, "total_ms": 0.0, "max_ms": 0.0}
+                if per_sql is not None:
+                    per_sql["count"] += 1
+                    per_sql["total_ms"] += ms
+                    per_sql["max_ms"] = max(per_sql["max_ms"], ms)
+
+                if ms >= self.slow_query_ms:
+                    self._slow_queries.appendleft(
+                        {
+                            "at": time.strftime("%Y-%m-%d %H:%M:%S"),
+                            "route": route,
+                            "sql": sql,
+                            "ms": round(ms, 2),
+                            "rows": statement["rows"],
+                        }
+                    )
+        return db_ms, render_ms
+
+    def snapshot(self):
+        """画面・JSON 用に、平均値を計算した集計のコピーを返す"""
+        with self._lock:
+            routes = []
+            for route, stats in self._routes.items():
+                requests = stats["requests"]
+                top_sql = sorted(
+                    stats["sql"].items(), key=lambda item: item[1]["total_ms"], reverse=True
+                )[:5]
+                routes.append(
+                    {
+                        "route": route,
+                        "requests": requests,
+                        "statements": stats["statements"],
+                        "avg_statements": round(stats["statements"] / requests, 1),
+                        "max_statements": stats["max_statements"],
+                        "avg_ms": round(stats["total_ms"] / requests, 2),
+                        "avg_db_ms": round(stats["db_ms"] / requests, 2),
+                        "avg_render_ms": round(stats["render_ms"] / requests, 2),
+                        "histogram": list(stats["histogram"]),
+                        "templates": {
+                            name: round(total_ms / count, 2)
+                            for name, (count, total_ms) in stats["templates"].items()
+                        },
+                        "top_sql": [
+                            {
+                                "sql": sql,
+                                "count": s["count"],
+                                "avg_ms": round(s["total_ms"] / s["count"], 2),
+                                "max_ms": round(s["max_ms"], 2),
+                            }
+                            for sql, s in top_sql
+                        ],
+                    }
+                )
+            slow_queries = list(self._slow_queries)
+
+        routes.sort(key=lambda r: r["avg_ms"] * r["requests"], reverse=True)
+        return {
+            "buckets": [f"≤{b}ms" if b else f">{HISTOGRAM_BUCKETS[-2]}ms" for b in HISTOGRAM_BUCKETS],
+            "slow_query_ms": self.slow_query_ms,
+            "routes": routes,
+            "slow_queries": slow_queries,
+        }
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+            self._slow_queries.clear()
+
+
+profiler = Profiler()
+
+
+def _server_timing(db_ms, statement_count, render_ms, total_ms):
+    return ", ".join(
+        [
+            # ヘッダーには ASCII しか使えないので、説明は英語で
+            f'db;dur={db_ms:.2f};desc="{statement_count} queries"',
+            f'tpl;dur={render_ms:.2f};desc="templates"',
+            f"total;dur={total_ms:.2f}",
+        ]
+    )
+
+
+def init_app(app):
+    """PERF_PROFILING が有効なときだけ、計測のフックを登録する
+
+    無効なら接続もテンプレートも包まないので、余計な処理は一切ありません。
+    """
+    app.config.setdefault("PERF_PROFILING", os.environ.get("PANTRY_PROFILE") == "1")
+    if not app.config["PERF_PROFILING"]:
+        return
+
+    db.connection_hook = _wrap_connection
+
+    @app.before_request
+    def start_profiling():
+        g.perf_started = time.perf_counter()
+        g.perf_statements = []
+        g.perf_templates = []
+
+    @app.after_request
+    def finish_profiling(response):
+        started = g.pop("perf_started", None)
+        if started is None or request.endpoint in UNPROFILED_ENDPOINTS:
+            return response
+
+        total = time.perf_counter() - started
+        statements = g.pop("perf_statements", [])
+        templates = g.pop("perf_templates", [])
+        route = request.url_rule.rule if request.url_rule else "(404)"
+        db_ms, render_ms = profiler.record(route, total, statements, templates)
+
+        response.headers["Server-Timing"] = _server_timing(
+            db_ms, len(statements), render_ms, total * 1000
+        )
+        return response
+
+    def before_render(sender, template, context, **extra):
+        if has_request_context() and "perf_templates" in g:
+            g.perf_render_started = time.perf_counter()
+
+    def after_render(sender, template, context, **extra):
+        started = g.pop("perf_render_started", None) if has_request_context() else None
+        if started is not None:
+            g.perf_templates.append((template.name, time.perf_counter() - started))
+
+    # ローカル関数なので weak=False にしないと、すぐ回収されて外れてしまいます
+    before_render_template.connect(before_render, app, weak=False)
+    template_rendered.connect(after_render, app, weak=False)
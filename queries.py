@@ -0,0 +1,50 @@
+# 複数のルートやマイグレーションの実行計画チェックで共有するクエリ
+
+# トップページ：最近動いた順の在庫一覧
+ACTIVE_PRODUCTS_RECENT = """
+    SELECT p.*, c.name AS category_name
+    FROM products p
+    LEFT JOIN categories c ON p.category_id = c.id
+    WHERE p.is_active = 1
+    ORDER BY p.updated_at DESC
+"""
+
+# トップページ：お買い物が必要な商品の件数
+# low_stock_products はトリガーで在庫の変更と同じトランザクションの中で更新されます
+LOW_STOCK_COUNT = "SELECT COUNT(*) FROM low_stock_products"
+
+# お買い物リスト
+LOW_STOCK_ITEMS = """
+    SELECT p.*, c.name AS category_name
+    FROM low_stock_products
+    JOIN products p ON p.id = low_stock_products.product_id
+    LEFT JOIN categories c ON p.category_id = c.id
+"""
+
+# カテゴリ一覧
+CATEGORIES = "SELECT * FROM categories"
+
+# 入庫・出庫・廃棄の商品選択画面
+ACTIVE_PRODUCTS_BY_NAME = "SELECT * FROM products WHERE is_active = 1 ORDER BY name"
+
+# 商品管理
+ACTIVE_PRODUCTS_BY_CATEGORY = """
+    SELECT p.*, c.name AS category_name
+    FROM products p
+    LEFT JOIN categories c ON p.category_id = c.id
+    WHERE p.is_active = 1
+    ORDER BY p.category_id, p.name
+"""
+
+# お買い物リスト・使用量の分析：直近の日別集計を商品ごとに合計（生のログは読みません）
+PRODUCT_USAGE_SINCE = """
+    SELECT p.id, p.name, p.unit, p.current_stock, p.reorder_level,
+           SUM(u.consumed) AS consumed,
+           SUM(u.wasted) AS wasted,
+           SUM(u.received) AS received
+    -- 期間で絞り込んだ集計行から商品を引く順番に固定します（集計表・商品の全件走査を避ける）
+    FROM daily_product_usage u INDEXED BY idx_daily_usage_day
+    CROSS JOIN products p ON p.id = u.product_id
+    WHERE u.day >= ? AND p.is_active = 1
+    GROUP BY u.product_id
+"""
@@ -0,0 +1,387 @@
+import re
+import unicodedata
+
+from db import get_db_connection
+from stock import run_write
+
+# 在庫一覧の1ページ（1回の読み込み）の件数
+PAGE_SIZE = 30
+# あいまい検索で候補として読む件数と、似ているとみなす割合（3文字ずつの一致の割合）
+FUZZY_CANDIDATES = 200
+FUZZY_THRESHOLD = 0.5
+# 3文字の並びが1つもそろわない短い語（「コヒー」と「コーヒー」など）は、
+# 2文字の並びで候補を読み、1文字違い（編集距離）までを近い商品にします
+TYPO_MAX_LENGTH = 6
+TYPO_DISTANCE = 1
+# trigram の索引は3文字から使えます（それより短い語は索引の表をなめて探します）
+TRIGRAM = 3
+
+STATUSES = ("all", "low", "out")
+
+# 並び順（画面の選択肢の値 → ORDER BY）。既定は在庫の少ない順です
+SORTS = {
+    "stock-asc": "p.current_stock, p.id",
+    "default": "p.id",
+    "name": "p.name, p.id",
+    "recent": "p.updated_at DESC, p.id DESC",
+}
+DEFAULT_SORT = "stock-asc"
+
+# 表記ゆれとして読み飛ばす文字（ハイフン・中黒・空白など）
+_SKIP = re.compile(r"[‐\-・･\s]+")
+# 長音は、前の音の母音に置き換えます（「コーヒー」→「こおひい」）
+_VOWEL_KANA = {"a": "あ", "i": "い", "u": "う", "e": "え", "o": "お"}
+_ROMAJI_SKIP = re.compile(r"[^a-z0-9]+")
+_ROMAJI_LONG = re.compile(r"([a-z])\1+")
+
+# ひらがな → ローマ字（ヘボン式）。拗音は2文字の組み合わせを先に見ます
+_ROMAJI = {
+    "あ": "a", "い": "i", "う": "u", "え": "e", "お": "o",
+    "か": "ka", "き": "ki", "く": "ku", "け": "ke", "こ": "ko",
+    "さ": "sa", "し": "shi", "す": "su", "せ": "se", "そ": "so",
+    "た": "ta", "ち": "chi", "つ": "tsu", "て": "te", "と": "to",
+    "な": "na", "に": "ni", "ぬ": "nu", "ね": "ne", "の": "no",
+    "は": "ha", "ひ": "hi", "ふ": "fu", "へ": "he", "ほ": "ho",
+    "ま": "ma", "み": "mi", "む": "mu", "め": "me", "も": "mo",
+    "や": "ya", "ゆ": "yu", "よ": "yo",
+    "ら": "ra", "り": "ri", "る": "ru", "れ": "re", "ろ": "ro",
+    "わ": "wa", "ゐ": "i", "ゑ": "e", "を": "o", "ん": "n",
+    "が": "ga", "ぎ": "gi", "ぐ": "gu", "げ": "ge", "ご": "go",
+    "ざ": "za", "じ": "ji", "ず": "zu", "ぜ": "ze", "ぞ": "zo",
+    "だ": "da", "ぢ": "ji", "づ": "zu", "で": "de", "ど": "do",
+    "ば": "ba", "び": "bi", "ぶ": "bu", "べ": "be", "ぼ": "bo",
+    "ぱ": "pa", "ぴ": "pi", "ぷ": "pu", "ぺ": "pe", "ぽ": "po",
+    "ゔ": "vu",
+    "ぁ": "a", "ぃ": "i", "ぅ": "u", "ぇ": "e", "ぉ": "o",
+    "ゃ": "ya", "ゅ": "yu", "ょ": "yo", "ゎ": "wa",
+    "きゃ": "kya", "きゅ": "kyu", "きょ": "kyo",
+    "しゃ": "sha", "しゅ": "shu", "しぇ": "she", "しょ": "sho",
+    "ちゃ": "cha", "ちゅ": "chu", "ちぇ": "che", "ちょ": "cho",
+    "にゃ": "nya", "にゅ": "nyu", "にょ": "nyo",
+    "ひゃ": "hya", "ひゅ": "hyu", "ひょ": "hyo",
+    "みゃ": "mya", "みゅ": "myu", "みょ": "myo",
+    "りゃ": "rya", "りゅ": "ryu", "りょ": "ryo",
+    "ぎゃ": "gya", "ぎゅ": "gyu", "ぎょ": "gyo",
+    "じゃ": "ja", "じゅ": "ju", "じぇ": "je", "じょ": "jo",
+    "びゃ": "bya", "びゅ": "byu", "びょ": "byo",
+    "ぴゃ": "pya", "ぴゅ": "pyu", "ぴょ": "pyo",
+    "ふぁ": "fa", "ふぃ": "fi", "ふぇ": "fe", "ふぉ": "fo",
+    "てぃ": "ti", "でぃ": "di", "でゅ": "dyu", "うぃ": "wi", "うぇ": "we", "うぉ": "wo",
+    "ゔぁ": "va", "ゔぃ": "vi", "ゔぇ": "ve", "ゔぉ": "vo",
+}
+
+
+def fold(text):
+    """検索用に表記をそろえる（全角半角・大文字小文字・カタカナ→ひらがな・長音→母音）"""
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    # カタカナ（ァ〜ヶ）はひらがなに寄せます
+    text = "".join(chr(ord(c) - 0x60) if "ァ" <= c <= "ヶ" else c for c in text)
+    return _long_vowels(_SKIP.sub("", text))
+
+
+def _long_vowels(text):
+    # 長音を消すと「コーヒー」が「こひ」の2文字になり、trigram の索引で探せなくなるので、
+    # 母音にして文字数を残します。かなのあとでない長音（英字のあとなど）は読み飛ばします
+    out = []
+    for c in text:
+        if c == "ー":
+            c = _VOWEL_KANA.get(_ROMAJI.get(out[-1], "")[-1:], "") if out else ""
+        out.append(c)
+    return "".join(out)
+
+
+def _romaji_fold(text):
+    # 「koohii」と「kohi」のように、伸ばす音や小さい「っ」の書き方の違いを無視します
+    text = _ROMAJI_SKIP.sub("", text.replace("ou", "o"))
+    return _ROMAJI_LONG.sub(r"\1", text)
+
+
+def romanize(folded):
+    """fold() したひらがなをローマ字にする（漢字などはそのまま）"""
+    out = []
+    i = 0
+    while i < len(folded):
+        pair = folded[i:i + 2]
+        if pair in _ROMAJI:
+            out.append(_ROMAJI[pair])
+            i += 2
+        elif folded[i] == "っ":
+            i += 1
+        else:
+            out.append(_ROMAJI.get(folded[i], folded[i]))
+            i += 1
+    return _romaji_fold("".join(out))
+
+
+def search_terms(q):
+    """検索語から (ひらがな側の語, ローマ字側の語 or None) を作る"""
+    kana = fold(q)
+    # 英字だけの入力は、ローマ字読みでも探します（「kohi」で「コーヒー」）
+    romaji = _romaji_fold(kana) if kana.isascii() else None
+    return kana, romaji or None
+
+
+def trigrams(text):
+    return {text[i:i + TRIGRAM] for i in range(len(text) - TRIGRAM + 1)}
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 索引の更新
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# products の追加と名前の変更はトリガーで product_search_dirty に積まれます
+# （商品登録・修正・まとめて取り込み・DB Browser での直接編集のどれでも）。
+# 読み仮名の計算は SQL ではできないので、積まれた分をここで products_fts に反映します。
+# アプリからの書き込みは同じトランザクションで sync_index() を呼び、それ以外（直接編集・
+# マイグレーション）は起動時と、在庫一覧で検索するときに refresh_index() で拾います。
+
+def sync_index(conn):
+    """積まれた商品の索引を作り直し、作り直した件数を返す（書き込みのトランザクションの中で）"""
+    rows = conn.execute(
+        """
+        SELECT p.id, p.name
+        FROM product_search_dirty d
+        JOIN products p ON p.id = d.product_id
+        """
+    ).fetchall()
+    if rows:
+        entries = []
+        for row in rows:
+            kana = fold(row["name"])
+            entries.append((row["id"], kana, romanize(kana)))
+        conn.executemany("DELETE FROM products_fts WHERE rowid = ?", [(e[0],) for e in entries])
+        conn.executemany(
+            "INSERT INTO products_fts (rowid, kana, romaji) VALUES (?, ?, ?)", entries
+        )
+    conn.execute("DELETE FROM product_search_dirty")
+    return len(rows)
+
+
+def index_is_stale(conn):
+    return conn.execute("SELECT EXISTS (SELECT 1 FROM product_search_dirty)").fetchone()[0]
+
+
+def refresh_index():
+    """積まれた商品があれば索引に反映し、反映した件数を返す"""
+    # 積まれていなければ、書き込みロックを取らずに終わります
+    with get_db_connection() as conn:
+        if not index_is_stale(conn):
+            return 0
+    return run_write(sync_index)
+
+
+def rebuild_index(conn):
+    """索引をすべて作り直す（読み仮名の規則を変えたとき用）"""
+    conn.execute("DELETE FROM products_fts")
+    conn.execute("INSERT OR IGNORE INTO product_search_dirty (product_id) SELECT id FROM products")
+    return sync_index(conn)
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 在庫一覧の検索
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+def parse_stock_filters(args):
+    """クエリ文字列から在庫一覧の条件を取り出す（空の項目・「すべて」は無視）"""
+    filters = {}
+    q = args.get("q", "").strip()
+    if q:
+        filters["q"] = q
+
+    status = args.get("status", "all")
+    if status not in STATUSES:
+        raise ValueError("状態の指定が正しくありません")
+    if status != "all":
+        filters["status"] = status
+
+    category = args.get("category", "all")
+    if category and category != "all":
+        filters["category_id"] = int(category)
+
+    sort = args.get("sort") or DEFAULT_SORT
+    if sort not in SORTS:
+        raise ValueError("並び順の指定が正しくありません")
+    filters["sort"] = sort
+    return filters
+
+
+def parse_offset(value):
+    offset = int(value or 0)
+    if offset < 0:
+        raise ValueError("offset は0以上にしてください")
+    return offset
+
+
+def _quote(term):
+    # FTS5 のフレーズとして渡します（trigram なので、語の途中にも一致します）
+    return '"' + term.replace('"', '""') + '"'
+
+
+STOCK_SELECT = """
+    SELECT p.*, c.name AS category_name
+    FROM products p
+    LEFT JOIN categories c ON p.category_id = c.id
+"""
+
+
+def _filter_clauses(filters):
+    """状態・カテゴリの条件から (WHERE の条件のリスト, パラメータ) を作る"""
+    where = ["p.is_active = 1"]
+    params = []
+
+    if filters.get("status") == "out":
+        where.append("p.current_stock <= 0")
+    elif filters.get("status") == "low":
+        # 発注点割れはトリガーで管理している一覧から引きます（在庫切れは除く）
+        where.append("p.id IN (SELECT product_id FROM low_stock_products)")
+        where.append("p.current_stock > 0")
+    if "category_id" in filters:
+        where.append("p.category_id = ?")
+        params.append(filters["category_id"])
+    return where, params
+
+
+def _match_clause(kana, romaji):
+    """検索語の条件（SQL, パラメータ）。3文字以上は索引、短い語は索引の表の中を探します"""
+    if len(kana) >= TRIGRAM:
+        expression = f"kana : {_quote(kana)}"
+        if romaji and len(romaji) >= TRIGRAM:
+            expression += f" OR romaji : {_quote(romaji)}"
+        return "p.id IN (SELECT rowid FROM products_fts WHERE products_fts MATCH ?)", [expression]
+
+    clause = "instr(kana, ?) > 0"
+    params = [kana]
+    if romaji:
+        clause += " OR instr(romaji, ?) > 0"
+        params.append(romaji)
+    return f"p.id IN (SELECT rowid FROM products_fts WHERE {clause})", params
+
+
+def build_stock_query(filters, offset=0, limit=PAGE_SIZE):
+    """在庫一覧1ページ分の (SQL, パラメータ) を組み立てる
+
+    商品の数は操作履歴ほど多くないので、ページ送りは OFFSET で済ませます。
+    検索語があるときは、名前（読み）が検索語で始まる商品を先に並べます。
+    """
+    where, params = _filter_clauses(filters)
+    order = SORTS[filters.get("sort", DEFAULT_SORT)]
+    select = STOCK_SELECT
+
+    if filters.get("q"):
+        kana, romaji = search_terms(filters["q"])
+        clause, match_params = _match_clause(kana, romaji)
+        where.append(clause)
+        params.extend(match_params)
+
+        select += " JOIN products_fts f ON f.rowid = p.id"
+        prefix = "f.kana LIKE ? ESCAPE '\\'"
+        prefix_params = [_like_prefix(kana)]
+        if romaji:
+            prefix += " OR f.romaji LIKE ? ESCAPE '\\'"
+            prefix_params.append(_like_prefix(romaji))
+        order = f"CASE WHEN {prefix} THEN 0 ELSE 1 END, {order}"
+    else:
+        prefix_params = []
+
+    query = f"{select} WHERE {' AND '.join(where)} ORDER BY {order} LIMIT ? OFFSET ?"
+    return query, [*params, *prefix_params, limit + 1, offset]
+
+
+def _like_prefix(term):
+    return re.sub(r"([\\%_])", r"\\\1", term) + "%"
+
+
+def build_fuzzy_query(filters, kana, limit=FUZZY_CANDIDATES):
+    """どれか1つでも3文字の並びが同じ商品を、一致の多い順に読む (SQL, パラメータ)"""
+    where, params = _filter_clauses(filters)
+    expression = " OR ".join(_quote(t) for t in sorted(trigrams(kana)))
+    query = f"""
+        {STOCK_SELECT}
+        JOIN products_fts f ON f.rowid = p.id
+        WHERE products_fts MATCH ? AND {' AND '.join(where)}
+        ORDER BY f.rank
+        LIMIT ?
+    """
+    return query, [f"kana : ({expression})", *params, limit]
+
+
+def bigrams(text):
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def build_typo_query(filters, kana, limit=FUZZY_CANDIDATES):
+    """どれか1つでも2文字の並びが同じ商品を読む (SQL, パラメータ)
+
+    2文字は trigram の索引で引けないので、短い語の検索と同じく索引の表の中を探します。
+    """
+    where, params = _filter_clauses(filters)
+    pairs = sorted(bigrams(kana))
+    clause = " OR ".join("instr(f.kana, ?) > 0" for _ in pairs)
+    query = f"""
+        {STOCK_SELECT}
+        JOIN products_fts f ON f.rowid = p.id
+        WHERE ({clause}) AND {' AND '.join(where)}
+        ORDER BY p.id
+        LIMIT ?
+    """
+    return query, [*pairs, *params, limit]
+
+
+def typo_distance(term, text):
+    """text の中で term にいちばん近い部分との編集距離（何文字直せば同じになるか）"""
+    # 1行目を0にしておくと、text のどこから始まる部分とも比べられます
+    previous = [0] * (len(text) + 1)
+    for i, a in enumerate(term, start=1):
+        current = [i]
+        for j, b in enumerate(text, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (a != b)))
+        previous = current
+    return min(previous)
+
+
+def _fuzzy_products(conn, filters, limit):
+    kana, _ = search_terms(filters["q"])
+    matches = []
+    wanted = trigrams(kana)
+    if wanted:
+        query, params = build_fuzzy_query(filters, kana)
+        for row in conn.execute(query, params):
+            found = trigrams(fold(row["name"]))
+            # 検索語の3文字の並びが半分以上そろっているものだけを「近い商品」にします
+            if len(wanted & found) / len(wanted) >= FUZZY_THRESHOLD:
+                matches.append(row)
+    if not matches and TRIGRAM <= len(kana) <= TYPO_MAX_LENGTH:
+        query, params = build_typo_query(filters, kana)
+        for row in conn.execute(query, params):
+            if typo_distance(kana, fold(row["name"])) <= TYPO_DISTANCE:
+                matches.append(row)
+    return matches[:limit]
+
+
+def fetch_stock_page(conn, filters, offset=0, limit=PAGE_SIZE):
+    """条件に合う在庫一覧の1ページ分を取得する
+
+    (商品のリスト, 次のページの offset or None, あいまい検索の結果かどうか) を返します。
+    名前に検索語を含む商品がなければ、表記の近い商品を1ページ分だけ返します。
+    """
+    query, params = build_stock_query(filters, offset, limit)
+    products = conn.execute(query, params).fetchall()
+    next_offset = offset + limit if len(products) > limit else None
+    if products or offset or not filters.get("q"):
+        return products[:limit], next_offset, False
+    return _fuzzy_products(conn, filters, limit), None, True
+
+
+def product_json(row):
+    """API で返す商品1件分"""
+    return {
+        "id": row["id"],
+        "name": row["name"],
+        "category_id": row["category_id"],
+        "category_name": row["category_name"],
+        "origin": row["origin"],
+        "current_stock": row["current_stock"],
+        "unit": row["unit"],
+        "reorder_level": row["reorder_level"],
+        "image_path": row["image_path"],
+        "status": row["stock_status"],
+    }
@@ -0,0 +1,293 @@
+"""起動時のウォームアップと、ヘルスチェック（/healthz・/readyz）の状態
+
+ワーカーが最初のリクエストを受ける前に、次のことを一度だけ済ませておきます
+（templates だけは app:app でも効くよう、app.py を読み込んだときに済ませます）。
+
+    templates    テンプレートをすべてコンパイルする
+    assets       Tailwind CSS がビルドされているか確かめ、なければビルドする（npm install 済みのとき）
+    migrate      未適用のマイグレーションを流す（--preload ならマスターで一度だけ）
+    schema       マイグレーションがすべて適用済みか、インデックスが効いているかを確かめる
+    read_caches  商品一覧などの読み取りキャッシュ・検索の索引・商品カードを作っておく
+    db_pool      接続プールの接続を作っておく
+
+gunicorn の --preload と app:create_app() を組み合わせると、マスターで一度だけ温めてから
+ワーカーを fork するので、コンパイル済みのテンプレートやキャッシュを全ワーカーで共有できます
+（接続だけは fork のあとにワーカーごとに作り直します）。
+
+    gunicorn --preload --workers 4 --worker-class gthread --threads 8 'app:create_app()'
+
+create_app() を通らない app:app で起動したときは、最初の /readyz で裏のスレッドで温め始め、
+終わるまで /readyz は 503（starting）を返します（"lazy": true）。/readyz のリクエスト自体は
+待たせないので、readiness probe のタイムアウトにはかかりません。
+
+かかった時間はログに出し、/readyz でも返します。PANTRY_STARTUP_LOG を設定すると、
+起動のたびに1行の JSON を追記するので、リリースごとに比べられます。
+
+    PANTRY_STARTUP_LOG  起動にかかった時間を追記するファイル
+    PANTRY_RELEASE      その記録につけるリリース名（バージョンやコミット）
+"""
+import time
+
+# app.py がいちばん最初に読み込むので、ここからの時間が「アプリの読み込み」になります
+# （import_ms。読み込みのときにコンパイルするテンプレートの時間も含みます）
+IMPORT_STARTED = time.perf_counter()
+
+import contextvars  # noqa: E402
+import json  # noqa: E402
+import os  # noqa: E402
+import subprocess  # noqa: E402
+import threading  # noqa: E402
+from contextlib import nullcontext  # noqa: E402
+
+import cache  # noqa: E402
+import search  # noqa: E402
+import templating  # noqa: E402
+import tenants  # noqa: E402
+from analytics import refresh_rollups  # noqa: E402
+from db import current_database, current_pool, get_db_connection, pools  # noqa: E402
+from migrations import MIGRATIONS, applied_versions, check_query_plans  # noqa: E402
+
+STARTUP_LOG = os.environ.get("PANTRY_STARTUP_LOG")
+RELEASE = os.environ.get("PANTRY_RELEASE", "")
+
+# 起動時に読んでおく商品選択の画面（入庫・出庫・廃棄）
+CHOOSE_MODES = ("arrival", "departure", "waste")
+
+
+class StartupState:
+    """ウォームアップの結果（ワーカープロセスごと。--preload ならマスターの結果を引き継ぎます）"""
+
+    def __init__(self):
+        self.steps = []
+        self.ready = False
+        self.error = None
+        self.import_ms = None
+        self.total_ms = None
+        self.warmed_pid = None
+        self.lazy = False
+        self.lock = threading.Lock()
+        self.background = None
+
+    def report(self):
+        return {
+            "ready": self.ready,
+            "error": self.error,
+            "import_ms": self.import_ms,
+            "warm_up_ms": self.total_ms,
+            "steps": self.steps,
+            "preloaded": self.warmed_pid is not None and self.warmed_pid != os.getpid(),
+            "lazy": self.lazy,
+            "release": RELEASE,
+        }
+
+
+state = StartupState()
+
+
+def each_database():
+    """温める店舗ごとに、その店舗のデータベースを使うブロックを返す
+
+    複数店舗なら、1ワーカーで接続を開いておける数（PANTRY_MAX_OPEN_STORES）までです。
+    """
+    if not tenants.enabled():
+        return [nullcontext()]
+    return [tenants.use_store(store) for store in tenants.list_stores()[: pools.max_open]]
+
+
+def tailwind_path(app):
+    return os.path.join(app.static_folder, "css", "tailwind.css")
+
+
+def build_css(app):
+    """Tailwind CSS をビルドして static/css/tailwind.css に置き、そのパスを返す
+
+    npm run build:css と同じビルドです（npm install 済みであること）。一時ファイルに書いてから
+    置き換えるので、複数のワーカーが同時にビルドしても、書きかけの CSS は配りません。
+    """
+    tool = os.path.join(app.root_path, "node_modules", ".bin", "tailwindcss")
+    if not os.path.exists(tool):
+        raise RuntimeError("Tailwind CSS のビルドには npm install が必要です")
+    output = tailwind_path(app)
+    tmp_path = f"{output}.{os.getpid()}.tmp"
+    try:
+        subprocess.run(
+            [
+                tool, "-c", "tailwind.config.js", "-i", "static/css/tailwind.input.css",
+                "-o", tmp_path, "--minify",
+            ],
+            cwd=app.root_path, check=True, capture_output=True, timeout=300,
+        )
+        os.replace(tmp_path, output)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return output
+
+
+def check_assets(app):
+    # CDN 版には戻さないので、ビルドされていなければここでビルドし、できなければ準備完了にしません
+    path = tailwind_path(app)
+    built = False
+    if not os.path.exists(path):
+        try:
+            build_css(app)
+        except (RuntimeError, OSError, subprocess.SubprocessError) as e:
+            raise RuntimeError(f"{path} がなく、ビルドもできませんでした（{e}）") from e
+        built = True
+    return {"tailwind_bytes": os.path.getsize(path), "built": built}
+
+
+def migrate():
+    databases = 0
+    for context in each_database():
+        with context:
+            tenants.ensure_migrated(current_database())
+            databases += 1
+    return {"databases": databases}
+
+
+def validate_schema():
+    missing = set()
+    plan_problems = []
+    databases = 0
+    for context in each_database():
+        with context, get_db_connection() as conn:
+            databases += 1
+            missing |= {version for version, _, _ in MIGRATIONS} - applied_versions(conn)
+            plan_problems += check_query_plans(conn)
+    if missing:
+        raise RuntimeError(f"未適用のマイグレーションがあります: {', '.join(sorted(missing))}")
+    return {"databases": databases, "plan_problems": plan_problems}
+
+
+def warm_read_caches(app):
+    from flask import render_template
+
+    products = 0
+    # 描画結果のキャッシュからあふれると先に描いたカードが捨てられるので、入る分だけ描きます
+    budget = templating.card_cache.max_size
+    for context in each_database():
+        with context:
+            search.refresh_index()
+            refresh_rollups()
+            with get_db_connection() as conn:
+                choose_rows = cache.active_products_by_name(conn)
+                cache.active_products_recent(conn)
+                cache.active_products_by_category(conn)
+                cache.categories(conn)
+                cache.low_stock_count(conn)
+                cache.low_stock_items(conn)
+                stock_rows, _, _ = search.fetch_stock_page(conn, search.parse_stock_filters({}))
+            products += len(choose_rows)
+
+            # 商品カードは画面ごとに描いておきます（描画結果のキャッシュに入ります）
+            with app.test_request_context("/"):
+                render_template(
+                    "fragments/stock_items.html",
+                    products=stock_rows, fuzzy=False, first_page=True, filtered=False, next_url=None,
+                )
+                budget -= len(stock_rows)
+                for mode in CHOOSE_MODES:
+                    if budget < len(choose_rows):
+                        break
+                    render_template(
+                        "choose_product.html", products=choose_rows, mode=mode, title="", bg_color=""
+                    )
+                    budget -= len(choose_rows)
+    return {"products": products, "cards": templating.card_cache.stats()["entries"]}
+
+
+def prime_pools():
+    connections = 0
+    for context in each_database():
+        with context:
+            connections += current_pool().prime()
+    return {"connections": connections}
+
+
+def run_step(name, fn, *args):
+    """fn(*args) を時間を測って実行し、結果を起動の記録に足す（失敗しても例外は出しません）"""
+    started = time.perf_counter()
+    step = {"name": name}
+    try:
+        step.update(fn(*args) or {})
+    except Exception as e:
+        step["error"] = str(e)
+    step["ms"] = round((time.perf_counter() - started) * 1000, 1)
+    state.steps.append(step)
+    return step
+
+
+def warm_up(app):
+    """ウォームアップを一度だけ実行し、結果（StartupState）を返す
+
+    どれかの手順に失敗しても起動は止めず、/readyz が 503 を返すようにします。
+    インデックスが効いていないクエリは、ログに出すだけで準備完了とします。
+    """
+    with state.lock:
+        if state.warmed_pid is not None:
+            return state
+
+        started = time.perf_counter()
+        state.import_ms = round((started - IMPORT_STARTED) * 1000, 1)
+        run_step("assets", check_assets, app)
+        run_step("migrate", migrate)
+        schema = run_step("schema", validate_schema)
+        run_step("read_caches", warm_read_caches, app)
+        run_step("db_pool", prime_pools)
+        state.total_ms = round((time.perf_counter() - started) * 1000, 1)
+        state.warmed_pid = os.getpid()
+
+        failed = [step for step in state.steps if "error" in step]
+        state.error = "; ".join(f"{step['name']}: {step['error']}" for step in failed) or None
+        state.ready = not failed
+
+    for name, detail in schema.get("plan_problems", []):
+        app.logger.warning("インデックスが使われていないクエリがあります: %s（%s）", name, detail)
+    summary = ", ".join(f"{step['name']} {step['ms']:.0f}ms" for step in state.steps)
+    if state.ready:
+        app.logger.info("起動準備ができました: 読み込み %.0fms, %s", state.import_ms, summary)
+    else:
+        app.logger.error("起動準備に失敗しました: %s（%s）", state.error, summary)
+    write_startup_log()
+    return state
+
+
+def warm_up_in_background(app):
+    """create_app() を通らずに起動したとき用に、ウォームアップをまだしていなければ裏で始める"""
+    with state.lock:
+        if state.warmed_pid is not None or state.background is not None:
+            return
+        state.lazy = True
+        # 単店舗のテストなどで use_database() したデータベースも、そのまま引き継ぎます
+        context = contextvars.copy_context()
+        state.background = threading.Thread(
+            target=context.run, args=(warm_up, app), name="warm-up", daemon=True
+        )
+        state.background.start()
+
+
+def write_startup_log():
+    if not STARTUP_LOG:
+        return
+    record = {"at": time.strftime("%Y-%m-%dT%H:%M:%S"), "pid": os.getpid(), **state.report()}
+    try:
+        with open(STARTUP_LOG, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except OSError:
+        pass
+
+
+def _after_fork():
+    # 裏で温めているスレッドは子プロセスには引き継がれないので、必要なら子で温め直します
+    if state.warmed_pid is None:
+        state.background = None
+        state.lock = threading.Lock()
+    # --preload のマスターで温めたあとなら、fork したワーカーでも接続だけは作っておきます
+    # （db.py が先に親の接続を捨てています）
+    if state.ready:
+        run_step("db_pool_after_fork", prime_pools)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
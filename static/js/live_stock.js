@@ -0,0 +1,83 @@
+// ========================================
+// 在庫のリアルタイム更新（Server-Sent Events）
+// ========================================
+
+// 在庫一覧のステータスバッジ（fragments/stock_items.html と同じ表示）
+const STOCK_STATUS_LABELS = {
+  out: { text: '在庫切れ', className: 'stock-status--danger' },
+  low: { text: '補充が必要', className: 'stock-status--warning' },
+  ok: { text: '在庫あり', className: 'stock-status--ok' },
+};
+
+// 在庫一覧のカードの背景（状態ごと）
+const STOCK_CARD_CLASSES = {
+  out: ['bg-rose-200', 'border-rose-500'],
+  low: ['bg-rose-100', 'border-rose-300'],
+  ok: [],
+};
+
+/**
+ * 変更のあった商品カードだけを書き換える
+ */
+function patchProduct(product) {
+  document.querySelectorAll(`[data-product-id="${product.id}"]`).forEach(card => {
+    // 削除（非表示）された商品はカードごと消します
+    if (product.status === 'inactive') {
+      card.remove();
+      return;
+    }
+
+    const stock = card.querySelector('.js-stock');
+    if (stock) stock.textContent = product.current_stock;
+
+    const out = card.querySelector('.js-out');
+    if (out) out.classList.toggle('hidden', product.status !== 'out');
+
+    const badge = card.querySelector('.js-stock-status');
+    if (badge) {
+      const label = STOCK_STATUS_LABELS[product.status];
+      badge.textContent = label.text;
+      badge.classList.remove('stock-status--danger', 'stock-status--warning', 'stock-status--ok');
+      badge.classList.add(label.className);
+    }
+
+    if (card.dataset.status !== undefined) {
+      Object.values(STOCK_CARD_CLASSES).flat().forEach(c => card.classList.remove(c));
+      STOCK_CARD_CLASSES[product.status].forEach(c => card.classList.add(c));
+      card.dataset.status = product.status;
+      card.dataset.stock = product.current_stock;
+    }
+  });
+}
+
+/**
+ * トップページの「お買い物に行きましょう」の件数を書き換える
+ */
+function patchLowStockCount(count) {
+  const alert = document.querySelector('.js-low-stock-alert');
+  if (!alert) return;
+
+  alert.classList.toggle('hidden', count === 0);
+  const number = alert.querySelector('.js-low-stock-count');
+  if (number) number.textContent = count;
+}
+
+document.addEventListener('DOMContentLoaded', function() {
+  if (!('EventSource' in window)) return;
+
+  // 切れても EventSource が Last-Event-ID をつけて自動で再接続します
+  const source = new EventSource('/events');
+
+  source.addEventListener('message', function(e) {
+    const event = JSON.parse(e.data);
+
+    // 追いつけないほど古い続きだったときは、画面ごと読み直します
+    if (event.reload) {
+      window.location.reload();
+      return;
+    }
+
+    event.products.forEach(patchProduct);
+    patchLowStockCount(event.low_stock_count);
+  });
+});
@@ -0,0 +1,48 @@
+// ========================================
+// 操作履歴 - 無限スクロール
+// ========================================
+
+/**
+ * 一番下の行（sentinel）が見えたら、続きの行を読み込んで差し替える
+ */
+document.addEventListener('DOMContentLoaded', function() {
+  const body = document.getElementById('logs-body');
+  if (!body || !('IntersectionObserver' in window)) return;
+
+  let loading = false;
+
+  const observer = new IntersectionObserver(function(entries) {
+    entries.forEach(entry => {
+      if (entry.isIntersecting) loadMore(entry.target);
+    });
+  }, { rootMargin: '200px' });
+
+  function watchSentinel() {
+    const sentinel = body.querySelector('.logs-sentinel');
+    if (sentinel) observer.observe(sentinel);
+  }
+
+  async function loadMore(sentinel) {
+    if (loading) return;
+    loading = true;
+    observer.unobserve(sentinel);
+
+    try {
+      const response = await fetch(sentinel.dataset.nextUrl);
+      if (!response.ok) throw new Error(response.statusText);
+      const html = await response.text();
+
+      sentinel.insertAdjacentHTML('beforebegin', html);
+      sentinel.remove();
+      watchSentinel();
+    } catch (e) {
+      // 読み込みに失敗したら、少し待ってからやり直します
+      sentinel.querySelector('td').textContent = '読み込みに失敗しました。再試行します...';
+      setTimeout(() => observer.observe(sentinel), 3000);
+    } finally {
+      loading = false;
+    }
+  }
+
+  watchSentinel();
+});
@@ -0,0 +1,173 @@
+// ========================================
+// オフラインでも記録できる入庫・出庫・廃棄（sync_queue.js のあとに読み込みます）
+// ========================================
+
+// 次の画面で出すお知らせ（送信のあと画面を移るので、sessionStorage で引き継ぎます）
+const SYNC_NOTICE_KEY = 'pantry-sync-notices';
+
+function pantryStore() {
+  const meta = document.querySelector('meta[name="pantry-store"]');
+  return meta ? meta.content : '';
+}
+
+function formatQty(value) {
+  return String(value).replace(/\.0+$/, '');
+}
+
+/**
+ * フォームの内容を、送信待ちキューに積む操作にする
+ * 数量入力の画面は1商品、お買い物リストは qty_<商品ID> の行ごとに1件です
+ */
+function opsFromForm(form) {
+  const base = {
+    mode: form.dataset.syncMode,
+    staff_id: Number(form.dataset.staffId) || null,
+    store: pantryStore(),
+  };
+  if (form.dataset.productId) {
+    const quantity = parseFloat(form.elements.quantity.value);
+    return quantity > 0 ? [{ ...base, product_id: Number(form.dataset.productId), quantity }] : [];
+  }
+  return [...form.querySelectorAll('input[name^="qty_"]')]
+    .map(input => ({ ...base, product_id: Number(input.name.slice(4)), quantity: parseFloat(input.value) }))
+    .filter(op => op.quantity > 0);
+}
+
+/**
+ * 送った結果から、画面に出すお知らせを作る（execute_stock_update のフラッシュと同じ文面）
+ */
+function noticesFromResults(results, form, queued) {
+  const notices = [];
+  results.forEach(result => {
+    if (result.crossed_low) {
+      notices.push(['message', `「${result.name}」の在庫が残りわずかです。お買い物リストに追加しました！`]);
+    } else if (result.recovered) {
+      notices.push(['success', `「${result.name}」をお買い物リストから外しました`]);
+    }
+    if (result.status === 'missing') notices.push(['error', '商品が見つかりませんでした']);
+    if (result.status === 'rejected') notices.push(['error', `記録できませんでした: ${result.error}`]);
+  });
+  // このフォームの操作が反映されたときだけ、完了のお知らせを出します
+  const ids = new Set(queued.map(op => op.op_id));
+  const done = results.filter(result => ids.has(result.op_id) && result.status === 'applied');
+  if (!done.length) return notices;
+  if (!form.dataset.productId) {
+    notices.push(['success', ' 一括入庫が完了しました']);
+  } else {
+    const quantity = formatQty(form.elements.quantity.value);
+    notices.push(['success', ` ${form.dataset.productName} を ${quantity} 個 ${form.dataset.label} しました！`]);
+  }
+  return notices;
+}
+
+function saveNotices(notices) {
+  const saved = JSON.parse(sessionStorage.getItem(SYNC_NOTICE_KEY) || '[]');
+  sessionStorage.setItem(SYNC_NOTICE_KEY, JSON.stringify(saved.concat(notices)));
+}
+
+/**
+ * 前の画面から引き継いだお知らせを、フラッシュメッセージと同じ見た目で出す
+ */
+function showSavedNotices() {
+  const notices = JSON.parse(sessionStorage.getItem(SYNC_NOTICE_KEY) || '[]');
+  sessionStorage.removeItem(SYNC_NOTICE_KEY);
+  showNotices(notices);
+}
+
+function showNotices(notices) {
+  const main = document.querySelector('main');
+  if (!notices.length || !main) return;
+
+  const wrapper = document.createElement('div');
+  wrapper.className = 'w-full mb-6';
+  notices.forEach(([category, message]) => {
+    const alert = document.createElement('div');
+    alert.className = `card-alert-${category}`;
+    alert.textContent = message;
+    wrapper.appendChild(alert);
+  });
+  main.prepend(wrapper);
+}
+
+/**
+ * ヘッダーの「送信待ち」の件数を書き換える
+ */
+async function updatePendingBadge() {
+  const badge = document.querySelector('.js-sync-pending');
+  if (!badge) return;
+  const count = await pendingCount();
+  badge.classList.toggle('hidden', count === 0);
+  badge.querySelector('.js-sync-pending-count').textContent = count;
+}
+
+function applySyncResult(result) {
+  if (typeof patchProduct === 'function') result.products.forEach(patchProduct);
+  updatePendingBadge();
+  // 画面を開いたとき・つながったときに裏で送った分も、記録できなかったものは知らせます
+  // （キューからは消えますが、サーバーの sync_ops に理由と中身が残っています）
+  const rejected = result.results.filter(r => r.status === 'rejected');
+  showNotices(rejected.map(r => ['error', `送信待ちの操作を記録できませんでした: ${r.error}`]));
+}
+
+/**
+ * つながったときに送ってもらう（Background Sync がなければ、次に画面を開いたときに送ります）
+ */
+function requestBackgroundSync() {
+  if (!('serviceWorker' in navigator)) return;
+  navigator.serviceWorker.ready
+    .then(registration => registration.sync && registration.sync.register('pantry-sync'))
+    .catch(() => {});
+}
+
+async function flushFromPage() {
+  const result = await flushQueue();
+  applySyncResult(result);
+  if (result.remaining) requestBackgroundSync();
+  return result;
+}
+
+async function submitOffline(form) {
+  const ops = opsFromForm(form);
+  if (!ops.length) return;
+
+  const queued = await enqueueOps(ops);
+  const result = navigator.onLine ? await flushQueue() : { results: [], products: [], remaining: await pendingCount() };
+
+  const notices = noticesFromResults(result.results, form, queued);
+  if (result.remaining) {
+    requestBackgroundSync();
+    notices.push(['flash', `📶 電波が届かないので、送信待ちにしました（${result.remaining} 件）。つながったら自動で送ります`]);
+  }
+  saveNotices(notices);
+  window.location.href = form.dataset.next;
+}
+
+document.addEventListener('DOMContentLoaded', function() {
+  if (!('indexedDB' in window)) return;
+
+  if ('serviceWorker' in navigator) {
+    navigator.serviceWorker.register('/sw.js').catch(() => {});
+    navigator.serviceWorker.addEventListener('message', function(e) {
+      if (e.data && e.data.type === 'synced') applySyncResult(e.data);
+    });
+  }
+
+  showSavedNotices();
+  updatePendingBadge();
+  if (navigator.onLine) flushFromPage();
+  window.addEventListener('online', flushFromPage);
+
+  // 入庫・出庫・廃棄のフォームは、送信せずにキューに積んでから送ります
+  // （ほかのスクリプトが入力の誤りで送信を止めたときは何もしません）
+  document.addEventListener('submit', function(e) {
+    const form = e.target;
+    if (!form.dataset.syncMode || e.defaultPrevented) return;
+    e.preventDefault();
+    const button = form.querySelector('[type="submit"]');
+    if (button) button.disabled = true;
+    submitOffline(form).catch(() => {
+      // IndexedDB が使えないときは、これまでどおりフォームで送ります
+      form.submit();
+    });
+  });
+});
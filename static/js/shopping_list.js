@@ -9,6 +9,8 @@ function toggleItem(checkbox) {
   const id = checkbox.getAttribute('data-id');
   const name = checkbox.getAttribute('data-name');
   const unit = checkbox.getAttribute('data-unit');
+  // 使用ペースから計算したおすすめの数量を、最初の数量にします
+  const suggested = parseInt(checkbox.getAttribute('data-suggested')) || 1;
   
   const card = document.getElementById('card-' + id);
   const container = document.getElementById('arrival-container');
@@ -37,7 +39,7 @@ function toggleItem(checkbox) {
             −
           </button>
           <div class="flex items-center gap-2">
-            <span class="arrival-row__qty" id="qty-display-${id}">1</span>
+            <span class="arrival-row__qty" id="qty-display-${id}">${suggested}</span>
             <span class="arrival-row__unit">${unit}</span>
           </div>
           <button type="button" 
@@ -50,7 +52,7 @@ function toggleItem(checkbox) {
         <input type="hidden" 
                name="qty_${id}" 
                id="qty-input-${id}" 
-               value="1" 
+               value="${suggested}" 
                class="arrival-row__hidden-input">
       </div>
     `;
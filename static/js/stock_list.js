@@ -0,0 +1,99 @@
+// ========================================
+// 在庫一覧 - 検索・絞り込み・無限スクロール
+// ========================================
+
+/**
+ * 条件が変わったらサーバーで絞り込んだ1ページ目と差し替え、
+ * 一番下の行（sentinel）が見えたら続きを読み込む
+ */
+document.addEventListener('DOMContentLoaded', function() {
+  const form = document.getElementById('stockFilters');
+  const container = document.getElementById('productContainer');
+  if (!form || !container) return;
+
+  // 入力が止まってから検索します（1文字ごとに問い合わせない）
+  const SEARCH_DELAY = 250;
+  let timer = null;
+  let controller = null;
+  let loading = false;
+
+  const observer = 'IntersectionObserver' in window
+    ? new IntersectionObserver(function(entries) {
+      entries.forEach(entry => {
+        if (entry.isIntersecting) loadMore(entry.target);
+      });
+    }, { rootMargin: '400px' })
+    : null;
+
+  function watchSentinel() {
+    const sentinel = container.querySelector('.stock-sentinel');
+    if (sentinel && observer) observer.observe(sentinel);
+  }
+
+  function currentParams() {
+    const params = new URLSearchParams();
+    new FormData(form).forEach((value, key) => {
+      if (value && value !== 'all') params.set(key, value);
+    });
+    return params;
+  }
+
+  async function search() {
+    const params = currentParams();
+    // 前の検索の結果があとから届いて上書きしないように、取り消しておきます
+    if (controller) controller.abort();
+    controller = new AbortController();
+
+    try {
+      const response = await fetch(`${form.dataset.itemsUrl}?${params}`, { signal: controller.signal });
+      if (!response.ok) throw new Error(response.statusText);
+      container.innerHTML = await response.text();
+      // 再読み込みしても同じ条件で開けるよう、URL も書き換えます
+      const query = params.toString();
+      history.replaceState(null, '', query ? `${form.action}?${query}` : form.action);
+      watchSentinel();
+    } catch (e) {
+      if (e.name !== 'AbortError') form.submit();
+    }
+  }
+
+  function scheduleSearch() {
+    clearTimeout(timer);
+    timer = setTimeout(search, SEARCH_DELAY);
+  }
+
+  form.addEventListener('submit', function(event) {
+    event.preventDefault();
+    clearTimeout(timer);
+    search();
+  });
+  form.querySelector('[name="q"]').addEventListener('input', scheduleSearch);
+  form.querySelectorAll('select').forEach(select => select.addEventListener('change', search));
+
+  async function loadMore(sentinel) {
+    if (loading) return;
+    loading = true;
+    observer.unobserve(sentinel);
+
+    try {
+      const response = await fetch(sentinel.dataset.nextUrl);
+      if (!response.ok) throw new Error(response.statusText);
+      const html = await response.text();
+
+      // 読み込み中に条件が変わって差し替えられていたら、捨てます
+      if (sentinel.isConnected) {
+        sentinel.insertAdjacentHTML('beforebegin', html);
+        sentinel.remove();
+        watchSentinel();
+      }
+    } catch (e) {
+      // 読み込みに失敗したら、少し待ってからやり直します
+      sentinel.textContent = '読み込みに失敗しました。再試行します...';
+      setTimeout(() => observer.observe(sentinel), 3000);
+    } finally {
+      loading = false;
+    }
+  }
+
+  watchSentinel();
+});
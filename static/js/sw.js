@@ -0,0 +1,124 @@
+// ========================================
+// Service Worker（/sw.js として配ります）
+// 電波が切れても画面を開けるようにし、積んである操作をつながったときに送ります
+// ========================================
+
+importScripts('/static/js/sync_queue.js');
+
+// 画面やファイルの中身を変えて配り直すときは、番号を上げて古いキャッシュを捨てます
+const CACHE_NAME = 'pantry-v1';
+
+// インストールのときに取っておくもの（失敗したものは、次に開いたときに入ります）
+const PRECACHE_URLS = [
+  '/offline',
+  '/static/css/style.css',
+  '/static/css/tailwind.css',
+  '/static/js/sync_queue.js',
+  '/static/js/offline.js',
+  '/static/js/live_stock.js',
+  '/static/js/shopping_list.js',
+  '/static/icons/chat-icon.png',
+];
+
+// 画面の応答がこれより遅いときは、取っておいた画面を見せます（ミリ秒）
+const NAVIGATION_TIMEOUT = 4000;
+
+// 画面を取っておかないURL（ログ・管理画面は古いものを見せても役に立たないため）
+const NO_CACHE_PREFIXES = ['/admin', '/logs', '/store', '/api/', '/events'];
+
+self.addEventListener('install', event => {
+  event.waitUntil(
+    caches.open(CACHE_NAME).then(cache =>
+      Promise.allSettled(PRECACHE_URLS.map(url => cache.add(url)))
+    ).then(() => self.skipWaiting())
+  );
+});
+
+self.addEventListener('activate', event => {
+  event.waitUntil(
+    caches.keys()
+      .then(keys => Promise.all(keys.filter(key => key !== CACHE_NAME).map(key => caches.delete(key))))
+      .then(() => self.clients.claim())
+  );
+});
+
+function fetchWithTimeout(request, timeout) {
+  return new Promise((resolve, reject) => {
+    const timer = setTimeout(() => reject(new Error('timeout')), timeout);
+    fetch(request).then(
+      response => { clearTimeout(timer); resolve(response); },
+      error => { clearTimeout(timer); reject(error); }
+    );
+  });
+}
+
+/**
+ * 画面はネットワークを先に試し、だめなら取っておいたもの・オフライン画面を見せる
+ */
+async function handleNavigation(request, url) {
+  const cache = await caches.open(CACHE_NAME);
+  const cacheable = !NO_CACHE_PREFIXES.some(prefix => url.pathname.startsWith(prefix));
+  try {
+    const response = await fetchWithTimeout(request, NAVIGATION_TIMEOUT);
+    if (cacheable && response.ok && !response.redirected) {
+      // お知らせ（フラッシュメッセージ）の出ている画面は、あとで見せると紛らわしいので取っておきません
+      const text = await response.clone().text();
+      if (!text.includes('data-flash-messages')) {
+        await cache.put(request, response.clone());
+      }
+    }
+    return response;
+  } catch (e) {
+    return (await cache.match(request)) || (await cache.match('/offline')) || Response.error();
+  }
+}
+
+/**
+ * 静的ファイルは取っておいたものをすぐ返し、裏で新しいものに入れ替える
+ */
+async function handleStatic(request) {
+  const cache = await caches.open(CACHE_NAME);
+  const cached = await cache.match(request);
+  const update = fetch(request).then(response => {
+    if (response.ok) cache.put(request, response.clone());
+    return response;
+  });
+  if (cached) {
+    update.catch(() => {});
+    return cached;
+  }
+  return update;
+}
+
+self.addEventListener('fetch', event => {
+  const request = event.request;
+  if (request.method !== 'GET') return;
+
+  const url = new URL(request.url);
+  if (url.origin !== self.location.origin) return;
+
+  if (request.mode === 'navigate') {
+    event.respondWith(handleNavigation(request, url));
+  } else if (url.pathname.startsWith('/static/')) {
+    event.respondWith(handleStatic(request));
+  }
+});
+
+/**
+ * 送った結果を開いている画面に知らせる（在庫の数字・送信待ちの件数を書き換えます）
+ */
+async function flushAndNotify() {
+  const result = await flushQueue();
+  const windows = await self.clients.matchAll({ type: 'window' });
+  windows.forEach(client => client.postMessage({ type: 'synced', ...result }));
+  if (result.remaining) throw new Error('まだ送れていない操作があります');
+}
+
+// Background Sync に対応したブラウザでは、画面を閉じていてもつながったときに送ります
+self.addEventListener('sync', event => {
+  if (event.tag === 'pantry-sync') event.waitUntil(flushAndNotify());
+});
+
+self.addEventListener('message', event => {
+  if (event.data && event.data.type === 'flush') event.waitUntil(flushAndNotify().catch(() => {}));
+});
@@ -0,0 +1,147 @@
+// ========================================
+// オフライン操作の送信待ちキュー（IndexedDB）
+// 画面（offline.js）と Service Worker（sw.js）の両方から読み込みます
+// ========================================
+
+const SYNC_DB_NAME = 'pantry-sync';
+const SYNC_STORE = 'ops';
+const SYNC_URL = '/api/sync';
+// 1回の /api/sync で送る操作の数（サーバーの MAX_SYNC_OPS 以下）
+const SYNC_BATCH_SIZE = 100;
+// 応答がこれより遅いときは、電波が切れているとみなして次の機会に送ります（ミリ秒）
+const SYNC_TIMEOUT = 8000;
+
+let syncDbPromise = null;
+
+function openSyncDb() {
+  if (!syncDbPromise) {
+    syncDbPromise = new Promise((resolve, reject) => {
+      const request = indexedDB.open(SYNC_DB_NAME, 1);
+      request.onupgradeneeded = () => {
+        // seq は積んだ順の番号。この順でサーバーに反映します
+        request.result.createObjectStore(SYNC_STORE, { keyPath: 'seq', autoIncrement: true });
+      };
+      request.onsuccess = () => resolve(request.result);
+      request.onerror = () => reject(request.error);
+    });
+  }
+  return syncDbPromise;
+}
+
+function syncTransaction(mode, work) {
+  return openSyncDb().then(db => new Promise((resolve, reject) => {
+    const tx = db.transaction(SYNC_STORE, mode);
+    const result = work(tx.objectStore(SYNC_STORE));
+    tx.oncomplete = () => resolve(result && 'result' in result ? result.result : result);
+    tx.onerror = () => reject(tx.error);
+    tx.onabort = () => reject(tx.error);
+  }));
+}
+
+/**
+ * 操作IDを作る（サーバーはこのIDで二重の反映を防ぎます）
+ */
+function newOpId() {
+  if (self.crypto && crypto.randomUUID) return crypto.randomUUID();
+  return Date.now().toString(36) + '-' + Math.random().toString(36).slice(2, 12);
+}
+
+/**
+ * 操作をキューに積み、操作IDをつけたものを返す
+ * ops: [{mode, product_id, quantity, staff_id, store}, ...]
+ */
+function enqueueOps(ops) {
+  const now = new Date().toISOString();
+  const queued = ops.map(op => ({ op_id: newOpId(), queued_at: now, ...op }));
+  return syncTransaction('readwrite', store => {
+    queued.forEach(op => store.add(op));
+  }).then(() => queued);
+}
+
+function pendingOps() {
+  return syncTransaction('readonly', store => store.getAll());
+}
+
+function pendingCount() {
+  return syncTransaction('readonly', store => store.count());
+}
+
+function removeOps(seqs) {
+  return syncTransaction('readwrite', store => {
+    seqs.forEach(seq => store.delete(seq));
+  });
+}
+
+async function postSyncBatch(store, batch) {
+  const controller = new AbortController();
+  const timer = setTimeout(() => controller.abort(), SYNC_TIMEOUT);
+  try {
+    return await fetch(SYNC_URL, {
+      method: 'POST',
+      credentials: 'same-origin',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({
+        store: store,
+        ops: batch.map(op => ({
+          op_id: op.op_id,
+          mode: op.mode,
+          product_id: op.product_id,
+          quantity: op.quantity,
+          staff_id: op.staff_id,
+        })),
+      }),
+      signal: controller.signal,
+    });
+  } finally {
+    clearTimeout(timer);
+  }
+}
+
+let lastFlush = Promise.resolve();
+
+/**
+ * 積んである操作を古い順にサーバーへ送る
+ *
+ * 送れた分（反映済み・受付済み・商品なし・中身の誤り）はキューから消し、
+ * つながらない・サーバーの誤り・店舗違いのときは残したまま止めます。
+ * 戻り値は { results, products, remaining }。
+ */
+function flushQueue() {
+  // 同じ画面の中では前の送信が終わってから送ります（その間に積んだ操作も取りこぼしません）。
+  // 画面と Service Worker が同時に送っても、操作IDで二重の反映は防げます
+  const run = lastFlush.then(doFlush);
+  lastFlush = run.catch(() => {});
+  return run;
+}
+
+async function doFlush() {
+  const results = [];
+  const products = new Map();
+
+  let ops = await pendingOps();
+  while (ops.length) {
+    // 店舗ごとに、続いている分だけを1回で送ります
+    const store = ops[0].store || '';
+    const batch = [];
+    for (const op of ops) {
+      if ((op.store || '') !== store || batch.length >= SYNC_BATCH_SIZE) break;
+      batch.push(op);
+    }
+
+    let response;
+    try {
+      response = await postSyncBatch(store, batch);
+    } catch (e) {
+      break;
+    }
+    if (!response.ok) break;
+
+    const body = await response.json();
+    await removeOps(batch.map(op => op.seq));
+    results.push(...body.results);
+    body.products.forEach(product => products.set(product.id, product));
+    ops = ops.slice(batch.length);
+  }
+
+  return { results, products: [...products.values()], remaining: ops.length };
+}
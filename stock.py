@@ -0,0 +1,204 @@
+import math
+
+import dbexec
+from db import get_db_connection, retry_busy
+from logs import LogEvent
+
+# 画面のモードと、在庫の増減方向・ログ種別の対応
+MODES = {
+    "arrival": (1, LogEvent.ARRIVAL),
+    "departure": (-1, LogEvent.DEPARTURE),
+    "waste": (-1, LogEvent.WASTE),
+}
+
+
+def mode_to_change(mode):
+    """モードから (符号, LogEvent) を返す（不明なモードは出庫扱い）"""
+    return MODES.get(mode, MODES["departure"])
+
+
+def run_write(work, *args, **kwargs):
+    """BEGIN IMMEDIATE で書き込みロックを取り、work(conn, ...) を実行する
+
+    ロック競合で失敗したときは、少しずつ待ち時間を延ばしてやり直します（db.retry_busy）。
+    非同期モード（asgi.py）では、書き込み専用のスレッドに順番に実行してもらいます
+    （やり直しもそのスレッドの中で行います）。
+    """
+    if dbexec.executor is not None:
+        return dbexec.executor.write(work, *args, **kwargs)
+
+    def attempt():
+        with get_db_connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            return work(conn, *args, **kwargs)
+
+    return retry_busy(attempt)
+
+
+def apply_stock_change(conn, product_id, delta, staff_id, event, quantity, floor=None):
+    """在庫の増減とログ記録を1つのUPDATEで行う
+
+    変更後の name, current_stock, reorder_level と、実際に動いた量 (applied)、
+    発注点を下回った・上回ったかどうか (crossed_low / recovered) を辞書で返します。
+    floor で止まって在庫が動かなかったときは、ログを残しません。
+    商品が見つからないときは None を返します。
+    """
+    # 書き込みロックを持った状態で読むので、変更前の状態が正確にわかります
+    before = conn.execute(
+        """
+        SELECT p.current_stock, l.product_id IS NOT NULL AS was_low
+        FROM products p
+        LEFT JOIN low_stock_products l ON l.product_id = p.id
+        WHERE p.id = ?
+        """,
+        (product_id,),
+    ).fetchone()
+    if before is None:
+        return None
+
+    if floor is None:
+        new_stock_sql = "current_stock + ?"
+    else:
+        # すでに floor を下回っている在庫を、floor まで増やしてしまわないようにします
+        new_stock_sql = "MIN(current_stock, MAX(?, current_stock + ?))"
+
+    params = (delta, product_id) if floor is None else (floor, delta, product_id)
+    rows = conn.execute(
+        f"""
+        UPDATE products
+        SET current_stock = {new_stock_sql},
+            updated_at = CURRENT_TIMESTAMP,
+            touch_count = touch_count + 1
+        WHERE id = ?
+        RETURNING name, current_stock, reorder_level, is_active
+        """,
+        params,
+    ).fetchall()
+
+    if not rows:
+        return None
+
+    product = dict(rows[0])
+    # floor で止まったときは、ログも実際に動いた分だけにします（在庫とログの合計を一致させるため）
+    product["applied"] = product["current_stock"] - before["current_stock"]
+    if floor is not None:
+        quantity = abs(product["applied"])
+    if quantity:
+        conn.execute(
+            "INSERT INTO inventory_logs (product_id, staff_id, event, quantity) VALUES (?, ?, ?, ?)",
+            (product_id, staff_id, event, quantity),
+        )
+
+    was_low = bool(before["was_low"])
+    is_low = (
+        product["is_active"] == 1
+        and product["reorder_level"] is not None
+        and product["current_stock"] <= product["reorder_level"]
+    )
+    product["crossed_low"] = is_low and not was_low
+    product["recovered"] = was_low and not is_low
+    return product
+
+
+def change_stock(product_id, delta, staff_id, event, quantity, floor=None):
+    """1商品の在庫変更を、書き込みトランザクション付きで実行する"""
+    return run_write(
+        apply_stock_change, product_id, delta, staff_id, event, quantity, floor=floor
+    )
+
+
+# 一括処理で1回の IN (...) / executemany に載せる件数
+BULK_BATCH_SIZE = 500
+
+
+def _batches(items, size=BULK_BATCH_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def parse_quantity(value):
+    """数量を読み取る（"inf" や "nan" も float() は通してしまうので ValueError にします）"""
+    quantity = float(value)
+    if not math.isfinite(quantity):
+        raise ValueError("数量は有限の数で指定してください")
+    return quantity
+
+
+def staff_exists(conn, staff_id):
+    """操作履歴に記録するスタッフが登録されているか（「担当者を選ぶ」と同じ確認）"""
+    return conn.execute("SELECT 1 FROM staffs WHERE id = ?", (staff_id,)).fetchone() is not None
+
+
+def parse_bulk_form(form):
+    """フォームの qty_<商品ID> をまとめて読み取り、{商品ID: 数量} を返す
+
+    数量が0以下の行は無視します。おかしな値があれば ValueError を投げます。
+    """
+    quantities = {}
+    for key, value in form.items():
+        if not key.startswith("qty_"):
+            continue
+        product_id = int(key[len("qty_"):])
+        quantity = parse_quantity(value) if value else 0
+        if quantity > 0:
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return quantities
+
+
+def parse_bulk_items(items):
+    """JSON の [{"product_id": 1, "quantity": 3}, ...] を {商品ID: 数量} にする"""
+    if not isinstance(items, list):
+        raise ValueError("items は配列で指定してください")
+
+    quantities = {}
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValueError("items の各要素はオブジェクトで指定してください")
+        product_id = int(item["product_id"])
+        quantity = parse_quantity(item["quantity"])
+        if quantity > 0:
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return quantities
+
+
+def apply_bulk_arrival(conn, quantities, staff_id, event=LogEvent.BULK_ARRIVAL):
+    """複数商品の入庫を、まとめたSQLで適用する
+
+    (反映した商品IDのリスト, 見つからなかった商品IDのリスト) を返します。
+    """
+    product_ids = list(quantities)
+    found = set()
+    for batch in _batches(product_ids):
+        placeholders = ",".join("?" * len(batch))
+        rows = conn.execute(
+            f"SELECT id FROM products WHERE id IN ({placeholders})", batch
+        ).fetchall()
+        found.update(row["id"] for row in rows)
+
+    applied = [pid for pid in product_ids if pid in found]
+    missing = [pid for pid in product_ids if pid not in found]
+
+    for batch in _batches(applied):
+        conn.executemany(
+            """
+            UPDATE products
+            SET current_stock = current_stock + ?,
+                updated_at = CURRENT_TIMESTAMP,
+                touch_count = touch_count + 1
+            WHERE id = ?
+            """,
+            [(quantities[pid], pid) for pid in batch],
+        )
+        conn.executemany(
+            "INSERT INTO inventory_logs (product_id, staff_id, event, quantity) VALUES (?, ?, ?, ?)",
+            [(pid, staff_id, event, quantities[pid]) for pid in batch],
+        )
+
+    return applied, missing
+
+
+def bulk_arrival(quantities, staff_id, event=LogEvent.BULK_ARRIVAL):
+    """一括入庫を1つの書き込みトランザクションで実行する"""
+    if not quantities:
+        return [], []
+    return run_write(apply_bulk_arrival, quantities, staff_id, event)
@@ -0,0 +1,183 @@
+"""タブレットのオフライン操作の同期
+
+電波が切れている間の入庫・出庫・廃棄は、ブラウザの IndexedDB に積んでおき
+（static/js/sync_queue.js）、つながったときに /api/sync へまとめて送ります。
+
+    {"store": "shibuya",
+     "ops": [{"op_id": "…", "mode": "departure", "product_id": 3, "quantity": 2, "staff_id": 1}, ...]}
+
+操作IDはタブレットが作るので、同じ操作が何度届いても在庫は1回しか動きません。
+届いた順に1つの書き込みトランザクションで反映し、結果と変わった商品の行を返します。
+
+タブレットは結果を受け取ると rejected の操作もキューから消すので、受け付けなかった
+操作は理由と送られてきた中身ごと sync_ops に残します（flask sync-rejected で確認できます）。
+"""
+import json
+import re
+
+from logs import LogEvent
+from search import STOCK_SELECT, product_json
+from stock import MODES, _batches, apply_stock_change, parse_quantity, staff_exists
+
+# 同期で受け付けるモード（お買い物リストからの入庫は一括入庫として記録します）
+SYNC_MODES = {**MODES, "bulk_arrival": (1, LogEvent.BULK_ARRIVAL)}
+
+# 1回の同期で受け付ける操作の数（多いときはタブレット側で分けて送ります）
+MAX_SYNC_OPS = 200
+
+# 受付済みの操作IDを覚えておく日数（これより古い再送は新しい操作として扱われます）
+SYNC_OP_RETENTION_DAYS = 30
+
+_OP_ID = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+# 結果の種類。タブレットはどれでも queue から消します（rejected はサーバーに残ります）
+APPLIED = "applied"
+DUPLICATE = "duplicate"
+MISSING = "missing"
+REJECTED = "rejected"
+
+
+def parse_sync_op(item, default_staff_id):
+    """1件の操作を読み取る。おかしな値があれば ValueError を投げます"""
+    if not isinstance(item, dict):
+        raise ValueError("操作はオブジェクトで指定してください")
+    if item.get("mode") not in SYNC_MODES:
+        raise ValueError(f"モードが正しくありません: {item.get('mode')}")
+    quantity = parse_quantity(item["quantity"])
+    if not quantity > 0:
+        raise ValueError("数量は0より大きくしてください")
+    staff_id = item.get("staff_id")
+    return {
+        "op_id": item["op_id"],
+        "mode": item["mode"],
+        "product_id": int(item["product_id"]),
+        "quantity": quantity,
+        "staff_id": default_staff_id if staff_id is None else int(staff_id),
+    }
+
+
+def parse_sync_ops(items, default_staff_id):
+    """ops の配列を読み取る
+
+    操作IDが読めない要素があれば、どの操作か返せないので全体を ValueError にします。
+    中身だけがおかしい操作は {"op_id", "error"} にして、その1件だけ rejected で返します。
+    """
+    if not isinstance(items, list):
+        raise ValueError("ops は配列で指定してください")
+    if len(items) > MAX_SYNC_OPS:
+        raise ValueError(f"1回に送れる操作は {MAX_SYNC_OPS} 件までです")
+
+    ops = []
+    for item in items:
+        op_id = item.get("op_id") if isinstance(item, dict) else None
+        if not isinstance(op_id, str) or not _OP_ID.match(op_id):
+            raise ValueError("op_id が正しくありません")
+        try:
+            ops.append(parse_sync_op(item, default_staff_id))
+        except (KeyError, TypeError, ValueError) as e:
+            ops.append({"op_id": op_id, "error": str(e), "payload": item})
+    return ops
+
+
+def prune_sync_ops(conn, days=SYNC_OP_RETENTION_DAYS):
+    conn.execute(
+        "DELETE FROM sync_ops WHERE applied_at < datetime('now', ?)", (f"-{days} days",)
+    )
+
+
+def apply_sync_ops(conn, ops):
+    """操作を届いた順に反映する（run_write の中で呼びます）
+
+    {"results": [操作ごとの結果], "products": [変わった商品の行]} を返します。
+    受付済みの操作IDは duplicate として、在庫を動かさずに今の行だけ返します
+    （受け付けなかった操作の再送には、そのときの理由をもう一度返します）。
+    """
+    prune_sync_ops(conn)
+
+    results = []
+    touched = []
+    for op in ops:
+        seen = conn.execute(
+            "SELECT status, error FROM sync_ops WHERE op_id = ?", (op["op_id"],)
+        ).fetchone()
+        if seen is not None and seen["status"] == REJECTED:
+            results.append({"op_id": op["op_id"], "status": REJECTED, "error": seen["error"]})
+            continue
+        if seen is not None:
+            results.append({"op_id": op["op_id"], "status": DUPLICATE})
+            touched.append(op["product_id"])
+            continue
+
+        if "error" not in op and not staff_exists(conn, op["staff_id"]):
+            op = {**op, "error": "スタッフが見つかりませんでした", "payload": op}
+        if "error" in op:
+            record_rejected(conn, op)
+            results.append({"op_id": op["op_id"], "status": REJECTED, "error": op["error"]})
+            continue
+
+        product_id = op["product_id"]
+        sign, event = SYNC_MODES[op["mode"]]
+        product = apply_stock_change(
+            conn, product_id, sign * op["quantity"], op["staff_id"], event, op["quantity"]
+        )
+        if product is None:
+            result = {"op_id": op["op_id"], "status": MISSING}
+        else:
+            result = {
+                "op_id": op["op_id"],
+                "status": APPLIED,
+                "name": product["name"],
+                "label": event.label,
+                "crossed_low": product["crossed_low"],
+                "recovered": product["recovered"],
+            }
+            touched.append(product_id)
+        conn.execute(
+            "INSERT INTO sync_ops (op_id, product_id, status) VALUES (?, ?, ?)",
+            (op["op_id"], product_id, result["status"]),
+        )
+        results.append(result)
+
+    return {"results": results, "products": changed_products(conn, touched)}
+
+
+def record_rejected(conn, op):
+    """受け付けなかった操作を、理由と送られてきた中身ごと残す"""
+    payload = op["payload"]
+    product_id = payload.get("product_id") if isinstance(payload, dict) else None
+    conn.execute(
+        "INSERT INTO sync_ops (op_id, product_id, status, error, payload) VALUES (?, ?, ?, ?, ?)",
+        (
+            op["op_id"],
+            product_id if isinstance(product_id, int) else None,
+            REJECTED,
+            op["error"],
+            json.dumps(payload, ensure_ascii=False, default=str),
+        ),
+    )
+
+
+def rejected_ops(conn, limit=100):
+    """受け付けなかった操作（新しい順）"""
+    return conn.execute(
+        """
+        SELECT op_id, product_id, error, payload, applied_at FROM sync_ops
+        WHERE status = ?
+        ORDER BY applied_at DESC
+        LIMIT ?
+        """,
+        (REJECTED, limit),
+    ).fetchall()
+
+
+def changed_products(conn, product_ids):
+    """同期のあとの商品の行（在庫一覧の API と同じ形）"""
+    product_ids = list(dict.fromkeys(product_ids))
+    products = []
+    for batch in _batches(product_ids):
+        placeholders = ",".join("?" * len(batch))
+        rows = conn.execute(
+            f"{STOCK_SELECT} WHERE p.id IN ({placeholders}) ORDER BY p.id", batch
+        ).fetchall()
+        products.extend(product_json(row) for row in rows)
+    return products
@@ -0,0 +1,13 @@
+/** テンプレートと JS で使っているクラスだけを残してビルドします */
+module.exports = {
+  content: ["./templates/**/*.html", "./static/js/**/*.js"],
+  // テンプレート内で文字列を組み立てているクラス（card-alert-{{ category }} など）
+  safelist: [
+    { pattern: /^card-alert-/ },
+    { pattern: /^page-header--/ },
+  ],
+  theme: {
+    extend: {},
+  },
+  plugins: [],
+};
@@ -0,0 +1,141 @@
+"""テンプレートの描画を軽くする仕組み
+
+- 起動時にテンプレートをすべてコンパイルしておき、最初のリクエストを待たせません。
+  PANTRY_TEMPLATE_CACHE_DIR を設定すると、コンパイル結果をファイルに残して
+  ほかのワーカーや次の起動でも使い回します。
+- 商品カード（templates/macros/product_card.html）は商品ごとに描画結果を覚えておき、
+  商品が変わっていなければ描画し直しません。在庫一覧・商品選択の画面で、
+  変わった商品のカードだけを描き直すことになります。
+
+    PANTRY_CARD_CACHE_SIZE  覚えておくカードの数（既定 20000。0 ならキャッシュしません）
+"""
+import os
+import threading
+from collections import OrderedDict
+from operator import itemgetter
+
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+
+from db import current_database
+from images import variants_version
+
+CARD_CACHE_SIZE = int(os.environ.get("PANTRY_CARD_CACHE_SIZE", "20000"))
+TEMPLATE_CACHE_DIR = os.environ.get("PANTRY_TEMPLATE_CACHE_DIR")
+
+CARD_TEMPLATE = "macros/product_card.html"
+
+# カードに出る列。updated_at は秒単位で、商品の編集では変わらないので、表示する値もあわせて比べます
+CARD_FIELDS = (
+    "updated_at",
+    "name",
+    "origin",
+    "unit",
+    "current_stock",
+    "reorder_level",
+    "category_id",
+    "image_path",
+    "icon",
+    "stock_status",
+)
+_fingerprint = itemgetter(*CARD_FIELDS)
+
+
+class CardCache:
+    """商品カードの描画結果（ワーカープロセスごと・店舗ごと）
+
+    キーは (店舗, マクロ名, 商品ID, マクロの引数)。1商品につき最新の1枚だけを覚えておき、
+    しばらく使われていないカードから捨てます。
+    """
+
+    def __init__(self, max_size=CARD_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._variants_version = variants_version()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, macro, rows, *args):
+        """rows の商品のカードを順に描画し、つなげた HTML を返す"""
+        if self.max_size <= 0:
+            self.misses += len(rows)
+            return Markup("".join(macro(row, *args) for row in rows))
+
+        database = current_database()
+        keys = [(database, macro.name, row["id"], *args) for row in rows]
+        fingerprints = [_fingerprint(row) for row in rows]
+
+        # 画像のサイズ違いが作られたら（flask build-thumbnails など）、<img> が変わるので描き直します
+        version = variants_version()
+
+        # 1画面ぶんをまとめて引き、ロックを取るのは前後の2回だけにします
+        html = [None] * len(rows)
+        with self._lock:
+            if version != self._variants_version:
+                self._entries.clear()
+                self._variants_version = version
+            for i, key in enumerate(keys):
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] == fingerprints[i]:
+                    self._entries.move_to_end(key)
+                    html[i] = entry[1]
+            hits = sum(1 for card in html if card is not None)
+            self.hits += hits
+            self.misses += len(rows) - hits
+
+        rendered = {}
+        for i, row in enumerate(rows):
+            if html[i] is None:
+                html[i] = rendered[i] = str(macro(row, *args))
+
+        if rendered:
+            with self._lock:
+                for i, card in rendered.items():
+                    self._entries[keys[i]] = (fingerprints[i], card)
+                    self._entries.move_to_end(keys[i])
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return Markup("".join(html))
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "max_size": self.max_size,
+            }
+
+
+card_cache = CardCache()
+
+
+def precompile_templates(app):
+    """テンプレートをすべて読み込んでコンパイルしておき、コンパイルした数を返す"""
+    env = app.jinja_env
+    names = env.list_templates(filter_func=lambda name: name.endswith(".html"))
+    for name in names:
+        env.get_template(name)
+    return len(names)
+
+
+def init_app(app):
+    if TEMPLATE_CACHE_DIR:
+        os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(TEMPLATE_CACHE_DIR)
+
+    def render_cards(name, rows, *args):
+        """商品カードを並べて描画する（変わっていない商品は前回の描画結果を使います）"""
+        macro = getattr(app.jinja_env.get_template(CARD_TEMPLATE).module, name)
+        return card_cache.render(macro, rows, *args)
+
+    app.jinja_env.globals["render_cards"] = render_cards
+
+    # デバッグ中（テンプレートの自動再読み込み）は、古い描画結果を出さないようにキャッシュしません
+    if app.debug:
+        card_cache.max_size = 0
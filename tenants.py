@@ -0,0 +1,202 @@
+"""複数店舗（テナント）
+
+PANTRY_TENANTS_DIR を設定すると、店舗ごとに別のデータベースファイルを使います。
+
+    <PANTRY_TENANTS_DIR>/<店舗名>/pantry_track.db
+    <PANTRY_TENANTS_DIR>/<店舗名>/archive/   （ログの保管ファイル）
+    <PANTRY_TENANTS_DIR>/<店舗名>/backups/   （スナップショット）
+
+SQLite の書き込みロックはファイルごとなので、店舗同士の書き込みは待ち合わせません。
+リクエストの店舗はサブドメイン（PANTRY_TENANT_DOMAIN=pantry.example.com なら
+shibuya.pantry.example.com → shibuya）か、「店舗を選ぶ」で選んだセッションの値で決まります。
+設定しなければ、これまでどおり PANTRY_DATABASE の1店舗だけで動きます。
+
+    PANTRY_TENANTS_DIR      店舗のフォルダーを置く場所
+    PANTRY_TENANT_DOMAIN    サブドメインで店舗を選ぶときの親ドメイン
+    PANTRY_MAX_OPEN_STORES  1ワーカーで接続を開いておく店舗の数（既定 32、db.py）
+    PANTRY_REPORT_WORKERS   店舗をまたぐ集計を並行して読むスレッド数（既定 4）
+"""
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from flask import abort, g, redirect, request, session, url_for
+
+from db import DATABASE, current_database, reset_database, set_database, use_database
+from migrations import run_migrations
+
+TENANTS_DIR = os.environ.get("PANTRY_TENANTS_DIR")
+TENANT_DOMAIN = os.environ.get("PANTRY_TENANT_DOMAIN")
+# 店舗のフォルダーの中のデータベースのファイル名
+TENANT_DB_NAME = os.path.basename(DATABASE)
+REPORT_WORKERS = int(os.environ.get("PANTRY_REPORT_WORKERS", "4"))
+
+# 店舗名はフォルダー名とサブドメインに使うので、英小文字・数字・ハイフンだけにします
+_STORE_NAME = re.compile(r"^[a-z0-9][a-z0-9-]{0,31}$")
+
+# 店舗を選ばなくても開ける画面
+EXEMPT_ENDPOINTS = {
+    "static", "service_worker", "choose_store", "select_store", "healthz", "readyz",
+}
+
+_migrated = set()
+_migrate_lock = threading.Lock()
+
+
+class UnknownStore(LookupError):
+    """店舗名が正しくない・その店舗のデータベースがないときのエラー"""
+
+
+def enabled():
+    return bool(TENANTS_DIR)
+
+
+def store_path(store):
+    if not _STORE_NAME.match(store or ""):
+        raise UnknownStore(f"店舗名が正しくありません: {store}")
+    return os.path.join(TENANTS_DIR, store, TENANT_DB_NAME)
+
+
+def list_stores():
+    """データベースのある店舗名の一覧"""
+    try:
+        names = os.listdir(TENANTS_DIR)
+    except (OSError, TypeError):
+        return []
+    return sorted(
+        name for name in names
+        if _STORE_NAME.match(name) and os.path.exists(os.path.join(TENANTS_DIR, name, TENANT_DB_NAME))
+    )
+
+
+def ensure_migrated(path):
+    # データベースごとに、このワーカーで最初に使うときに一度だけ未適用のマイグレーションを流します
+    # （--preload ならマスターの create_app() で済ませたものを、fork したワーカーが引き継ぎます）
+    if path in _migrated:
+        return
+    with _migrate_lock:
+        if path not in _migrated:
+            run_migrations(path)
+            _migrated.add(path)
+
+
+def database_for(store):
+    """店舗のデータベースのパス（なければ UnknownStore）"""
+    path = store_path(store)
+    if not os.path.exists(path):
+        raise UnknownStore(f"店舗が見つかりません: {store}")
+    ensure_migrated(path)
+    return path
+
+
+def create_store(store):
+    """店舗のフォルダーと、マイグレーション済みの空のデータベースを作る"""
+    path = store_path(store)
+    if os.path.exists(path):
+        raise ValueError(f"{store} はもうあります")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    run_migrations(path)
+    _migrated.add(path)
+    return path
+
+
+def current_store():
+    """今のリクエストの店舗名（1店舗だけのときは None）"""
+    if not enabled():
+        return None
+    store_dir = os.path.dirname(os.path.abspath(current_database()))
+    # 店舗をまだ選んでいない（既定のデータベースのまま）なら None
+    if os.path.dirname(store_dir) != os.path.abspath(TENANTS_DIR):
+        return None
+    return os.path.basename(store_dir)
+
+
+@contextmanager
+def use_store(store):
+    with use_database(database_for(store)):
+        yield store
+
+
+def data_dir(kind, override=None):
+    """保管ファイル・スナップショットなどの置き場所
+
+    1店舗なら override（環境変数）か、データベースと同じフォルダーの kind/。
+    複数店舗なら、店舗ごとのフォルダーの中に分けます（店舗を選んでいなければ UnknownStore）。
+    """
+    if override:
+        if not enabled():
+            return override
+        store = current_store()
+        if store is None:
+            raise UnknownStore(f"店舗を選んでから使ってください（{kind}）")
+        return os.path.join(override, store)
+    return os.path.join(os.path.dirname(os.path.abspath(current_database())), kind)
+
+
+def store_from_host(host):
+    """Host ヘッダーのサブドメインから店舗名を取り出す（なければ None）"""
+    if not TENANT_DOMAIN or not host:
+        return None
+    host = host.split(":", 1)[0].lower()
+    suffix = "." + TENANT_DOMAIN.lower()
+    if not host.endswith(suffix):
+        return None
+    return host[: -len(suffix)] or None
+
+
+def requested_store():
+    """このリクエストの店舗名（サブドメインが優先、なければセッション）"""
+    return store_from_host(request.host) or session.get("store")
+
+
+def fan_out(fn, *args, stores=None, workers=REPORT_WORKERS):
+    """店舗ごとに fn(*args) をその店舗のデータベースで実行する（店舗をまたぐ集計用）
+
+    [(店舗名, 結果, エラー), ...] を店舗名の順に返します。1店舗の失敗で全体は止めません。
+    """
+    stores = list_stores() if stores is None else stores
+
+    def run(store):
+        try:
+            with use_store(store):
+                return store, fn(*args), None
+        except Exception as e:
+            return store, None, e
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="store-report") as executor:
+        return list(executor.map(run, stores))
+
+
+def init_app(app):
+    if not enabled():
+        # 1店舗なら、create_app() を通らずに起動した（app:app）ときも最初のリクエストで流します
+        app.before_request(lambda: ensure_migrated(current_database()))
+        return
+    app.jinja_env.globals["current_store"] = current_store
+
+    @app.before_request
+    def select_store_database():
+        # ワーカーのスレッドは使い回されるので、前のリクエストの店舗が残らないよう
+        # いったん既定のデータベースにしてから、このリクエストの店舗に切り替えます
+        g.database_token = set_database(DATABASE)
+        store = requested_store()
+        if store is None:
+            if request.endpoint in EXEMPT_ENDPOINTS:
+                return None
+            return redirect(url_for("choose_store"))
+        try:
+            set_database(database_for(store))
+        except UnknownStore:
+            # 消された店舗を選んだままのセッションは、選び直してもらいます
+            if session.pop("store", None) == store:
+                return redirect(url_for("choose_store"))
+            abort(404)
+        return None
+
+    @app.teardown_request
+    def reset_store_database(exc):
+        token = g.pop("database_token", None)
+        if token is not None:
+            reset_database(token)
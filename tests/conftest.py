@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+# テストはリポジトリ直下のモジュール（db.py など）をそのまま読み込みます
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+
+@pytest.fixture
+def database(tmp_path):
+    """マイグレーション済みの一時データベースを、このテストのデータベースにする"""
+    from db import pools, use_database
+    from migrations import run_migrations
+
+    path = str(tmp_path / "pantry_track.db")
+    run_migrations(path)
+    with use_database(path):
+        yield path
+    pools.discard(path)
+
+
+@pytest.fixture
+def client(database):
+    """一時データベースを使うテスト用クライアント"""
+    from app import app
+
+    return app.test_client()
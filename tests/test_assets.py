@@ -0,0 +1,44 @@
+"""Tailwind CSS がなければ起動時にビルドし、ビルドできなければ準備完了にしないこと"""
+import os
+import shutil
+
+import pytest
+from flask import Flask
+
+import startup
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TAILWIND = os.path.join(ROOT_DIR, "node_modules", ".bin", "tailwindcss")
+
+
+def make_app(root):
+    os.makedirs(os.path.join(root, "static", "css"), exist_ok=True)
+    return Flask("pantry_assets_test", root_path=str(root))
+
+
+def test_missing_css_without_build_tool_is_not_ready(tmp_path):
+    app = make_app(tmp_path)
+    with pytest.raises(RuntimeError, match="npm install"):
+        startup.check_assets(app)
+
+
+@pytest.mark.skipif(not os.path.exists(TAILWIND), reason="npm install していません")
+def test_missing_css_is_built(tmp_path):
+    for name in ("tailwind.config.js", "node_modules", "templates", "static"):
+        source = os.path.join(ROOT_DIR, name)
+        target = tmp_path / name
+        if name == "node_modules":
+            os.symlink(source, target)
+        elif os.path.isdir(source):
+            shutil.copytree(source, target, ignore=shutil.ignore_patterns("products", "tailwind.css"))
+        else:
+            shutil.copy(source, target)
+    app = make_app(tmp_path)
+
+    step = startup.check_assets(app)
+
+    assert step["built"] is True
+    with open(startup.tailwind_path(app), encoding="utf-8") as f:
+        css = f.read()
+    assert ".btn" in css
+    assert "@apply" not in css
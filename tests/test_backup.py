@@ -0,0 +1,113 @@
+"""在庫の書き込みが続いている間に取ったスナップショットから、壊れずに書き戻せること"""
+import sqlite3
+import threading
+from contextlib import closing
+
+import backup
+from db import get_db_connection, use_database
+from logs import INCOMING_EVENTS
+from stock import change_stock, mode_to_change
+
+PRODUCTS = 5
+# コピーが何回にも分かれるくらいの大きさにしておきます
+SEED_LOGS = 20_000
+
+
+def seed(count):
+    with get_db_connection() as conn:
+        ids = [
+            conn.execute("INSERT INTO products (name, unit) VALUES (?, '個')", (f"商品{i}",)).lastrowid
+            for i in range(PRODUCTS)
+        ]
+        conn.commit()
+    for i in range(count // 100):
+        product_id = ids[i % PRODUCTS]
+        _, event = mode_to_change("arrival")
+        with get_db_connection() as conn:
+            conn.executemany(
+                "INSERT INTO inventory_logs (product_id, staff_id, event, quantity) VALUES (?, 1, ?, 1)",
+                [(product_id, event)] * 100,
+            )
+            conn.execute(
+                "UPDATE products SET current_stock = current_stock + 100 WHERE id = ?", (product_id,)
+            )
+            conn.commit()
+    return ids
+
+
+def counts(path):
+    with closing(sqlite3.connect(path)) as conn:
+        return {
+            table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in ("products", "inventory_logs", "staffs", "schema_migrations")
+        }
+
+
+def stock_matches_logs(path):
+    """各商品の在庫が、ログの増減の合計と一致しているか"""
+    incoming = ",".join(str(int(event)) for event in INCOMING_EVENTS)
+    with closing(sqlite3.connect(path)) as conn:
+        rows = conn.execute(
+            f"""
+            SELECT p.current_stock,
+                   COALESCE(SUM(CASE WHEN l.event IN ({incoming}) THEN l.quantity
+                                     ELSE -l.quantity END), 0)
+            FROM products p LEFT JOIN inventory_logs l ON l.product_id = p.id
+            GROUP BY p.id
+            """
+        ).fetchall()
+    return all(stock == total for stock, total in rows)
+
+
+def test_snapshot_during_writes_restores_cleanly(database, tmp_path):
+    product_ids = seed(SEED_LOGS)
+    backup_dir = str(tmp_path / "backups")
+    stop = threading.Event()
+    writes = []
+
+    def writer():
+        with use_database(database):
+            i = 0
+            while not stop.is_set():
+                sign, event = mode_to_change("arrival")
+                change_stock(product_ids[i % PRODUCTS], sign, 1, event, 1)
+                writes.append(i)
+                i += 1
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        result = backup.create_snapshot(database, backup_dir)
+    finally:
+        stop.set()
+        thread.join()
+
+    assert writes, "スナップショットの間に書き込みが進んでいません"
+    snapshot = result["path"]
+    backup.check_integrity(snapshot)
+    assert stock_matches_logs(snapshot)
+    expected = counts(snapshot)
+    assert SEED_LOGS <= expected["inventory_logs"] <= SEED_LOGS + len(writes)
+
+    # 書き込みのあとの状態から、スナップショットの時点へ書き戻します
+    assert counts(database)["inventory_logs"] == SEED_LOGS + len(writes)
+    safety_path = backup.restore_snapshot(snapshot, database, backup_dir)
+
+    assert counts(database) == expected
+    assert stock_matches_logs(database)
+    with closing(sqlite3.connect(database)) as conn:
+        assert conn.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert counts(safety_path)["inventory_logs"] == SEED_LOGS + len(writes)
+
+
+def test_unchanged_database_is_not_copied_again(database, tmp_path):
+    seed(100)
+    backup_dir = str(tmp_path / "backups")
+    assert backup.create_snapshot(database, backup_dir) is not None
+    assert backup.create_snapshot(database, backup_dir) is None
+
+    sign, event = mode_to_change("departure")
+    change_stock(1, sign, 1, event, 1)
+    assert backup.create_snapshot(database, backup_dir) is not None
+    assert len(backup.list_snapshots(backup_dir)) == 2
@@ -0,0 +1,41 @@
+"""一括入庫の API が、おかしな数量や登録されていないスタッフを受け付けないこと"""
+import pytest
+
+from db import get_db_connection
+from stock import parse_bulk_form, parse_bulk_items
+
+
+def add_product():
+    with get_db_connection() as conn:
+        product_id = conn.execute("INSERT INTO products (name, unit) VALUES ('牛乳', '本')").lastrowid
+        conn.commit()
+    return product_id
+
+
+@pytest.mark.parametrize("value", ["inf", "-inf", "nan", "1e999"])
+def test_non_finite_quantities_are_rejected(value):
+    with pytest.raises(ValueError):
+        parse_bulk_items([{"product_id": 1, "quantity": value}])
+    with pytest.raises(ValueError):
+        parse_bulk_form({"qty_1": value})
+
+
+def test_api_rejects_unknown_staff(client):
+    product_id = add_product()
+    items = [{"product_id": product_id, "quantity": 2}]
+
+    response = client.post("/api/bulk_arrival", json={"staff_id": 999, "items": items})
+    assert response.status_code == 400
+    response = client.post("/api/bulk_arrival", json={"staff_id": "x", "items": items})
+    assert response.status_code == 400
+    response = client.post(
+        "/api/bulk_arrival", json={"items": [{"product_id": product_id, "quantity": "inf"}]}
+    )
+    assert response.status_code == 400
+
+    with get_db_connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM inventory_logs").fetchone()[0] == 0
+
+    response = client.post("/api/bulk_arrival", json={"staff_id": 1, "items": items})
+    assert response.status_code == 200
+    assert response.get_json() == {"applied": [product_id], "missing": []}
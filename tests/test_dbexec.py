@@ -0,0 +1,43 @@
+"""非同期モードの書き込み用スレッドでも、ロック競合のときはやり直すこと"""
+import sqlite3
+import threading
+
+import pytest
+
+import dbexec
+from db import get_db_connection
+from stock import run_write
+
+
+@pytest.fixture
+def executor(database):
+    yield dbexec.start()
+    dbexec.stop()
+
+
+def test_busy_write_is_retried_in_the_writer_thread(executor):
+    attempts = []
+
+    def work(conn):
+        attempts.append(threading.current_thread().name)
+        if len(attempts) < 3:
+            raise sqlite3.OperationalError("database is locked")
+        conn.execute("INSERT INTO staffs (name) VALUES ('アルバイト')")
+        return len(attempts)
+
+    assert run_write(work) == 3
+    assert all(name.startswith("db-write-") for name in attempts)
+    with get_db_connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM staffs WHERE name = 'アルバイト'").fetchone()[0] == 1
+
+
+def test_other_errors_are_not_retried(executor):
+    attempts = []
+
+    def work(conn):
+        attempts.append(1)
+        raise sqlite3.OperationalError("no such table: nothing")
+
+    with pytest.raises(sqlite3.OperationalError, match="no such table"):
+        run_write(work)
+    assert attempts == [1]
@@ -0,0 +1,18 @@
+"""起動時の実行計画チェックが、画面のクエリを通し、全件スキャンを見逃さないこと"""
+from db import get_db_connection
+from migrations import QUERY_PLAN_CHECKS, check_query_plans
+
+
+def test_route_queries_use_indexes(database):
+    with get_db_connection() as conn:
+        assert check_query_plans(conn) == []
+
+
+def test_scan_inside_a_limited_query_is_reported(database):
+    query = """
+        SELECT * FROM (SELECT product_id, SUM(quantity) AS total FROM inventory_logs GROUP BY product_id)
+        ORDER BY total DESC LIMIT 10
+    """
+    with get_db_connection() as conn:
+        problems = check_query_plans(conn, [*QUERY_PLAN_CHECKS, ("ranking", query, ())])
+    assert problems and {name for name, _ in problems} == {"ranking"}
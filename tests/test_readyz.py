@@ -0,0 +1,43 @@
+"""/readyz が、app:create_app() でも app:app でも準備ができたら 200 になること"""
+import pytest
+
+import startup
+
+
+@pytest.fixture
+def fresh_state(monkeypatch, tmp_path):
+    # ウォームアップはプロセスごとに一度だけなので、テストごとに作り直します
+    monkeypatch.setattr(startup, "state", startup.StartupState())
+    css = tmp_path / "tailwind.css"
+    css.write_text("/* built */")
+    monkeypatch.setattr(startup, "tailwind_path", lambda app: str(css))
+    return startup.state
+
+
+def test_factory_is_ready_before_the_first_request(client, fresh_state):
+    from app import create_app
+
+    create_app()
+    response = client.get("/readyz")
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["status"] == "ready"
+    assert body["lazy"] is False
+
+
+def test_plain_app_warms_up_after_the_first_probe(client, fresh_state):
+    response = client.get("/readyz")
+    assert response.status_code == 503
+    assert response.get_json()["status"] == "starting"
+
+    fresh_state.background.join(timeout=60)
+    response = client.get("/readyz")
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["status"] == "ready"
+    assert body["lazy"] is True
+    assert [step["name"] for step in body["steps"]][-5:] == [
+        "assets", "migrate", "schema", "read_caches", "db_pool",
+    ]
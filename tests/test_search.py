@@ -0,0 +1,43 @@
+"""在庫一覧の検索が、直接編集された商品名も拾い、1文字違いの短い語でも近い商品を出すこと"""
+import analytics
+import search
+from db import get_db_connection
+
+
+def add_product(name):
+    with get_db_connection() as conn:
+        conn.execute("INSERT INTO products (name, unit) VALUES (?, '袋')", (name,))
+        search.sync_index(conn)
+        conn.commit()
+
+
+def names(response):
+    return [product["name"] for product in response.get_json()["products"]]
+
+
+def test_directly_edited_names_are_indexed_without_the_rollup_ticker(client, monkeypatch):
+    monkeypatch.setattr(analytics.rollup_ticker, "interval", 0)
+    add_product("紅茶")
+    # DB Browser などで直接名前を変えたとき（sync_index は呼ばれません）
+    with get_db_connection() as conn:
+        conn.execute("UPDATE products SET name = 'ほうじ茶'")
+        conn.commit()
+
+    response = client.get("/stock_list/items?q=ほうじ茶&format=json")
+    assert names(response) == ["ほうじ茶"]
+    assert response.get_json()["fuzzy"] is False
+
+
+def test_one_character_typo_finds_the_product(client):
+    add_product("コーヒー豆")
+    add_product("ひよこ豆")
+
+    response = client.get("/stock_list/items?q=コヒー&format=json")
+    assert names(response) == ["コーヒー豆"]
+    assert response.get_json()["fuzzy"] is True
+
+
+def test_typo_distance():
+    assert search.typo_distance("こひい", search.fold("コーヒー豆")) == 1
+    assert search.typo_distance("こおひい", search.fold("コーヒー豆")) == 0
+    assert search.typo_distance("こひい", search.fold("牛乳")) == 3
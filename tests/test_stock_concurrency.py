@@ -0,0 +1,97 @@
+"""1つの商品に入庫・出庫を同時に流しても、在庫とログが食い違わず、ロック競合のエラーも出ないこと"""
+import sqlite3
+import threading
+
+from db import get_db_connection, use_database
+from logs import INCOMING_EVENTS, LogEvent
+from stock import change_stock, mode_to_change
+
+THREADS = 16
+CHANGES_PER_THREAD = 150
+
+
+def add_product():
+    with get_db_connection() as conn:
+        product_id = conn.execute("INSERT INTO products (name, unit) VALUES ('コーヒー豆', '袋')").lastrowid
+        conn.commit()
+    return product_id
+
+
+def stock_and_logged(product_id):
+    """(在庫, ログの増減の合計, ログの件数)"""
+    incoming = ",".join(str(int(event)) for event in INCOMING_EVENTS)
+    with get_db_connection() as conn:
+        return tuple(
+            conn.execute(
+                f"""
+                SELECT p.current_stock,
+                       COALESCE(SUM(CASE WHEN l.event IN ({incoming}) THEN l.quantity
+                                         ELSE -l.quantity END), 0),
+                       COUNT(l.id)
+                FROM products p
+                LEFT JOIN inventory_logs l ON l.product_id = p.id
+                WHERE p.id = ?
+                GROUP BY p.id
+                """,
+                (product_id,),
+            ).fetchone()
+        )
+
+
+def run_threads(database, work):
+    errors = []
+    start = threading.Barrier(THREADS)
+
+    def worker(n):
+        # スレッドには ContextVar が引き継がれないので、使うデータベースを決め直します
+        with use_database(database):
+            start.wait()
+            try:
+                work(n)
+            except sqlite3.Error as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+def test_parallel_arrivals_and_departures_keep_stock_consistent(database):
+    product_id = add_product()
+
+    def work(n):
+        for i in range(CHANGES_PER_THREAD):
+            mode = ("arrival", "departure", "waste")[(n + i) % 3]
+            sign, event = mode_to_change(mode)
+            quantity = 1 + (n + i) % 4
+            # 出庫の一部は「1つ減らす」と同じく 0 で止めます
+            floor = 0 if mode == "departure" and i % 2 else None
+            change_stock(product_id, sign * quantity, 1, event, quantity, floor=floor)
+
+    errors = run_threads(database, work)
+
+    assert not any("locked" in str(e) or "busy" in str(e) for e in errors), errors
+    assert errors == []
+    stock, logged, count = stock_and_logged(product_id)
+    assert THREADS * CHANGES_PER_THREAD >= 2000
+    assert 0 < count <= THREADS * CHANGES_PER_THREAD
+    assert stock == logged
+
+
+def test_departure_floor_is_applied_under_the_write_lock(database):
+    product_id = add_product()
+    change_stock(product_id, 5, 1, LogEvent.ARRIVAL, 5)
+
+    errors = run_threads(
+        database, lambda n: change_stock(product_id, -1, 1, LogEvent.DEPARTURE, 1, floor=0)
+    )
+
+    assert errors == []
+    stock, logged, count = stock_and_logged(product_id)
+    # 0 で止まった分はログに残さないので、入庫1件 + 出庫5件です
+    assert stock == 0
+    assert logged == 0
+    assert count == 6
@@ -0,0 +1,46 @@
+"""数量入力の画面から、おかしな数量で在庫を動かせないこと"""
+import pytest
+
+from db import get_db_connection
+
+
+def add_product():
+    with get_db_connection() as conn:
+        product_id = conn.execute("INSERT INTO products (name, unit) VALUES ('牛乳', '本')").lastrowid
+        conn.commit()
+    return product_id
+
+
+def stock_and_log_count(product_id):
+    with get_db_connection() as conn:
+        stock = conn.execute("SELECT current_stock FROM products WHERE id = ?", (product_id,)).fetchone()[0]
+        count = conn.execute("SELECT COUNT(*) FROM inventory_logs").fetchone()[0]
+    return stock, count
+
+
+@pytest.mark.parametrize("value", ["inf", "nan", "-3", "0", "abc", ""])
+def test_bad_quantities_are_rejected(client, value):
+    product_id = add_product()
+
+    response = client.post(f"/arrival/execute/{product_id}", data={"quantity": value})
+
+    assert response.status_code == 302
+    assert response.location.endswith(f"/arrival/entry/{product_id}")
+    assert stock_and_log_count(product_id) == (0, 0)
+
+
+def test_valid_quantity_is_applied(client):
+    product_id = add_product()
+
+    response = client.post(f"/arrival/execute/{product_id}", data={"quantity": "2.5"})
+
+    assert response.status_code == 302
+    assert stock_and_log_count(product_id) == (2.5, 1)
+
+
+def test_reduce_at_zero_does_not_log(client):
+    product_id = add_product()
+
+    client.post(f"/reduce/{product_id}")
+
+    assert stock_and_log_count(product_id) == (0, 0)
@@ -0,0 +1,49 @@
+"""オフライン操作の同期で、受け付けなかった操作が理由ごとサーバーに残ること"""
+import json
+
+import sync
+from db import get_db_connection
+from stock import run_write
+
+
+def add_product():
+    with get_db_connection() as conn:
+        product_id = conn.execute("INSERT INTO products (name, unit) VALUES ('牛乳', '本')").lastrowid
+        conn.commit()
+    return product_id
+
+
+def op(op_id, product_id, quantity, **extra):
+    return {"op_id": op_id, "mode": "arrival", "product_id": product_id, "quantity": quantity, **extra}
+
+
+def send(items):
+    return run_write(sync.apply_sync_ops, sync.parse_sync_ops(items, 1))
+
+
+def test_unknown_staff_and_bad_quantity_are_rejected_and_kept(database):
+    product_id = add_product()
+    items = [
+        op("op-applied-1", product_id, 3, staff_id=1),
+        op("op-staff-999", product_id, 3, staff_id=999),
+        op("op-infinite", product_id, "inf"),
+    ]
+    statuses = [result["status"] for result in send(items)["results"]]
+    assert statuses == [sync.APPLIED, sync.REJECTED, sync.REJECTED]
+
+    with get_db_connection() as conn:
+        stock = conn.execute("SELECT current_stock FROM products WHERE id = ?", (product_id,)).fetchone()[0]
+        assert stock == 3
+        assert conn.execute("SELECT COUNT(*) FROM inventory_logs").fetchone()[0] == 1
+        rejected = {row["op_id"]: row for row in sync.rejected_ops(conn)}
+    assert set(rejected) == {"op-staff-999", "op-infinite"}
+    assert rejected["op-staff-999"]["error"] == "スタッフが見つかりませんでした"
+    assert json.loads(rejected["op-staff-999"]["payload"])["staff_id"] == 999
+    assert rejected["op-infinite"]["product_id"] == product_id
+
+    # 再送されても在庫は動かず、受け付けなかった操作にはそのときの理由を返します
+    results = send(items)["results"]
+    assert [result["status"] for result in results] == [sync.DUPLICATE, sync.REJECTED, sync.REJECTED]
+    assert results[1]["error"] == "スタッフが見つかりませんでした"
+    with get_db_connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM inventory_logs").fetchone()[0] == 1
@@ -0,0 +1,71 @@
+"""商品の取り込みが、おかしな数値を行ごとのエラーにし、確認のあとの変更も見落とさないこと"""
+import transfer
+from db import get_db_connection
+
+HEADER = "商品名,カテゴリ,単位,在庫,発注点\n"
+
+
+def write_csv(tmp_path, body):
+    path = tmp_path / "products.csv"
+    path.write_text(HEADER + body, encoding="utf-8")
+    return str(path)
+
+
+def product_count():
+    with get_db_connection() as conn:
+        return conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+
+
+def test_non_finite_and_negative_numbers_are_row_errors(database, tmp_path):
+    path = write_csv(
+        tmp_path,
+        "牛乳,乳製品,本,inf,1\n"
+        "卵,乳製品,パック,-1,1\n"
+        "バター,乳製品,個,2,nan\n"
+        "チーズ,乳製品,個,3,1\n",
+    )
+
+    report = transfer.import_products(path, 1, dry_run=False)
+
+    assert [line for line, _ in report.errors] == [2, 3, 4]
+    assert "0以上" in report.errors[1][1]
+    assert report.inserted == 1
+    # エラーが1件でもあれば、正しい行も取り込みません
+    assert product_count() == 0
+
+
+def test_import_writes_the_checked_rows(database, tmp_path):
+    path = write_csv(tmp_path, "牛乳,乳製品,本,3,1\nチーズ,新しいカテゴリ,個,0,1\n")
+
+    preview = transfer.import_products(path, 1)
+    assert (preview.inserted, preview.error_count) == (2, 0)
+    assert preview.new_categories == ["乳製品", "新しいカテゴリ"]
+    assert product_count() == 0
+
+    report = transfer.import_products(path, 1, dry_run=False)
+    assert (report.inserted, report.error_count) == (2, 0)
+    with get_db_connection() as conn:
+        rows = conn.execute(
+            "SELECT p.name, c.name AS category, p.current_stock FROM products p "
+            "JOIN categories c ON c.id = p.category_id ORDER BY p.name"
+        ).fetchall()
+    assert [tuple(row) for row in rows] == [("チーズ", "新しいカテゴリ", 0), ("牛乳", "乳製品", 3)]
+
+
+def test_products_added_after_the_check_are_not_duplicated(database, tmp_path, monkeypatch):
+    path = write_csv(tmp_path, "牛乳,乳製品,本,3,1\n")
+    plan_import = transfer._plan_import
+
+    def plan_then_add(conn, path):
+        # 確認が終わって書き込みロックを取るまでのあいだに、同じ名前の商品が登録されたとき
+        planned = plan_import(conn, path)
+        with get_db_connection() as other:
+            other.execute("INSERT INTO products (name, unit) VALUES ('牛乳', '本')")
+            other.commit()
+        return planned
+
+    monkeypatch.setattr(transfer, "_plan_import", plan_then_add)
+    report = transfer.import_products(path, 1, dry_run=False)
+
+    assert report.error_count == 1
+    assert product_count() == 1
@@ -0,0 +1,533 @@
+import csv
+import io
+import os
+import re
+import secrets
+import tempfile
+import time
+
+from db import current_database, get_db_connection, use_database
+from logs import LogEvent, build_logs_export_query, describe_log, encode_details
+from search import sync_index
+from stock import parse_quantity, run_write
+
+try:
+    import openpyxl
+except ImportError:  # openpyxl が入っていなければ CSV だけ取り込めます
+    openpyxl = None
+
+# 1回にまとめて確認・書き込みする行数
+IMPORT_CHUNK_SIZE = 1_000
+# 書き出しで1回に読む行数（この分ずつ送るので、全件をメモリに載せません）
+EXPORT_CHUNK_SIZE = 1_000
+# 確認画面に出す変更の件数（件数の集計は全件分です）
+REPORT_LIMIT = 200
+# 確認してから取り込むまで、アップロードされたファイルを置いておく場所
+UPLOAD_DIR = os.path.join(tempfile.gettempdir(), "pantry-import")
+# 確認したまま取り込まれなかったファイルを消すまでの秒数
+UPLOAD_MAX_AGE = 24 * 60 * 60
+
+IMPORT_EXTENSIONS = {".csv", ".xlsx"}
+
+# 書き出し・取り込みの見出し（書き出したファイルをそのまま取り込めます）
+PRODUCT_HEADERS = ("商品ID", "商品名", "カテゴリ", "産地", "単位", "在庫", "発注点")
+
+# 取り込むファイルの見出し → 項目名（英語の見出しでも読めます）
+COLUMN_ALIASES = {
+    "商品ID": "id",
+    "id": "id",
+    "商品名": "name",
+    "name": "name",
+    "カテゴリ": "category",
+    "category": "category",
+    "産地": "origin",
+    "origin": "origin",
+    "単位": "unit",
+    "unit": "unit",
+    "在庫": "current_stock",
+    "在庫数": "current_stock",
+    "current_stock": "current_stock",
+    "発注点": "reorder_level",
+    "補充の目安": "reorder_level",
+    "reorder_level": "reorder_level",
+}
+REQUIRED_COLUMNS = ("name", "category", "unit")
+
+# 変更の確認画面に出す項目名
+FIELD_LABELS = {
+    "name": "商品名",
+    "category": "カテゴリ",
+    "origin": "産地",
+    "unit": "単位",
+    "current_stock": "在庫",
+    "reorder_level": "発注点",
+    "is_active": "削除済みから戻す",
+}
+
+_TOKEN = re.compile(r"^[0-9a-f]{32}$")
+
+
+class ImportReport:
+    """取り込みの結果（確認だけのときは、取り込んだらどうなるか）"""
+
+    def __init__(self):
+        self.inserted = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.new_categories = []
+        self.error_count = 0
+        self.errors = []
+        self.changes = []
+
+    @property
+    def total(self):
+        return self.inserted + self.updated + self.unchanged + self.error_count
+
+    def add_change(self, action, line, name, fields=None):
+        if len(self.changes) < REPORT_LIMIT:
+            self.changes.append({"action": action, "line": line, "name": name, "fields": fields or []})
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < REPORT_LIMIT:
+            self.errors.append((line, message))
+
+
+class _Rollback(Exception):
+    """書き込む直前の確認でエラーがあったときに、トランザクションを取り消すための例外"""
+
+    def __init__(self, report):
+        self.report = report
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# アップロードされたファイル
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+def save_upload(file):
+    """アップロードされたファイルを一時的に保存し、あとで取り出すためのトークンを返す"""
+    ext = os.path.splitext(file.filename or "")[1].lower()
+    if ext not in IMPORT_EXTENSIONS:
+        raise ValueError("CSV（.csv）か Excel（.xlsx）のファイルを選んでください")
+    if ext == ".xlsx" and openpyxl is None:
+        raise ValueError("Excel ファイルを読むには openpyxl が必要です（CSV なら読めます）")
+
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    _remove_stale_uploads()
+    token = secrets.token_hex(16)
+    file.save(os.path.join(UPLOAD_DIR, token + ext))
+    return token
+
+
+def _remove_stale_uploads():
+    cutoff = time.time() - UPLOAD_MAX_AGE
+    for name in os.listdir(UPLOAD_DIR):
+        path = os.path.join(UPLOAD_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def upload_path(token):
+    if not _TOKEN.match(token or ""):
+        raise ValueError("ファイルの指定が正しくありません")
+    for ext in IMPORT_EXTENSIONS:
+        path = os.path.join(UPLOAD_DIR, token + ext)
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(token)
+
+
+def discard_upload(token):
+    try:
+        os.remove(upload_path(token))
+    except (ValueError, FileNotFoundError):
+        pass
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# ファイルの読み込み（1行ずつ読むので、大きなファイルでもメモリを使いません）
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+def _detect_encoding(path):
+    # Excel で保存した CSV は Shift_JIS（cp932）のことが多いので、先頭を見て決めます
+    with open(path, "rb") as f:
+        head = f.read(64 * 1024)
+    try:
+        head.decode("utf-8")
+    except UnicodeDecodeError as e:
+        # 読んだ範囲の最後で文字が切れているだけなら UTF-8 です
+        if e.start < len(head) - 3:
+            return "cp932"
+    return "utf-8-sig"
+
+
+def _map_header(header):
+    columns = [COLUMN_ALIASES.get(str(name or "").strip()) for name in header]
+    missing = [name for name in REQUIRED_COLUMNS if name not in columns]
+    if missing:
+        labels = "、".join(FIELD_LABELS[name] for name in missing)
+        raise ValueError(f"見出しに {labels} の列がありません")
+    return columns
+
+
+def _records(rows):
+    """見出し行 + データ行から、(行番号, {項目名: 値}) を順に返す"""
+    header = next(rows, None)
+    if header is None:
+        raise ValueError("ファイルが空です")
+    columns = _map_header(header)
+    for line, values in enumerate(rows, start=2):
+        if not any(value not in (None, "") for value in values):
+            continue
+        yield line, {
+            column: value for column, value in zip(columns, values) if column is not None
+        }
+
+
+def read_rows(path):
+    """CSV / Excel ファイルの行を (行番号, {項目名: 値}) で順に返す"""
+    if path.lower().endswith(".xlsx"):
+        if openpyxl is None:
+            raise ValueError("Excel ファイルを読むには openpyxl が必要です（CSV なら読めます）")
+        workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            yield from _records(workbook.active.iter_rows(values_only=True))
+        finally:
+            workbook.close()
+    else:
+        with open(path, newline="", encoding=_detect_encoding(path)) as f:
+            yield from _records(csv.reader(f))
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 商品の取り込み
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+def _text(value):
+    return "" if value is None else str(value).strip()
+
+
+def _number(value, label, default):
+    text = _text(value)
+    if not text:
+        return default
+    try:
+        number = parse_quantity(text)
+    except ValueError:
+        raise ValueError(f"{label}は数字で入力してください（{text}）") from None
+    if number < 0:
+        raise ValueError(f"{label}は0以上の数で入力してください（{text}）")
+    return number
+
+
+def validate_row(record):
+    """1行分を確認して、取り込む値の辞書を返す（問題があれば ValueError）"""
+    item = {
+        "name": _text(record.get("name")),
+        "category": _text(record.get("category")),
+        "origin": _text(record.get("origin")),
+        "unit": _text(record.get("unit")),
+        "current_stock": _number(record.get("current_stock"), "在庫", 0.0),
+        "reorder_level": _number(record.get("reorder_level"), "発注点", 1.0),
+    }
+    for name in REQUIRED_COLUMNS:
+        if not item[name]:
+            raise ValueError(f"{FIELD_LABELS[name]}が空です")
+
+    product_id = _text(record.get("id"))
+    if product_id:
+        try:
+            item["id"] = int(float(product_id))
+        except ValueError:
+            raise ValueError(f"商品IDは数字で入力してください（{product_id}）") from None
+    else:
+        item["id"] = None
+    return item
+
+
+def _chunks(records, size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _existing_products(conn, items):
+    """この塊の行に当たる登録済みの商品を、ID と名前（表示中の商品のみ）で引く"""
+    ids = [item["id"] for item in items if item["id"] is not None]
+    names = [item["name"] for item in items if item["id"] is None]
+    by_id = {}
+    by_name = {}
+    query = """
+        SELECT p.id, p.name, c.name AS category, p.category_id, p.origin, p.unit,
+               p.current_stock, p.reorder_level, p.is_active
+        FROM products p
+        LEFT JOIN categories c ON c.id = p.category_id
+    """
+    if ids:
+        placeholders = ", ".join("?" * len(ids))
+        for row in conn.execute(f"{query} WHERE p.id IN ({placeholders})", ids):
+            by_id[row["id"]] = row
+    if names:
+        placeholders = ", ".join("?" * len(names))
+        for row in conn.execute(
+            f"{query} WHERE p.is_active = 1 AND p.name IN ({placeholders}) ORDER BY p.id", names
+        ):
+            by_name.setdefault(row["name"], []).append(row)
+    return by_id, by_name
+
+
+def _diff(current, item):
+    fields = []
+    for name in ("name", "category", "origin", "unit", "current_stock", "reorder_level"):
+        before = current[name]
+        after = item[name]
+        if name == "origin":
+            before = before or ""
+        if before != after:
+            fields.append((FIELD_LABELS[name], before, after))
+    if not current["is_active"]:
+        fields.append((FIELD_LABELS["is_active"], "", ""))
+    return fields
+
+
+def _plan_import(conn, path):
+    """ファイルを塊ごとに確認して、今のデータとの違いを ImportReport と書き込む内容にまとめる
+
+    読み取りの接続で行うので、書き込みロックは持ちません。
+    書き込む内容は [(追加する行, 更新する行), ...] の塊ごとのリストで、
+    カテゴリは名前のまま持っておき、書き込むときに ID に直します。
+    """
+    report = ImportReport()
+    categories = {row["name"] for row in conn.execute("SELECT name FROM categories")}
+    seen = set()
+    plan = []
+
+    for chunk in _chunks(read_rows(path), IMPORT_CHUNK_SIZE):
+        items = []
+        for line, record in chunk:
+            try:
+                item = validate_row(record)
+            except ValueError as e:
+                report.add_error(line, str(e))
+                continue
+            key = ("id", item["id"]) if item["id"] is not None else ("name", item["name"])
+            if key in seen:
+                report.add_error(line, f"{item['name']} がファイルの中で重複しています")
+                continue
+            seen.add(key)
+            items.append((line, item))
+
+        by_id, by_name = _existing_products(conn, [item for _, item in items])
+        inserts = []
+        updates = []
+        for line, item in items:
+            if item["id"] is not None:
+                current = by_id.get(item["id"])
+                if current is None:
+                    report.add_error(line, f"商品ID {item['id']} の商品が見つかりません")
+                    continue
+            else:
+                matches = by_name.get(item["name"], [])
+                if len(matches) > 1:
+                    report.add_error(line, f"{item['name']} という商品が複数あります（商品IDを指定してください）")
+                    continue
+                current = matches[0] if matches else None
+
+            if item["category"] not in categories:
+                categories.add(item["category"])
+                report.new_categories.append(item["category"])
+            if current is None:
+                inserts.append((line, item))
+                report.inserted += 1
+                report.add_change("insert", line, item["name"])
+                continue
+
+            fields = _diff(current, item)
+            if not fields:
+                report.unchanged += 1
+                continue
+            updates.append((line, dict(item, id=current["id"])))
+            report.updated += 1
+            report.add_change("update", line, item["name"], fields)
+        plan.append((inserts, updates))
+
+    return report, plan
+
+
+def _category_ids(conn, names):
+    """カテゴリ名を ID に直す（まだないカテゴリはここで追加します）"""
+    categories = {row["name"]: row["id"] for row in conn.execute("SELECT id, name FROM categories")}
+    for name in names:
+        if name not in categories:
+            categories[name] = conn.execute(
+                "INSERT INTO categories (name) VALUES (?) RETURNING id", (name,)
+            ).fetchone()[0]
+    return categories
+
+
+def _recheck(conn, inserts, updates, report):
+    """確認してから書き込みロックを取るまでに、追加・更新する商品が変わっていないか
+
+    同じ名前の商品が先に登録された・更新する商品が消えたときは、その行をエラーにします。
+    """
+    by_id, by_name = _existing_products(
+        conn, [item for _, item in updates] + [item for _, item in inserts]
+    )
+    for line, item in inserts:
+        if item["name"] in by_name:
+            report.add_error(line, f"{item['name']} は確認のあとで登録されました（もう一度確認してください）")
+    for line, item in updates:
+        if item["id"] not in by_id:
+            report.add_error(line, f"商品ID {item['id']} の商品は確認のあとで削除されました")
+
+
+def _write_import(conn, plan, staff_id, report):
+    """確認済みの内容を書き込む（run_write の中で、書き込みロックを持って実行されます）"""
+    categories = _category_ids(conn, report.new_categories)
+
+    for inserts, updates in plan:
+        _recheck(conn, inserts, updates, report)
+        if report.error_count:
+            break
+
+        def values(item):
+            return (
+                item["name"], categories[item["category"]], item["origin"], item["current_stock"],
+                item["unit"], item["reorder_level"],
+            )
+
+        conn.executemany(
+            """
+            INSERT INTO products (name, category_id, origin, current_stock, unit, reorder_level, is_active)
+            VALUES (?, ?, ?, ?, ?, ?, 1)
+            """,
+            [values(item) for _, item in inserts],
+        )
+        conn.executemany(
+            """
+            UPDATE products
+            SET name = ?, category_id = ?, origin = ?, current_stock = ?, unit = ?, reorder_level = ?,
+                is_active = 1, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+            """,
+            [values(item) + (item["id"],) for _, item in updates],
+        )
+        # 画面から修正したときと同じく、変更後の内容をログに残します
+        conn.executemany(
+            """
+            INSERT INTO inventory_logs (product_id, staff_id, event, details, quantity)
+            VALUES (?, ?, ?, ?, 0)
+            """,
+            [
+                (
+                    item["id"], staff_id, LogEvent.PRODUCT_EDITED,
+                    encode_details(
+                        {
+                            "name": item["name"], "stock": item["current_stock"],
+                            "unit": item["unit"], "reorder_level": item["reorder_level"],
+                        }
+                    ),
+                )
+                for _, item in updates
+            ],
+        )
+
+    # 確認のあとで変わっていた行があれば、途中まで取り込むことはせずに全部取り消します
+    if report.error_count:
+        raise _Rollback(report)
+    # 追加・名前を変えた商品は、同じトランザクションの中で検索の索引にも入れます
+    sync_index(conn)
+    return report
+
+
+def import_products(path, staff_id, dry_run=True):
+    """CSV / Excel の商品一覧を取り込む（商品IDか商品名が同じものは更新、なければ追加）
+
+    ファイルの読み取り・確認は読み取りの接続で塊ごとに行い、書き込みロックは
+    確認が済んだあとの追加・更新のあいだだけ持ちます（在庫の書き込みを待たせません）。
+    書き込みは全体で1つのトランザクションで、dry_run のときやエラーがあったときは
+    何も変えずに、取り込んだらどうなるかの ImportReport を返します。
+    """
+    with get_db_connection() as conn:
+        # ファイル全体を、同じ時点のデータと比べます
+        conn.execute("BEGIN")
+        report, plan = _plan_import(conn, path)
+        conn.rollback()
+    if dry_run or report.error_count:
+        return report
+    try:
+        return run_write(_write_import, plan, staff_id, report)
+    except _Rollback as e:
+        return e.report
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 書き出し（CSV を少しずつ返すジェネレーター）
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+def _stream_csv(header, query, params, to_row):
+    # 本文はリクエストが終わってから読まれるので、店舗のデータベースはここで決めておきます
+    return _generate_csv(current_database(), header, query, params, to_row)
+
+
+def _generate_csv(database, header, query, params, to_row):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # Excel で開いても文字化けしないように BOM を付けます
+    buffer.write("\ufeff")
+    writer.writerow(header)
+
+    with use_database(database), get_db_connection() as conn:
+        cursor = conn.execute(query, params)
+        try:
+            while True:
+                rows = cursor.fetchmany(EXPORT_CHUNK_SIZE)
+                if not rows:
+                    break
+                writer.writerows(to_row(row) for row in rows)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        finally:
+            # 途中で接続を切られても、読みかけの文を残したまま接続をプールに返しません
+            cursor.close()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def export_products():
+    """表示中の商品を、取り込みと同じ見出しの CSV で返す"""
+    query = """
+        SELECT p.id, p.name, c.name AS category, p.origin, p.unit, p.current_stock, p.reorder_level
+        FROM products p
+        LEFT JOIN categories c ON c.id = p.category_id
+        WHERE p.is_active = 1
+        ORDER BY p.id
+    """
+    return _stream_csv(
+        PRODUCT_HEADERS,
+        query,
+        (),
+        lambda row: (
+            row["id"], row["name"], row["category"] or "", row["origin"] or "",
+            row["unit"] or "", row["current_stock"], row["reorder_level"],
+        ),
+    )
+
+
+def export_logs(filters):
+    """操作履歴を古い順に CSV で返す（絞り込みは /logs と同じ）"""
+    query, params = build_logs_export_query(filters)
+    return _stream_csv(
+        ("日時", "商品ID", "商品名", "スタッフ", "種別", "数量"),
+        query,
+        params,
+        lambda row: (
+            row["created_at"], row["product_id"], row["product_name"], row["staff_name"],
+            describe_log(row), row["quantity"],
+        ),
+    )
@@ -0,0 +1,153 @@
+import os
+import sqlite3
+import threading
+import time
+
+from db import current_database, is_busy_error, use_database
+from stock import apply_stock_change, run_write
+
+# 最初の1件が来てから、まとめて書き込むまでに待つ秒数
+# 0 でも、前のコミット中に溜まった分は次のコミットにまとまります（測ると 0 が一番速いです）
+BATCH_WINDOW = float(os.environ.get("PANTRY_WRITE_BEHIND_WINDOW_MS", "0")) / 1000
+# 1回のトランザクションにまとめる最大件数
+MAX_BATCH_SIZE = 200
+# 書き込みの完了を待つ最大秒数
+WAIT_TIMEOUT = 30.0
+
+
+class PendingTap:
+    """キューに入れた1件の在庫変更（書き込みが終わると done がセットされる）"""
+
+    def __init__(self, args, database):
+        self.args = args
+        self.database = database
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    def wait(self, timeout=WAIT_TIMEOUT):
+        if not self.done.wait(timeout):
+            raise sqlite3.OperationalError("在庫の書き込みがタイムアウトしました")
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def _apply_batch(conn, taps):
+    """キューに溜まった変更を、来た順に1つのトランザクションで適用する
+
+    1件ずつ SAVEPOINT で囲むので、失敗した変更だけを取り消して残りは反映します。
+    [(結果, エラー), ...] を返します。
+    """
+    outcomes = []
+    for tap in taps:
+        conn.execute("SAVEPOINT tap")
+        try:
+            result = apply_stock_change(conn, *tap.args[:5], floor=tap.args[5])
+        except sqlite3.Error as e:
+            # ロック競合はバッチ全体を run_write でやり直すので、そのまま上に投げます
+            if is_busy_error(e):
+                raise
+            conn.execute("ROLLBACK TO tap")
+            conn.execute("RELEASE tap")
+            outcomes.append((None, e))
+        else:
+            conn.execute("RELEASE tap")
+            outcomes.append((result, None))
+    return outcomes
+
+
+class WriteBehindQueue:
+    """+1 / -1 のタップをまとめて書き込む、ワーカープロセスごとのキュー
+
+    呼び出し側は submit() の戻り値の wait() で、自分の変更がコミットされるまで待ちます。
+    1件ずつ書くのと同じ順番・同じ SQL で適用するので、在庫とログの結果は変わりません。
+    """
+
+    def __init__(self, window=BATCH_WINDOW, max_batch_size=MAX_BATCH_SIZE):
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._pending = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stats = {"taps": 0, "batches": 0, "max_batch": 0, "errors": 0}
+
+    def submit(self, product_id, delta, staff_id, event, quantity, floor=None):
+        tap = PendingTap((product_id, delta, staff_id, event, quantity, floor), current_database())
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="write-behind", daemon=True
+                )
+                self._thread.start()
+            self._pending.append(tap)
+            self._cond.notify()
+        return tap
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+
+        # 最初の1件から少しだけ待って、後続のタップを同じコミットに乗せます
+        deadline = time.perf_counter() + self.window
+        with self._cond:
+            while len(self._pending) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._pending[:self.max_batch_size]
+            del self._pending[:self.max_batch_size]
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            # 複数店舗なら店舗ごとにデータベースが違うので、店舗ごとに分けてコミットします
+            by_database = {}
+            for tap in batch:
+                by_database.setdefault(tap.database, []).append(tap)
+            for database, taps in by_database.items():
+                self._write(database, taps)
+
+    def _write(self, database, batch):
+        try:
+            with use_database(database):
+                outcomes = run_write(_apply_batch, batch)
+        except Exception as e:
+            outcomes = [(None, e)] * len(batch)
+
+        with self._cond:
+            self._stats["taps"] += len(batch)
+            self._stats["batches"] += 1
+            self._stats["max_batch"] = max(self._stats["max_batch"], len(batch))
+            self._stats["errors"] += sum(1 for _, error in outcomes if error is not None)
+
+        for tap, (result, error) in zip(batch, outcomes):
+            tap.result = result
+            tap.error = error
+            tap.done.set()
+
+    def reset(self):
+        """fork 後の子プロセスでは、親の書き込みスレッドは動いていないので作り直す"""
+        self._pending = []
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats, pending=len(self._pending))
+        stats["avg_batch"] = stats["taps"] / stats["batches"] if stats["batches"] else 0.0
+        return stats
+
+
+queue = WriteBehindQueue()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=queue.reset)
+
+
+def change_stock(product_id, delta, staff_id, event, quantity, floor=None):
+    """stock.change_stock と同じ引数・戻り値で、キュー経由で書き込む"""
+    return queue.submit(product_id, delta, staff_id, event, quantity, floor).wait()